@@ -1,14 +1,30 @@
 """Main file for command line interface."""
 
 import logging
+import sys
+from argparse import Namespace
+from contextlib import contextmanager
+from typing import Generator
 
+from rich.console import Console
 from rich.logging import RichHandler
 
+from ibex_device_generator.exc import InvalidDeviceManifestError
 from ibex_device_generator.ibex_device_generator import (
     IBEXDeviceGenerator,
 )
+from ibex_device_generator.paths import CLIENT_SRC, EPICS
 from ibex_device_generator.utils.arg_parser import parse_arguments
+from ibex_device_generator.utils.batch import (
+    batch_results_table,
+    load_device_manifest,
+    run_batch,
+)
 from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import remove_stale_stages
+from ibex_device_generator.utils.git_utils import SubmoduleOptions
+from ibex_device_generator.utils.profiling import StepProfiler
+from ibex_device_generator.utils.trace import tracing
 
 
 def _configure_logging(level: str = logging.INFO) -> None:
@@ -20,19 +36,97 @@ def _configure_logging(level: str = logging.INFO) -> None:
     )
 
 
+@contextmanager
+def _traced(trace_path: str | None) -> Generator[None, None, None]:
+    """Trace everything within the block if a trace file is given."""
+    if trace_path is None:
+        yield
+        return
+
+    tracer = None
+    try:
+        with tracing() as tracer:
+            yield
+    finally:
+        if tracer is not None:
+            tracer.write(trace_path)
+            logging.info(f"Trace written to {trace_path}")
+
+
+def _profiler(args: Namespace) -> StepProfiler | None:
+    """Make a step profiler if profiling is requested."""
+    if args.profile is None:
+        return None
+    return StepProfiler(args.profile, memory=args.profile_memory)
+
+
+def _submodule_options(args: Namespace) -> SubmoduleOptions:
+    """Get how to clone support submodules."""
+    return SubmoduleOptions(
+        depth=args.submodule_depth,
+        filter=args.submodule_filter,
+        mirror_dir=args.mirror_dir,
+        offline=args.offline,
+    )
+
+
 def main() -> None:
     """Run cli interface."""
     args = parse_arguments()
 
     _configure_logging(level=args.log_level)
 
+    # Stages of killed runs are never published
+    remove_stale_stages(EPICS, CLIENT_SRC)
+
+    if args.command == "batch":
+        batch_main(args)
+        return
+
     device = DeviceInfo(
         args.ioc_name, args.device_name, device_count=args.device_count
     )
 
-    IBEXDeviceGenerator(
-        device, args.use_git, args.github_token, args.ticket, args.interactive
-    ).safe_run()
+    with _traced(args.trace):
+        IBEXDeviceGenerator(
+            device,
+            args.use_git,
+            args.github_token,
+            args.ticket,
+            args.interactive,
+            jobs=args.jobs,
+            dry_run=args.dry_run,
+            resume=args.resume,
+            profiler=_profiler(args),
+            submodule_options=_submodule_options(args),
+        ).safe_run()
+
+
+def batch_main(args: Namespace) -> None:
+    """Run the batch command generating all devices of a manifest."""
+    try:
+        entries = load_device_manifest(args.manifest)
+    except InvalidDeviceManifestError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    with _traced(args.trace):
+        results = run_batch(
+            entries,
+            use_git=args.use_git,
+            github_token=args.github_token,
+            interactive=args.interactive,
+            jobs=args.jobs,
+            dry_run=args.dry_run,
+            resume=args.resume,
+            profiler=_profiler(args),
+            submodule_options=_submodule_options(args),
+        )
+
+    Console().print(batch_results_table(results))
+
+    if not all(result.succeeded for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
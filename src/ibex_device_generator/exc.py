@@ -120,6 +120,17 @@ class ReassignPlaceholderError(IBEXDeviceGeneratorError):
         )
 
 
+class InvalidDeviceManifestError(IBEXDeviceGeneratorError):
+    """Indicate that a device manifest for batch generation is invalid."""
+
+    def __init__(self, path: str, msg: str) -> None:
+        self.path = path
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return "Invalid device manifest '%s': %s" % (self.path, self.msg)
+
+
 # Git related
 
 
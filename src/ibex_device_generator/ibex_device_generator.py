@@ -1,29 +1,53 @@
 """Main file."""
 
 import logging
+import os
+from contextlib import nullcontext
 
 from rich.prompt import Confirm
 
 from ibex_device_generator.exc import IBEXDeviceGeneratorError
-from ibex_device_generator.paths import CLIENT, EPICS, IOC_ROOT
+from ibex_device_generator.paths import (
+    CLIENT,
+    EPICS,
+    EPICS_SUPPORT,
+    IOC_ROOT,
+    OPI_RESOURCES,
+)
 from ibex_device_generator.utils.device_info import DeviceInfo
-from ibex_device_generator.utils.git_utils import commit_changes
+from ibex_device_generator.utils.file_system import (
+    FileChanges,
+    in_memory_output,
+)
+from ibex_device_generator.utils.git_utils import (
+    SubmoduleOptions,
+    commit_changes,
+)
 from ibex_device_generator.utils.github import (
     create_github_repository,
     grant_permissions_for_github_repository,
 )
+from ibex_device_generator.utils.gui import OPI_INFO
+from ibex_device_generator.utils.journal import StepJournal
 from ibex_device_generator.utils.placeholders import (
     DEVICE_NAME,
+    IOC_PATH,
     SUPPORT_MASTER_PATH,
+    SUPPORT_PATH,
 )
+from ibex_device_generator.utils.profiling import StepProfiler
+from ibex_device_generator.utils.scheduler import Step, run_concurrently
 from ibex_device_generator.utils.step import (
     add_lewis_emulator,
     add_opi_to_gui,
+    add_opis_to_opi_info,
     add_test_framework,
     create_ioc_from_template,
     create_submodule,
     create_submodule_structure,
+    log_file_changes,
 )
+from ibex_device_generator.utils.trace import span
 
 
 class IBEXDeviceGenerator:
@@ -37,8 +61,22 @@ class IBEXDeviceGenerator:
         ticket_num: int,
         interactive: bool = True,
         retry: bool = True,
+        jobs: int = 1,
+        dry_run: bool = False,
+        resume: bool = False,
+        profiler: StepProfiler | None = None,
+        submodule_options: SubmoduleOptions | None = None,
+        add_opi_info: bool = True,
     ) -> None:
-        """Create a device generator instance."""
+        """Create a device generator instance.
+
+        Completed steps are recorded in a journal, unless in a dry run. When
+        resuming, the steps a previous run completed are skipped if their
+        outputs still exist. With a profiler every step is profiled. The
+        support submodule is cloned with the submodule options, offline
+        GitHub is not used. Without add OPI info the OPI is not added to
+        opi_info.xml, e.g. to add the OPIs of many devices at once.
+        """
         device_name_underscores = device[DEVICE_NAME].replace(" ", "_")
         ticket_branch = f"Ticket{ticket_num}_Add_IOC_{device_name_underscores}"
 
@@ -49,6 +87,15 @@ class IBEXDeviceGenerator:
         self.ticket_branch = ticket_branch
         self.interactive = interactive
         self.retry = retry
+        self.jobs = jobs
+        self.dry_run = dry_run
+        self.resume = resume
+        self.profiler = profiler
+        self.submodule_options = submodule_options or SubmoduleOptions()
+        self.add_opi_info = add_opi_info
+        self.journal = (
+            None if dry_run else StepJournal(device, ticket_num, resume)
+        )
 
     def safe_run(self) -> None:
         """."""
@@ -57,66 +104,196 @@ class IBEXDeviceGenerator:
         except IBEXDeviceGeneratorError:
             logging.info("The last failed.")
 
-    def run(self) -> None:
-        """Run the generator."""
+    def run(self, steps: list[Step] | None = None) -> None:
+        """Run the generator.
+
+        In a dry run every file is written into memory instead of the disk,
+        git, make and GitHub are not used and the changes that would be made
+        are printed at the end.
+
+        Args:
+            steps: the steps to run, all steps of the generator by default
+
+        """
+        if steps is None:
+            steps = self.steps()
+
+        if not self.dry_run:
+            self.run_steps(steps)
+            return
+
+        with in_memory_output() as overlay:
+            self.run_steps(steps)
+
+        logging.info(
+            "[bold]Dry run finished, no files were written.",
+            extra={"markup": True},
+        )
+        log_file_changes(overlay.changes())
+
+        diff = overlay.diff()
+        if diff:
+            logging.info(
+                f"Diff of modified files:\n{diff}",
+                extra={"highlighter": None},
+            )
+
+    def run_steps(self, steps: list[Step]) -> None:
+        """Run steps of the generator.
+
+        Interactively or when profiling, the steps run one after the other
+        in the order they are listed. Otherwise independent steps run
+        concurrently.
+        """
+        # Profilers measure one step at a time
+        if self.interactive or self.profiler is not None:
+            for step in steps:
+                self.run_step(step)
+        else:
+            run_concurrently(steps, self.run_step)
+
+    def steps(self) -> list[Step]:
+        """Get all steps of the generator in the order they are listed."""
         # Generator steps below
+        steps = []
 
-        self.add_step(
-            None,
-            "Create GitHub repository",
-            create_github_repository,
-            self.device,
-            self.github_token,
+        if not self.dry_run and not self.submodule_options.offline:
+            steps.append(
+                Step(
+                    "Create GitHub repository",
+                    None,
+                    create_github_repository,
+                    (self.device, self.github_token),
+                )
+            )
+
+            steps.append(
+                Step(
+                    "Grant permissions for GitHub repository",
+                    None,
+                    grant_permissions_for_github_repository,
+                    (self.device, self.github_token),
+                    after=(create_github_repository,),
+                )
+            )
+
+        # The submodule is cloned from the new GitHub repository
+        steps.append(
+            Step(
+                "Add support submodule to EPICS",
+                EPICS,
+                create_submodule,
+                (self.device,),
+                {
+                    "jobs": self.jobs,
+                    "dry_run": self.dry_run,
+                    "submodule_options": self.submodule_options,
+                },
+                after=(create_github_repository,),
+                outputs=(
+                    self.device[SUPPORT_PATH],
+                    os.path.join(EPICS_SUPPORT, "Makefile"),
+                    os.path.join(EPICS, ".gitmodules"),
+                ),
+            )
         )
 
-        self.add_step(
-            None,
-            "Grant permissions for GitHub repository",
-            grant_permissions_for_github_repository,
-            self.device,
-            self.github_token,
+        steps.append(
+            Step(
+                "Add template file structure in support submodule",
+                self.device[SUPPORT_MASTER_PATH],
+                create_submodule_structure,
+                (self.device,),
+                {"jobs": self.jobs, "dry_run": self.dry_run},
+                after=(create_submodule,),
+                generated_only=True,
+            )
         )
 
-        self.add_step(
-            EPICS,
-            "Add support submodule to EPICS",
-            create_submodule,
-            self.device,
+        # The IOC is built against the support module
+        steps.append(
+            Step(
+                "Add template IOC",
+                IOC_ROOT,
+                create_ioc_from_template,
+                (self.device,),
+                {"jobs": self.jobs, "dry_run": self.dry_run},
+                after=(create_submodule_structure,),
+                outputs=(
+                    self.device[IOC_PATH],
+                    os.path.join(IOC_ROOT, "Makefile"),
+                ),
+            )
         )
 
-        self.add_step(
-            self.device[SUPPORT_MASTER_PATH],
-            "Add template file structure in support submodule",
-            create_submodule_structure,
-            self.device,
+        steps.append(
+            Step(
+                "Add device to test framework",
+                self.device[SUPPORT_MASTER_PATH],
+                add_test_framework,
+                (self.device,),
+                {"jobs": self.jobs},
+                generated_only=True,
+            )
         )
 
-        self.add_step(
-            IOC_ROOT,
-            "Add template IOC",
-            create_ioc_from_template,
-            self.device,
+        steps.append(
+            Step(
+                "Add Lewis emulator",
+                self.device[SUPPORT_MASTER_PATH],
+                add_lewis_emulator,
+                (self.device,),
+                {"jobs": self.jobs},
+                generated_only=True,
+            )
         )
 
-        self.add_step(
-            self.device[SUPPORT_MASTER_PATH],
-            "Add device to test framework",
-            add_test_framework,
-            self.device,
+        steps.append(
+            Step(
+                "Add OPI to gui",
+                CLIENT,
+                add_opi_to_gui,
+                (self.device,),
+                {"jobs": self.jobs, "add_opi_info": self.add_opi_info},
+                outputs=(OPI_RESOURCES,),
+            )
         )
 
-        self.add_step(
-            self.device[SUPPORT_MASTER_PATH],
-            "Add Lewis emulator",
-            add_lewis_emulator,
-            self.device,
+        return steps
+
+    def repo_paths(self) -> list[str]:
+        """Get the repositories the steps of the generator commit in."""
+        return list(
+            dict.fromkeys(
+                step.repo_path for step in self.steps() if step.repo_path
+            )
         )
 
-        self.add_step(
+    def opi_info_step(self, devices: list[DeviceInfo]) -> Step:
+        """Get a step adding the OPIs of many devices to opi_info.xml.
+
+        The entries are written at once. As the step is committed on the
+        ticket branch of this generator, it is only meant for runs without
+        git.
+        """
+        return Step(
+            "Add OPIs to opi_info.xml",
             CLIENT,
-            "Add OPI to gui",
-            add_opi_to_gui,
-            self.device,
+            add_opis_to_opi_info,
+            (devices,),
+            outputs=(OPI_INFO,),
+        )
+
+    def run_step(self, step: Step) -> None:
+        """Run a single generator step."""
+        self.add_step(
+            step.repo_path,
+            step.name,
+            step.action,
+            *step.args,
+            outputs=step.outputs,
+            generated_only=step.generated_only,
+            **step.kwargs,
         )
 
     def add_step(
@@ -125,6 +302,8 @@ class IBEXDeviceGenerator:
         commit_msg: str,
         action: callable,
         *args,
+        outputs: tuple[str, ...] = (),
+        generated_only: bool = False,
         **kwargs,
     ) -> None:
         """Add a generator step.
@@ -137,9 +316,19 @@ class IBEXDeviceGenerator:
             commit_msg: the commit message
             action: the function to execute as this step
             *args: any positional arguments for the action
+            outputs: the paths the action writes to in the repository
+            generated_only: whether the action only writes generated files,
+                which are then committed with git plumbing commands
             **kwargs: any keywoprd arguments for the action
 
         """
+        if self.journal is not None and self.journal.is_complete(commit_msg):
+            logging.info(
+                f"Skipping '{commit_msg}', a previous run completed it.",
+                extra={"highlighter": None},
+            )
+            return
+
         if self.interactive and not Confirm.ask(
             f"Do '{commit_msg}'?", default="y"
         ):
@@ -149,18 +338,44 @@ class IBEXDeviceGenerator:
             return
 
         try:
-            if self.use_git and repo_path and commit_msg:
-                logging.info(
-                    f"Running '{commit_msg}' with git...",
-                    extra={"highlighter": None},
-                )
-                with commit_changes(repo_path, self.ticket_branch, commit_msg):
-                    action(*args, **kwargs)
-            else:
-                logging.info(
-                    f"Running '{commit_msg}'...", extra={"highlighter": None}
-                )
-                action(*args, **kwargs)
+            profile = (
+                self.profiler.profile(commit_msg)
+                if self.profiler is not None
+                else nullcontext()
+            )
+            with span(commit_msg, "step", repo=repo_path), profile:
+                if (
+                    self.use_git
+                    and not self.dry_run
+                    and repo_path
+                    and commit_msg
+                ):
+                    logging.info(
+                        f"Running '{commit_msg}' with git...",
+                        extra={"highlighter": None},
+                    )
+                    # Only the files written by the step are committed
+                    changes = FileChanges()
+                    with commit_changes(
+                        repo_path,
+                        self.ticket_branch,
+                        commit_msg,
+                        outputs,
+                        changes,
+                        plumbing=generated_only,
+                    ) as repo:
+                        changes.extend(action(*args, **kwargs))
+                    commit = repo.head.commit.hexsha
+                else:
+                    logging.info(
+                        f"Running '{commit_msg}'...",
+                        extra={"highlighter": None},
+                    )
+                    changes = action(*args, **kwargs)
+                    commit = None
+
+            if self.journal is not None:
+                self.journal.record(commit_msg, repo_path, changes, commit)
 
             logging.info(
                 ":white_check_mark: [bold green]Successfully executed step.",
@@ -175,9 +390,19 @@ class IBEXDeviceGenerator:
 
             if self.interactive and self.retry:
                 logging.info("Retrying...")
-                self.add_step(repo_path, commit_msg, action, *args, **kwargs)
+                self.add_step(
+                    repo_path,
+                    commit_msg,
+                    action,
+                    *args,
+                    outputs=outputs,
+                    generated_only=generated_only,
+                    **kwargs,
+                )
             else:
-                raise IBEXDeviceGeneratorError("Failed.")
+                raise IBEXDeviceGeneratorError(
+                    f"Failed to '{commit_msg}': {e}"
+                ) from e
 
         except Exception as e:
             logging.exception(
@@ -1,9 +1,16 @@
 """Standard system paths used in the IBEX distribution."""
 
 from os import getenv
-from os.path import abspath, dirname, join
+from os.path import abspath, dirname, expanduser, join
 
 PROJECT_ROOT = join(dirname(abspath(__file__)))
+TEMPLATES_DIR = join(PROJECT_ROOT, "templates")
+
+# Caches derived from the instrument trees, kept outside of them
+CACHE_DIR = getenv(
+    "IBEX_DEVICE_GENERATOR_CACHE",
+    join(expanduser("~"), ".ibex_device_generator"),
+)
 
 INSTRUMENT = join("C:\\", "Instrument")
 EPICS = getenv("EPICS_KIT_ROOT", join(INSTRUMENT, "Apps", "EPICS"))
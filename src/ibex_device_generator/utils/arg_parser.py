@@ -1,7 +1,10 @@
 """Parse command line arguments."""
 
 import argparse
-from argparse import ArgumentTypeError, Namespace
+import os
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from typing import Sequence
 
 from ibex_device_generator.exc import (
     InvalidDeviceCountError,
@@ -17,16 +20,91 @@ from ibex_device_generator.utils.device_info import (
 from ibex_device_generator.utils.github import (
     does_github_issue_exist_and_is_open,
 )
+from ibex_device_generator.utils.gui import (
+    OPI_INFO,
+    DuplicateOPIKeyError,
+    is_opi_key_taken,
+)
+
+COMMANDS = ("generate", "batch")
+
 
+def parse_arguments(argv: Sequence[str] | None = None) -> Namespace:
+    """Parse cli arguments.
+
+    The command run is set as `command`. Without a command the generate
+    command is run, so a device is generated by giving its IOC name and
+    ticket only.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if _command_of(argv) not in (None, *COMMANDS):
+        argv.insert(0, "generate")
 
-def parse_arguments() -> Namespace:
-    """Parse cli arguments."""
     parser = argparse.ArgumentParser(
+        prog="ibex_device_generator",
         description=(
             "IBEX Device IOC Generator. "
             "Generate boilerplate code for IBEX device support."
         ),
     )
+    _add_generator_arguments(parser)
+    commands = parser.add_subparsers(
+        dest="command",
+        required=True,
+        metavar="{generate,batch}",
+        help="Run 'ibex_device_generator <command> -h' for its arguments.",
+    )
+
+    generate_parser = commands.add_parser(
+        "generate",
+        help="Generate a device, the default command.",
+        description=(
+            "Generate boilerplate code for IBEX device support. The command "
+            "name can be left out."
+        ),
+    )
+    _add_device_arguments(generate_parser)
+    _add_generator_arguments(generate_parser, defaults=False)
+
+    batch_parser = commands.add_parser(
+        "batch",
+        help="Generate many devices from a manifest file.",
+        description=(
+            "Generate boilerplate code for many IBEX devices in one go. "
+            "Devices are read from a JSON, CSV or YAML manifest listing "
+            "ioc_name, ticket and optionally device_name and device_count "
+            "of each device."
+        ),
+    )
+    batch_parser.add_argument(
+        "manifest",
+        type=str,
+        help="Path to the device manifest file.",
+    )
+    _add_generator_arguments(batch_parser, defaults=False)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        _check_device_arguments(generate_parser, args)
+
+    return args
+
+
+def _command_of(argv: list[str]) -> str | None:
+    """Get the command, the first positional argument, if there is one."""
+    parser = argparse.ArgumentParser(
+        prog="ibex_device_generator", add_help=False
+    )
+    _add_device_options(parser)
+    _add_generator_arguments(parser)
+    parser.add_argument("command", nargs="?")
+    args, _ = parser.parse_known_args(argv)
+    return args.command
+
+
+def _add_device_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments of a device to generate."""
     parser.add_argument(
         "ioc_name",
         type=ioc_name_checker,
@@ -37,10 +115,13 @@ def parse_arguments() -> Namespace:
     )
     parser.add_argument(
         "ticket",
-        type=ticket_number_checker,
+        type=int,
         help="GitHub issue 'ticket' number within our development workflow.",
     )
+    _add_device_options(parser)
+
 
+def _add_device_options(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--device_name",
         type=device_name_checker,
@@ -56,6 +137,41 @@ def parse_arguments() -> Namespace:
         help="Number of duplicate device IOCs to generate.",
         default=DeviceInfo.default_device_count,
     )
+
+
+def _check_device_arguments(parser: ArgumentParser, args: Namespace) -> None:
+    """Check the device arguments against GitHub and opi_info.xml."""
+    if not args.device_name:
+        args.device_name = args.ioc_name
+
+    # Checked after parsing so the request can use the token
+    if not args.offline and not args.dry_run:
+        try:
+            ticket_number_checker(args.ticket, args.github_token)
+        except ArgumentTypeError as e:
+            parser.error(f"argument ticket: {e}")
+
+    # A resumed run may have added the OPI already
+    if not args.resume:
+        try:
+            opi_key_checker(args.ioc_name)
+        except ArgumentTypeError as e:
+            parser.error(f"argument ioc_name: {e}")
+
+
+def _add_generator_arguments(
+    parser: ArgumentParser, defaults: bool = True
+) -> None:
+    """Add options shared by all commands running the generator.
+
+    The options can be given before and after the command. Without defaults
+    an option is only set if it is given, so the parser of a command does
+    not override the options given before the command.
+    """
+
+    def default(value: object) -> object:
+        return value if defaults else argparse.SUPPRESS
+
     parser.add_argument(
         "--use_git",
         action="store_true",
@@ -64,6 +180,7 @@ def parse_arguments() -> Namespace:
             "at every step. The script will abort if the git status is "
             "dirty at the respective repositories."
         ),
+        default=default(False),
     )
     parser.add_argument(
         "--github_token",
@@ -72,28 +189,114 @@ def parse_arguments() -> Namespace:
             'GitHub token with "repo" scope. '
             "Use to create support repository."
         ),
+        default=default(None),
     )
     parser.add_argument(
         "--log_level",
         type=str,
         help="Logging level.",
         choices=["DEBUG", "INFO", "WARN", "ERROR"],
-        default="INFO",
+        default=default("INFO"),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=jobs_checker,
+        help="Number of files to write concurrently from templates.",
+        default=default(1),
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help=(
+            "Write all files into memory and print what would change instead "
+            "of modifying the disk. Git, make and GitHub are not used."
+        ),
+        default=default(False),
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        metavar="FILE",
+        help=(
+            "Write the time spent in each step and the I/O it made to FILE "
+            "in the Chrome trace event format, e.g. to load it in Perfetto."
+        ),
+        default=default(None),
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="DIR",
+        help=(
+            "Profile each step with cProfile, write its statistics to a "
+            ".pstats file in DIR and print its hotspots. Steps run one "
+            "after the other."
+        ),
+        default=default(None),
+    )
+    parser.add_argument(
+        "--profile_memory",
+        action="store_true",
+        help="Also trace memory allocations of each step when profiling.",
+        default=default(False),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Skip the steps completed by a previous run for the same ticket "
+            "and device if their files and commits still exist."
+        ),
+        default=default(False),
+    )
+    parser.add_argument(
+        "--submodule_depth",
+        type=depth_checker,
+        metavar="DEPTH",
+        help="Clone only the last DEPTH commits of the support submodule.",
+        default=default(None),
+    )
+    parser.add_argument(
+        "--submodule_filter",
+        type=str,
+        metavar="FILTER",
+        help=(
+            "Clone the support submodule partially with a git filter, e.g. "
+            "blob:none to download file contents when they are needed."
+        ),
+        default=default(None),
+    )
+    parser.add_argument(
+        "--mirror_dir",
+        type=str,
+        metavar="DIR",
+        help=(
+            "Directory of local bare mirrors of repositories, e.g. "
+            "EPICS-device.git. The objects of an existing mirror are used "
+            "when cloning the support submodule. Defaults to a directory in "
+            "the cache."
+        ),
+        default=default(None),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help=(
+            "Do not use GitHub. The support submodule is cloned from its "
+            "mirror, which is made with an empty commit if it does not "
+            "exist, and the GitHub repository and ticket are not checked "
+            "or made."
+        ),
+        default=default(False),
     )
     parser.add_argument(
         "-i",
         "--interactive",
         action="store_true",
         help="Ask the user to confirm each step before executing.",
+        default=default(False),
     )
 
-    args = parser.parse_args()
-
-    if not args.device_name:
-        args.device_name = args.ioc_name
-
-    return args
-
 
 # Input checkers
 
@@ -105,6 +308,14 @@ def ioc_name_checker(ioc_name: str) -> str:
     return ioc_name
 
 
+def opi_key_checker(ioc_name: str) -> str:
+    """Check that the OPI key of a new IOC is not taken."""
+    # The IOC name is used as the OPI key of the device
+    if os.path.isfile(OPI_INFO) and is_opi_key_taken(ioc_name):
+        raise ArgumentTypeError(str(DuplicateOPIKeyError(ioc_name)))
+    return ioc_name
+
+
 def device_name_checker(device_name: str) -> str:
     """Check device name validity."""
     if not is_valid_device_name(device_name):
@@ -120,10 +331,28 @@ def device_count_checker(val: str) -> int:
     return count
 
 
-def ticket_number_checker(val: str) -> int:
+def jobs_checker(val: str) -> int:
+    """Check number of jobs validity."""
+    jobs = int(val)
+    if jobs < 1:
+        raise ArgumentTypeError(f"'{jobs}' is an invalid number of jobs.")
+    return jobs
+
+
+def depth_checker(val: str) -> int:
+    """Check clone depth validity."""
+    depth = int(val)
+    if depth < 1:
+        raise ArgumentTypeError(f"'{depth}' is an invalid clone depth.")
+    return depth
+
+
+def ticket_number_checker(
+    val: str | int, github_token: str | None = None
+) -> int:
     """Check ticket number validity."""
     ticket_number = int(val)
-    if not does_github_issue_exist_and_is_open(ticket_number):
+    if not does_github_issue_exist_and_is_open(ticket_number, github_token):
         raise ArgumentTypeError(
             f"GitHub issue {ticket_number} is closed or does not exist."
         )
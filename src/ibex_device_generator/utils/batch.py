@@ -0,0 +1,309 @@
+"""Generate many devices listed in a manifest within a single process."""
+
+import csv
+import json
+import logging
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from typing import Any
+
+from rich.table import Table
+
+from ibex_device_generator.exc import (
+    IBEXDeviceGeneratorError,
+    InvalidDeviceManifestError,
+)
+from ibex_device_generator.ibex_device_generator import IBEXDeviceGenerator
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.git_utils import restoring_branches
+from ibex_device_generator.utils.github import (
+    does_github_issue_exist_and_is_open,
+)
+from ibex_device_generator.utils.gui import (
+    OPI_INFO,
+    DuplicateOPIKeyError,
+    get_opi_keys,
+)
+from ibex_device_generator.utils.trace import span
+
+
+@dataclass(frozen=True)
+class BatchEntry:
+    """A device to generate as listed in the manifest."""
+
+    ioc_name: str
+    ticket: int
+    device_name: str
+    device_count: int = DeviceInfo.default_device_count
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    """Outcome of generating a device."""
+
+    entry: BatchEntry
+    succeeded: bool
+    message: str
+    duration: float
+    """ Time taken to generate the device in seconds """
+
+
+def load_device_manifest(path: str) -> list[BatchEntry]:
+    """Load the devices to generate from a JSON, CSV or YAML manifest.
+
+    JSON and YAML manifests contain a list of devices, either at the top level
+    or under a 'devices' key. CSV manifests have a header row naming the
+    columns. Each device has an ioc_name and ticket and optionally a
+    device_name and device_count.
+
+    Args:
+        path: path to the manifest file
+
+    Returns:
+        The devices in the order they are listed.
+
+    Raises:
+        InvalidDeviceManifestError: if the manifest cannot be read.
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    try:
+        with open(path, newline="") as f:
+            if extension == ".json":
+                rows = json.load(f)
+            elif extension == ".csv":
+                rows = list(csv.DictReader(f))
+            elif extension in (".yaml", ".yml"):
+                rows = _load_yaml(path, f)
+            else:
+                raise InvalidDeviceManifestError(
+                    path, f"unsupported file type '{extension}'."
+                )
+    except (OSError, ValueError) as e:
+        raise InvalidDeviceManifestError(path, str(e))
+
+    if isinstance(rows, dict):
+        rows = rows.get("devices")
+
+    if not isinstance(rows, list):
+        raise InvalidDeviceManifestError(path, "expected a list of devices.")
+
+    return [
+        _entry_from_row(path, number, row)
+        for number, row in enumerate(rows, 1)
+    ]
+
+
+def _load_yaml(path: str, stream: Any) -> Any:
+    try:
+        import yaml
+    except ImportError:
+        raise InvalidDeviceManifestError(
+            path, "reading YAML manifests requires PyYAML to be installed."
+        )
+
+    try:
+        return yaml.safe_load(stream)
+    except yaml.YAMLError as e:
+        raise InvalidDeviceManifestError(path, str(e))
+
+
+def _entry_from_row(path: str, number: int, row: Any) -> BatchEntry:
+    if not isinstance(row, dict):
+        raise InvalidDeviceManifestError(
+            path, f"device {number} is not a mapping."
+        )
+
+    try:
+        ioc_name = str(row["ioc_name"])
+        ticket = int(row["ticket"])
+        device_name = str(row.get("device_name") or ioc_name)
+        device_count = int(
+            row.get("device_count") or DeviceInfo.default_device_count
+        )
+    except KeyError as e:
+        raise InvalidDeviceManifestError(
+            path, f"device {number} is missing {e}."
+        )
+    except (TypeError, ValueError) as e:
+        raise InvalidDeviceManifestError(
+            path, f"device {number} has an invalid value: {e}"
+        )
+
+    return BatchEntry(ioc_name, ticket, device_name, device_count)
+
+
+def run_batch(entries: list[BatchEntry], **kwargs: Any) -> list[BatchResult]:
+    """Generate every device in turn, carrying on when one fails.
+
+    All devices are generated in this process, so caches such as compiled
+    templates are shared between them. The OPI keys of all devices are
+    checked before any device is generated, unless resuming.
+
+    With git every device is committed on its own ticket branch, including
+    its opi_info.xml entry, and the repositories are switched back to their
+    branches after each device. Otherwise the OPIs of the generated devices
+    are added to opi_info.xml in one step at the end.
+
+    Args:
+        entries: the devices to generate
+        **kwargs: options passed to each `IBEXDeviceGenerator`
+
+    Returns:
+        The result of each device in the order of the entries.
+
+    """
+    options = kwargs.get("submodule_options")
+    dry_run = kwargs.get("dry_run", False)
+    # GitHub is not used in a dry run either
+    offline = (options is not None and options.offline) or dry_run
+    # Git is not used in a dry run
+    use_git = kwargs.get("use_git", False) and not dry_run
+    opi_key_errors = (
+        [None] * len(entries)
+        if kwargs.get("resume", False)
+        else find_duplicate_opi_keys(entries)
+    )
+
+    results = []
+    generated = []
+    for entry, opi_key_error in zip(entries, opi_key_errors):
+        if opi_key_error is not None:
+            results.append(BatchResult(entry, False, str(opi_key_error), 0))
+            continue
+
+        logging.info(
+            f"[bold]Generating {entry.ioc_name} ({entry.device_name})",
+            extra={"markup": True, "highlighter": None},
+        )
+        start = time.perf_counter()
+
+        try:
+            with span(f"Generate {entry.ioc_name}", "device"):
+                if not offline and not does_github_issue_exist_and_is_open(
+                    entry.ticket, kwargs.get("github_token")
+                ):
+                    raise IBEXDeviceGeneratorError(
+                        f"GitHub issue {entry.ticket} is closed or does not"
+                        " exist."
+                    )
+
+                device = DeviceInfo(
+                    entry.ioc_name,
+                    entry.device_name,
+                    device_count=entry.device_count,
+                )
+                generator = IBEXDeviceGenerator(
+                    device,
+                    ticket_num=entry.ticket,
+                    add_opi_info=use_git,
+                    **kwargs,
+                )
+                with (
+                    restoring_branches(generator.repo_paths())
+                    if use_git
+                    else nullcontext()
+                ):
+                    generator.run()
+            succeeded, message = True, "Generated"
+            generated.append((len(results), generator))
+        except IBEXDeviceGeneratorError as e:
+            succeeded, message = False, str(e)
+        except Exception as e:
+            logging.exception(e)
+            succeeded, message = False, f"Unexpected error: {e}"
+
+        results.append(
+            BatchResult(entry, succeeded, message, time.perf_counter() - start)
+        )
+
+    if generated and not use_git:
+        _add_opis_to_opi_info(results, generated)
+    return results
+
+
+def find_duplicate_opi_keys(
+    entries: list[BatchEntry],
+) -> list[DuplicateOPIKeyError | None]:
+    """Find the devices whose OPI key is already taken.
+
+    A key is taken if it is in opi_info.xml or used by an earlier device.
+
+    Args:
+        entries: the devices to generate
+
+    Returns:
+        For each device, an error if its OPI key is taken or None.
+
+    """
+    opi_keys = get_opi_keys(OPI_INFO) if os.path.isfile(OPI_INFO) else set()
+
+    errors = []
+    for entry in entries:
+        # The IOC name is used as the OPI key of the device
+        if entry.ioc_name in opi_keys:
+            errors.append(DuplicateOPIKeyError(entry.ioc_name))
+        else:
+            errors.append(None)
+            opi_keys.add(entry.ioc_name)
+    return errors
+
+
+def _add_opis_to_opi_info(
+    results: list[BatchResult],
+    generated: list[tuple[int, IBEXDeviceGenerator]],
+) -> None:
+    """Add the OPIs of the generated devices, failing them if this fails."""
+    last_generator = generated[-1][1]
+    step = last_generator.opi_info_step(
+        [generator.device for _, generator in generated]
+    )
+    start = time.perf_counter()
+
+    try:
+        with span(step.name, "device"):
+            last_generator.run([step])
+        return
+    except IBEXDeviceGeneratorError as e:
+        message = f"Failed to add OPI to opi_info.xml: {e}"
+    except Exception as e:
+        logging.exception(e)
+        message = f"Unexpected error adding OPI to opi_info.xml: {e}"
+
+    duration = time.perf_counter() - start
+    for index, _ in generated:
+        results[index] = replace(
+            results[index],
+            succeeded=False,
+            message=message,
+            duration=results[index].duration + duration,
+        )
+
+
+def batch_results_table(results: list[BatchResult]) -> Table:
+    """Summarise the results of a batch in a table."""
+    table = Table(title="Batch generation results")
+    table.add_column("IOC")
+    table.add_column("Device")
+    table.add_column("Count", justify="right")
+    table.add_column("Ticket", justify="right")
+    table.add_column("Result")
+    table.add_column("Time", justify="right")
+
+    for result in results:
+        table.add_row(
+            result.entry.ioc_name,
+            result.entry.device_name,
+            str(result.entry.device_count),
+            str(result.entry.ticket),
+            (
+                f"[green]{result.message}"
+                if result.succeeded
+                else f"[red]{result.message}"
+            ),
+            f"{result.duration:.1f}s",
+        )
+    return table
@@ -7,6 +7,7 @@ from os import PathLike, devnull
 from typing import Sequence, TypeAlias
 
 from ibex_device_generator.exc import CommandNotFoundError
+from ibex_device_generator.utils.trace import count_subprocess, span
 
 StrOrBytesPath: TypeAlias = str | bytes | PathLike[str] | PathLike[bytes]
 
@@ -27,15 +28,17 @@ def run_command(
     logging.info(
         "Running command {} from {}".format(" ".join(command), working_dir)
     )
-    with open(devnull, "w") as null_out:
-        cmd = subprocess.Popen(
-            command,
-            cwd=working_dir,
-            stdout=null_out,
-            stderr=subprocess.STDOUT,
-            stdin=subprocess.PIPE,
-        )
-    return cmd.wait()
+    with span("run_command", "subprocess", command=str(command)):
+        count_subprocess()
+        with open(devnull, "w") as null_out:
+            cmd = subprocess.Popen(
+                command,
+                cwd=working_dir,
+                stdout=null_out,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.PIPE,
+            )
+        return cmd.wait()
 
 
 def run_make_command_in(dir: PathLike) -> int:
@@ -1,16 +1,634 @@
 """Utilities for interacting with the file system."""
 
+import difflib
+import hashlib
+import locale
 import logging
+import os
+import re
+import shutil
+import socket
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import Enum
+from importlib.abc import Traversable
+from os import PathLike
 from os.path import join
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Generator, Iterable
 
+from ibex_device_generator.utils.locks import FileLock, is_process_running
+from ibex_device_generator.utils.trace import count_file_written
 
-def _add_entry_to_list(text: str, list_name: str, entry: str) -> str:
-    """Add entry to prefixed list in llist of strings.
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+_STAGE_PREFIX = ".ibex_device_generator-stage-"
+
+
+class FileStatus(Enum):
+    """What happened to a file when it was written."""
+
+    ADDED = "added"
+    MODIFIED = "modified"
+    UNCHANGED = "unchanged"
+
+
+@dataclass
+class FileChanges:
+    """Files added, modified or left unchanged, in the order of writing."""
+
+    added: list[PathLike] = field(default_factory=list)
+    modified: list[PathLike] = field(default_factory=list)
+    unchanged: list[PathLike] = field(default_factory=list)
+
+    def record(self, path: PathLike, status: FileStatus) -> None:
+        """Record the status of a written file."""
+        getattr(self, status.value).append(path)
+
+    def extend(self, other: "FileChanges") -> None:
+        """Record all files from other changes."""
+        self.added.extend(other.added)
+        self.modified.extend(other.modified)
+        self.unchanged.extend(other.unchanged)
+
+
+def encode_text(text: str) -> bytes:
+    """Encode text as it would be written by a file opened in text mode."""
+    if os.linesep != "\n":
+        text = text.replace("\n", os.linesep)
+    return text.encode(locale.getpreferredencoding(False))
+
+
+def hash_file(path: PathLike) -> str:
+    """Get the sha256 hash of a file's content."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class _Overlay(ABC):
+    """Redirects reads and writes of files under a root away from the disk."""
+
+    def __init__(self, root: PathLike | None) -> None:
+        """Make an overlay for a root directory, None covers all files."""
+        self.root = os.path.abspath(root) if root is not None else None
+
+    def covers(self, path: PathLike) -> bool:
+        """Check whether the overlay is responsible for a path."""
+        if self.root is None:
+            return True
+        path = os.path.abspath(path)
+        try:
+            return os.path.commonpath([self.root, path]) == self.root
+        except ValueError:
+            # Paths are on different drives
+            return False
+
+    @abstractmethod
+    def read(self, path: PathLike) -> bytes | None:
+        """Get the content written to a file or None if it was not written."""
+
+    @abstractmethod
+    def write(self, path: PathLike, content: bytes) -> None:
+        """Write content to a file in the overlay."""
+
+    def disk_path(self, path: PathLike) -> str | None:
+        """Get where the overlay keeps a file on the disk, if it does."""
+        return None
+
+    def makedirs(self, path: PathLike) -> None:
+        """Create a directory in the overlay."""
+
+
+class StagedOutput(_Overlay):
+    """Staging directory collecting all writes under a root directory.
+
+    The staging directory is created next to the outermost repository
+    containing the root, so it is on the same file system and publishing is
+    done by renaming, but git never sees it. Its name records the host and
+    process making it, so stages left by a killed process can be removed.
+    """
+
+    def __init__(self, root: PathLike) -> None:
+        """Create an empty staging directory for a root directory."""
+        super().__init__(root)
+        self.path = tempfile.mkdtemp(
+            prefix=f"{_STAGE_PREFIX}{socket.gethostname()}-{os.getpid()}-",
+            dir=_stage_dir(self.root),
+        )
+        self._locks: list[FileLock] = []
+
+    def hold(self, lock: FileLock) -> None:
+        """Keep a lock until the staged files are published or discarded."""
+        self._locks.append(lock)
+
+    def disk_path(self, path: PathLike) -> str:
+        """Get the path of a file in the staging directory."""
+        return os.path.join(
+            self.path, os.path.relpath(os.path.abspath(path), self.root)
+        )
+
+    def read(self, path: PathLike) -> bytes | None:
+        """Get the content of a staged file or None if it is not staged."""
+        try:
+            with open(self.disk_path(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path: PathLike, content: bytes) -> None:
+        """Write a file into the staging directory.
+
+        A file replacing an existing one gets its mode, as publishing renames
+        the staged file over it.
+        """
+        staged_path = self.disk_path(path)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        with open(staged_path, "wb") as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, staged_path)
+
+    def makedirs(self, path: PathLike) -> None:
+        """Create a directory in the staging directory."""
+        os.makedirs(self.disk_path(path), exist_ok=True)
+
+    def publish(self) -> None:
+        """Move the staged files into the root directory.
+
+        New directories are moved as a whole and existing files are
+        atomically replaced.
+        """
+        _publish_dir(self.path, self.root)
+        self.discard()
+
+    def discard(self) -> None:
+        """Delete the staging directory and release the held locks."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        while self._locks:
+            self._locks.pop().release()
+
+
+def _stage_dir(root: str) -> str:
+    """Get the directory to stage writes under a root in.
+
+    This is the parent of the outermost repository containing the root, or
+    of the root itself if it is not in a repository.
+    """
+    outermost = root
+    directory = root
+    while True:
+        if os.path.exists(os.path.join(directory, ".git")):
+            outermost = directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return os.path.dirname(outermost)
+        directory = parent
+
+
+def remove_stale_stages(*roots: PathLike) -> None:
+    """Remove staging directories left by generator processes that died.
+
+    Args:
+        *roots: the directories whose writes are staged
+
+    """
+    host = socket.gethostname()
+    for stage_dir in {_stage_dir(os.path.abspath(root)) for root in roots}:
+        try:
+            entries = list(os.scandir(stage_dir))
+        except FileNotFoundError:
+            continue
+
+        for entry in entries:
+            if not entry.name.startswith(_STAGE_PREFIX):
+                continue
+            # Names are <prefix><host>-<pid>-<random suffix>
+            owner = entry.name[len(_STAGE_PREFIX) :].rpartition("-")[0]
+            stage_host, _, pid = owner.rpartition("-")
+            if (
+                stage_host == host
+                and pid.isdigit()
+                and not is_process_running(int(pid))
+            ):
+                logging.debug(f"Removing stale staging directory {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _publish_dir(staged_dir: str, target_dir: str) -> None:
+    os.makedirs(target_dir, exist_ok=True)
+    for entry in os.scandir(staged_dir):
+        target = os.path.join(target_dir, entry.name)
+        if entry.is_dir() and os.path.isdir(target):
+            _publish_dir(entry.path, target)
+        else:
+            os.replace(entry.path, target)
+
+
+class MemoryOverlay(_Overlay):
+    """Keeps every write in memory so nothing is written to the disk.
+
+    Files that are not written are read from the disk. The original content
+    of every written file is remembered to report what would change.
+    """
+
+    def __init__(self, root: PathLike | None = None) -> None:
+        """Make an empty in-memory overlay."""
+        super().__init__(root)
+        self.files: dict[str, bytes] = {}
+        self.originals: dict[str, bytes | None] = {}
+        self._lock = Lock()
+
+    def read(self, path: PathLike) -> bytes | None:
+        """Get the content written to a file or None if it was not written."""
+        return self.files.get(os.path.abspath(path))
+
+    def write(self, path: PathLike, content: bytes) -> None:
+        """Keep the new content of a file in memory."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.originals:
+                try:
+                    with open(path, "rb") as f:
+                        self.originals[path] = f.read()
+                except FileNotFoundError:
+                    self.originals[path] = None
+            self.files[path] = content
+
+    def changes(self) -> FileChanges:
+        """Get the files that would be added or modified."""
+        changes = FileChanges()
+        for path, content in self.files.items():
+            original = self.originals[path]
+            if original is None:
+                changes.record(path, FileStatus.ADDED)
+            elif original != content:
+                changes.record(path, FileStatus.MODIFIED)
+        return changes
+
+    def diff(self) -> str:
+        """Get a unified diff of all files that would be modified."""
+        diff = []
+        for path in self.changes().modified:
+            diff.extend(
+                difflib.unified_diff(
+                    _decode_text(self.originals[path]).splitlines(True),
+                    _decode_text(self.files[path]).splitlines(True),
+                    fromfile=path,
+                    tofile=path,
+                )
+            )
+        return "".join(diff)
+
+
+_active_overlays: ContextVar[tuple[_Overlay, ...]] = ContextVar(
+    "active_overlays", default=()
+)
+
+
+@contextmanager
+def staged_output(*roots: PathLike) -> Generator[None, None, None]:
+    """Stage all writes under the root directories until the block succeeds.
+
+    Files written through this module within the block go to staging
+    directories. They are published into the roots when the block exits
+    normally and discarded if it raises, so the roots are never left half
+    populated. Nothing is staged if output is kept in memory.
+
+    Args:
+        *roots: the directories whose writes are staged
+
+    """
+    active = _active_overlays.get()
+    if any(isinstance(overlay, MemoryOverlay) for overlay in active):
+        yield
+        return
+
+    stages = tuple(StagedOutput(root) for root in roots)
+    token = _active_overlays.set(active + stages)
+    try:
+        yield
+    except BaseException:
+        for stage in stages:
+            stage.discard()
+        raise
+    finally:
+        _active_overlays.reset(token)
+
+    try:
+        for stage in stages:
+            stage.publish()
+    finally:
+        for stage in stages:
+            stage.discard()
+
+
+@contextmanager
+def in_memory_output() -> Generator[MemoryOverlay, None, None]:
+    """Keep all writes made through this module within the block in memory.
+
+    Yields:
+        The overlay holding the written files.
+
+    """
+    overlay = MemoryOverlay()
+    token = _active_overlays.set(_active_overlays.get() + (overlay,))
+    try:
+        yield overlay
+    finally:
+        _active_overlays.reset(token)
+
+
+@contextmanager
+def locked(path: PathLike) -> Generator[None, None, None]:
+    """Lock a file shared with other generator processes for an update.
+
+    Reads and writes of the file within the block are not interleaved with
+    those of other processes. If writes to the file are staged, the lock is
+    held until they are published so no other process reads the file in
+    between.
+
+    Args:
+        path: the shared file
+
+    """
+    lock = FileLock(path)
+    lock.acquire()
+    overlay = _overlay_for(path)
+    if not isinstance(overlay, StagedOutput):
+        try:
+            yield
+        finally:
+            lock.release()
+        return
+
+    overlay.hold(lock)
+    yield
+
+
+def _overlay_for(path: PathLike) -> _Overlay | None:
+    for overlay in reversed(_active_overlays.get()):
+        if overlay.covers(path):
+            return overlay
+    return None
+
+
+def _decode_text(content: bytes) -> str:
+    text = content.decode(locale.getpreferredencoding(False), "replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def read_file(path: PathLike) -> bytes:
+    """Read the current content of a file, including unpublished writes."""
+    overlay = _overlay_for(path)
+    if overlay is not None:
+        content = overlay.read(path)
+        if content is not None:
+            return content
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_text(path: PathLike) -> str:
+    """Read a file as it would be read by a file opened in text mode."""
+    return _decode_text(read_file(path))
+
+
+def disk_path(path: PathLike) -> PathLike | None:
+    """Get where a file is written on the disk or None if kept in memory."""
+    overlay = _overlay_for(path)
+    if overlay is None:
+        return path
+    return overlay.disk_path(path)
+
+
+def makedirs(path: PathLike) -> None:
+    """Create a directory and its parents if they do not exist."""
+    overlay = _overlay_for(path)
+    if overlay is None:
+        os.makedirs(path, exist_ok=True)
+    else:
+        overlay.makedirs(path)
+
+
+def file_status(path: PathLike, size: int, sha256: str) -> FileStatus:
+    """Get what writing content of the given size and hash would do.
+
+    The size of the existing file is compared first so the file only needs to
+    be hashed when the sizes match.
+
+    Args:
+        path: path to the file
+        size: size of the new content in bytes
+        sha256: hash of the new content
+
+    Returns:
+        ADDED if the file does not exist, UNCHANGED if it has the same content
+        and MODIFIED otherwise.
+
+    """
+    overlay = _overlay_for(path)
+    content = overlay.read(path) if overlay is not None else None
+    if content is not None:
+        if (
+            len(content) == size
+            and hashlib.sha256(content).hexdigest() == sha256
+        ):
+            return FileStatus.UNCHANGED
+        return FileStatus.MODIFIED
+
+    try:
+        existing_size = os.stat(path).st_size
+    except FileNotFoundError:
+        return FileStatus.ADDED
+
+    if existing_size == size and hash_file(path) == sha256:
+        return FileStatus.UNCHANGED
+    return FileStatus.MODIFIED
+
+
+@contextmanager
+def _replacing(
+    target: PathLike, original: PathLike
+) -> Generator[str, None, None]:
+    """Write a temporary file within the block and rename it to the target.
+
+    The temporary file is next to the target so readers never see a partial
+    file. It gets the mode of the original file if that exists.
+
+    Yields:
+        The path of the temporary file to write.
+
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = "%s.%d-%d.tmp" % (target, os.getpid(), get_ident())
+    try:
+        yield tmp_path
+        if os.path.exists(original):
+            shutil.copymode(original, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write(path: PathLike, content: bytes) -> None:
+    count_file_written(len(content))
+    overlay = _overlay_for(path)
+    if overlay is not None:
+        overlay.write(path, content)
+        return
+
+    with _replacing(path, path) as tmp_path, open(tmp_path, "xb") as f:
+        f.write(content)
+
+
+def write_file(path: PathLike, content: bytes) -> FileStatus:
+    """Write content to a file unless it already has the same content.
+
+    Skipping identical writes keeps modification times, so make does not
+    rebuild anything for a rerun.
+
+    Args:
+        path: path to the file
+        content: the new content of the file
+
+    Returns:
+        Whether the file was added, modified or left unchanged.
+
+    """
+    status = file_status(
+        path, len(content), hashlib.sha256(content).hexdigest()
+    )
+    if status is not FileStatus.UNCHANGED:
+        _write(path, content)
+    return status
+
+
+def copy_file(source: Traversable, path: PathLike) -> None:
+    """Copy a file or resource byte for byte, without decoding.
+
+    Args:
+        source: the file to copy
+        path: the destination
+
+    """
+    target = disk_path(path)
+    if target is None:
+        _write(path, source.read_bytes())
+        return
+
+    with _replacing(target, path) as tmp_path:
+        if isinstance(source, Path):
+            # Lets the OS copy the file in kernel space where supported
+            shutil.copyfile(source, tmp_path)
+        else:
+            with source.open("rb") as src, open(tmp_path, "xb") as dst:
+                shutil.copyfileobj(src, dst)
+        count_file_written(os.path.getsize(tmp_path))
+
+
+_MAKEFILE_ASSIGNMENT = re.compile(
+    r"^\s*(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*[+:?]?=(?P<values>.*)$"
+)
+
+
+class MakefileLists:
+    """Lists assigned in a Makefile, e.g. 'IOCDIRS += IOC1 IOC2'.
+
+    The Makefile is parsed once. Each list is kept as an ordered set of its
+    entries along with the line where the list ends, so looking up an entry
+    matches whole names only and many entries can be added in one pass.
+    """
+
+    def __init__(self, lines: list[str]) -> None:
+        """Parse the lists in the lines of a Makefile."""
+        self.lines = lines
+        self.entries: dict[str, dict[str, None]] = {}
+        self.ends: dict[str, int] = {}
+        self._added: dict[str, list[str]] = {}
+
+        continued_list = None
+        for index, line in enumerate(lines):
+            content = line.split("#", 1)[0].rstrip()
+            if continued_list is None:
+                match = _MAKEFILE_ASSIGNMENT.match(content)
+                if match is None:
+                    continue
+                list_name, values = match["name"], match["values"]
+            else:
+                list_name, values = continued_list, content
+
+            entries = self.entries.setdefault(list_name, {})
+            for entry in values.rstrip("\\").split():
+                entries[entry] = None
+            self.ends[list_name] = index
+            continued_list = list_name if values.endswith("\\") else None
+
+    def __contains__(self, item: tuple[str, str]) -> bool:
+        """Check if a (list name, entry) pair is in the Makefile."""
+        list_name, entry = item
+        return entry in self.entries.get(list_name, {})
+
+    def add(self, list_name: str, entry: str) -> bool:
+        """Add an entry to the end of a list unless it is already there.
+
+        Args:
+            list_name: The name of the list to add to
+            entry: The entry to add to the list
+
+        Returns:
+            Whether the entry was added.
+
+        """
+        if (list_name, entry) in self:
+            return False
+        self.entries.setdefault(list_name, {})[entry] = None
+        self._added.setdefault(list_name, []).append(entry)
+        return True
+
+    def to_lines(self) -> list[str]:
+        """Get the lines of the Makefile with the added entries.
+
+        Entries are added after the last line of their list, or at the end
+        of the Makefile for new lists.
+        """
+        insertions: dict[int, list[str]] = {}
+        for list_name, entries in self._added.items():
+            end = self.ends.get(list_name, len(self.lines) - 1)
+            insertions.setdefault(end, []).extend(
+                "{} += {}\n".format(list_name, entry) for entry in entries
+            )
+
+        new_lines = []
+        if -1 in insertions:
+            new_lines.extend(insertions[-1])
+        for index, line in enumerate(self.lines):
+            new_lines.append(line)
+            if index in insertions:
+                if not line.endswith("\n"):
+                    new_lines[-1] = line + "\n"
+                new_lines.extend(insertions[index])
+        return new_lines
+
+
+def _add_entry_to_list(
+    text: list[str], list_name: str, entry: str
+) -> list[str]:
+    """Add entry to prefixed list in list of strings.
 
     Check if 'list_name += entry' already exists in text and add it if not.
 
     Args:
-        text: The original text
+        text: The original lines of text
         list_name: The name of the list to add to
         entry: The entry to add to the list
 
@@ -18,24 +636,11 @@ def _add_entry_to_list(text: str, list_name: str, entry: str) -> str:
         The original text with the requested entry added to the named list
 
     """
-    new_text = []
-    last_line = ""
-    marker = "{} += ".format(list_name)
-
-    new_line = marker + entry + "\n"
-    # Go to the end of the list of IOCDIRS/SUPPDIRS += iocname,
-    # and add our new IOC
-    for line in text:
-        if entry in line:
-            # Entry already in the list
-            return text
-        elif marker in last_line and marker not in line:
-            # We found the end of the list
-            new_text.append(new_line)
-        # Copy rest of the lines into new text as usual
-        new_text.append(line)
-        last_line = line
-    return new_text  # return Makefile with new entry
+    makefile_lists = MakefileLists(text)
+    if not makefile_lists.add(list_name, entry):
+        # Entry already in the list
+        return text
+    return makefile_lists.to_lines()
 
 
 def add_to_makefile_list(directory: str, list_name: str, entry: str) -> bool:
@@ -49,28 +654,49 @@ def add_to_makefile_list(directory: str, list_name: str, entry: str) -> bool:
         list_name: The name of the list in the makefile to append to
         entry: The entry to add to the list
 
+    Returns:
+        Whether the Makefile was modified.
+
+    """
+    return add_to_makefile_lists(directory, {list_name: [entry]})
+
+
+def add_to_makefile_lists(
+    directory: str, entries: dict[str, Iterable[str]]
+) -> bool:
+    """Add entries to lists in a Makefile, reading and writing it once.
+
+    Args:
+        directory: Directory containing the makefile
+        entries: The entries to add to each list, by list name
+
+    Returns:
+        Whether the Makefile was modified.
+
     """
-    logging.info(
-        "Adding {} to list {} in Makefile for directory {}".format(
-            entry, list_name, directory
-        )
-    )
     makefile = join(directory, "Makefile")
-    with open(makefile) as f:
-        old_lines = f.readlines()
+    with locked(makefile):
+        makefile_lists = MakefileLists(read_text(makefile).splitlines(True))
 
-    new_lines = _add_entry_to_list(old_lines, list_name, entry)
+        modified = False
+        for list_name, list_entries in entries.items():
+            for entry in list_entries:
+                logging.info(
+                    "Adding {} to list {} in Makefile for directory {}".format(
+                        entry, list_name, directory
+                    )
+                )
+                if makefile_lists.add(list_name, entry):
+                    modified = True
+                else:
+                    logging.warning(
+                        f"Entry '{entry}' is already added to list"
+                        f" '{list_name}' in '{makefile}'."
+                    )
 
-    if old_lines == new_lines:
-        logging.warn(
-            (
-                f"Entry '{entry}' is already added to list '{list_name}' in"
-                f" '{makefile}'."
+        if modified:
+            write_file(
+                makefile, encode_text("".join(makefile_lists.to_lines()))
             )
-        )
-        return False
-
-    with open(makefile, "w") as f:
-        f.writelines(new_lines)
 
-    return True
+        return modified
@@ -3,12 +3,18 @@
 This is sometimes done via the command line and other times the PythonGit API.
 """
 
+import atexit
 import logging
 import os
+import stat
 import subprocess
+import threading
 from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
 from os.path import relpath
-from typing import Generator
+from pathlib import Path
+from typing import Generator, Iterable
 
 from git import (
     GitCommandError,
@@ -22,6 +28,30 @@ from ibex_device_generator.exc import (
     FailedToSwitchBranchError,
     NothingToCommitError,
 )
+from ibex_device_generator.paths import CACHE_DIR, CLIENT, EPICS
+from ibex_device_generator.utils.file_system import FileChanges
+from ibex_device_generator.utils.trace import count_subprocess, span
+
+
+class DirtyCheck(Enum):
+    """How to check if a repository has uncommitted changes."""
+
+    # Changes and untracked files anywhere in the working tree and its
+    # submodules
+    FULL = "full"
+    # Changes and untracked files in the paths a step writes to only, with
+    # `git status --porcelain=v2` ignoring submodules
+    SCOPED = "scoped"
+
+
+# Local mirrors of repositories to clone submodules from
+MIRROR_DIR = os.path.join(CACHE_DIR, "mirrors")
+
+# Repositories with many submodules or files, where the full check is slow
+DIRTY_CHECKS = {
+    EPICS: DirtyCheck.SCOPED,
+    CLIENT: DirtyCheck.SCOPED,
+}
 
 
 class RepoWrapper(Repo):
@@ -32,6 +62,7 @@ class RepoWrapper(Repo):
         path: str,
         init: bool = False,
         *args,
+        dirty_check: DirtyCheck = DirtyCheck.FULL,
         **kwargs,
     ) -> None:
         """Attach to existing git repository or initialise a new.
@@ -46,9 +77,11 @@ class RepoWrapper(Repo):
             init: If True git repo is initialised at directory if it
                 doesn't exist.
             *args: any additional positional arguments
+            dirty_check: how `is_dirty_in` checks for uncommitted changes
             **kwargs: any additional keyword arguments
 
         """
+        self.dirty_check = dirty_check
         try:
             super().__init__(path, *args, **kwargs)
         except (InvalidGitRepositoryError, NoSuchPathError):
@@ -69,6 +102,33 @@ class RepoWrapper(Repo):
             # HEAD is detached
             return None
 
+    def is_dirty_in(self, paths: Iterable[str] = ()) -> bool:
+        """Check for uncommitted changes with the repository's dirty check.
+
+        The scoped check only looks at the given paths, or the whole working
+        tree without any, and does not look into submodules. Git uses the
+        untracked cache and file system monitor if they are enabled in the
+        repository's config, so these make the check faster still.
+
+        Args:
+            paths: the paths a step writes to
+
+        """
+        if self.dirty_check is DirtyCheck.FULL:
+            return self.is_dirty(untracked_files=True)
+
+        pathspecs = [relpath(path, self.working_tree_dir) for path in paths]
+        with span("status", "git", repo=self.working_tree_dir):
+            count_subprocess()
+            status = self.git.status(
+                "--porcelain=v2",
+                "--untracked-files=normal",
+                "--ignore-submodules=all",
+                "--",
+                *pathspecs,
+            )
+        return bool(status.strip())
+
     def switch(self, branch: str = "main") -> None:
         """Switch to branch. Creates it if needed.
 
@@ -94,57 +154,264 @@ class RepoWrapper(Repo):
         except GitCommandError as e:
             raise FailedToSwitchBranchError(self, branch, e)
 
-    def commit_all(self, msg: str) -> None:
-        """Commit all changes and untracked files in the repository.
+    def commit_all(self, msg: str, paths: Iterable[str] | None = None) -> None:
+        """Commit the changes and untracked files in the repository.
+
+        With paths only the changes to these are staged, along with anything
+        staged already, so the time taken depends on the size of the change
+        rather than the size of the repository.
 
         Args:
             msg: The commit message
+            paths: The files to commit, all files if None
+
+        Raises:
+            NothingToCommitError: if there are no changes to commit
 
         """
         logging.info(
             (
-                f"Committing all changes and untracked files in"
-                f" '{self.working_tree_dir}'."
+                f"Committing {'all' if paths is None else 'the'} changes and"
+                f" untracked files in '{self.working_tree_dir}'."
             )
         )
 
-        if self.is_dirty(untracked_files=True):
-            self.git.add(A=True)
+        with span("commit_all", "git", repo=self.working_tree_dir):
+            if paths is None:
+                if not self.is_dirty(untracked_files=True):
+                    raise NothingToCommitError(self)
+                count_subprocess()
+                self.git.add(A=True)
+            else:
+                self.stage(paths)
+                if not self.has_staged_changes():
+                    raise NothingToCommitError(self)
+
+            count_subprocess()
             self.git.commit(m=msg)
             sha = self.head.object.hexsha
             logging.info(f"Commit {sha[:9]} made")
-        else:
-            raise NothingToCommitError(self)
 
-    def create_submodule(self, name: str, url: str, path: str) -> None:
+    def stage(self, paths: Iterable[str]) -> None:
+        """Stage files with a single `git add`.
+
+        Paths outside of the working tree are ignored, e.g. files written
+        into a parent repository by a step in a submodule.
+
+        Args:
+            paths: The files to stage
+
+        """
+        pathspecs = self._paths_in_working_tree(paths)
+        if not pathspecs:
+            return
+
+        # Read from stdin so any number of paths fit on the command line
+        self._run_git(
+            "--literal-pathspecs",
+            "add",
+            "--pathspec-from-file=-",
+            "--pathspec-file-nul",
+            input="\0".join(pathspecs),
+        )
+
+    def commit_files(self, msg: str, paths: Iterable[str]) -> None:
+        """Commit files with git plumbing commands.
+
+        Unlike `commit_all` the working tree is never scanned, the files are
+        written as blobs by a single `git hash-object`, added to the index
+        and committed on the current branch. The number of commands is the
+        same however many files there are, except that files with a newline
+        in their path are hashed one at a time. Commit hooks are not run.
+
+        Args:
+            msg: The commit message
+            paths: The files to commit, files outside the working tree are
+                ignored
+
+        Raises:
+            NothingToCommitError: if the commit would not change anything
+
+        """
+        logging.info(
+            f"Committing the generated files in '{self.working_tree_dir}'."
+        )
+
+        with span("commit_files", "git", repo=self.working_tree_dir):
+            files = self._paths_in_working_tree(paths)
+            if files:
+                blobs = self._hash_objects(files)
+                filemode = self.config_reader().get_value(
+                    "core", "filemode", True
+                )
+                index_info = "".join(
+                    f"{self._file_mode(path, filemode):o} {blob}\t{path}\0"
+                    for path, blob in zip(files, blobs)
+                )
+                self._run_git(
+                    "update-index", "-z", "--index-info", input=index_info
+                )
+
+            tree = self._run_git("write-tree").strip()
+            parent = self.head.commit if self.head.is_valid() else None
+            if parent is not None and parent.tree.hexsha == tree:
+                raise NothingToCommitError(self)
+
+            parents = ["-p", parent.hexsha] if parent is not None else []
+            sha = self._run_git(
+                "commit-tree", tree, *parents, input=msg
+            ).strip()
+            # HEAD is the branch being committed on, so that is advanced
+            self._run_git(
+                "update-ref",
+                "-m",
+                f"commit: {msg.splitlines()[0] if msg else ''}",
+                "HEAD",
+                sha,
+                *([parent.hexsha] if parent is not None else []),
+            )
+            logging.info(f"Commit {sha[:9]} made")
+
+    def _hash_objects(self, paths: list[str]) -> list[str]:
+        """Write files as blobs, getting their hashes in the same order."""
+        # hash-object reads one path per line, others are hashed on their own
+        listed = [path for path in paths if "\n" not in path]
+        blobs = {}
+        if listed:
+            output = self._run_git(
+                "hash-object", "-w", "--stdin-paths", input="\n".join(listed)
+            )
+            blobs.update(zip(listed, output.split()))
+        for path in paths:
+            if path not in blobs:
+                blobs[path] = self._run_git(
+                    "hash-object", "-w", "--", path
+                ).strip()
+        return [blobs[path] for path in paths]
+
+    def _file_mode(self, path: str, filemode: bool) -> int:
+        """Get the git file mode of a file, executable or regular."""
+        if (
+            filemode
+            and os.stat(os.path.join(self.working_tree_dir, path)).st_mode
+            & stat.S_IXUSR
+        ):
+            return 0o100755
+        return 0o100644
+
+    def _paths_in_working_tree(self, paths: Iterable[str]) -> list[str]:
+        """Get the paths within the working tree relative to it."""
+        relative_paths = []
+        for path in paths:
+            path = relpath(path, self.working_tree_dir)
+            if path != os.pardir and not path.startswith(os.pardir + os.sep):
+                relative_paths.append(path.replace(os.sep, "/"))
+        return relative_paths
+
+    def _run_git(self, *args: str, input: str = "") -> str:
+        """Run a git command in the working tree with input on stdin."""
+        return _run_git(self.working_tree_dir, *args, input=input)
+
+    def has_staged_changes(self) -> bool:
+        """Check if the index differs from HEAD."""
+        count_subprocess()
+        try:
+            self.git.diff("--cached", "--quiet")
+        except GitCommandError as e:
+            if e.status == 1:
+                return True
+            raise
+        return False
+
+    def create_submodule(
+        self,
+        name: str,
+        url: str,
+        path: str,
+        options: "SubmoduleOptions | None" = None,
+    ) -> None:
         """Create submodule in this repository.
 
         Args:
             name: Name of the submodule
             url: Url to the submodule repo
             path: Local system path to the submodule
+            options: How to clone the submodule, a full clone of the url if
+                None
 
         """
+        options = options or SubmoduleOptions()
+        branch = "main"
+        # create path relative to current root in case path is absolute
+        sub_path = relpath(path, start=self.working_tree_dir)
+        # git runs in the working tree, so relative mirrors would not be found
+        mirror = os.path.abspath(options.mirror_of(url))
+
+        clone_args = []
+        if options.depth is not None:
+            clone_args += ["--depth", str(options.depth)]
+        if os.path.isdir(mirror) and not options.offline:
+            clone_args += ["--reference", mirror, "--dissociate"]
+
         try:
-            branch = "main"
-            # create path relative to current root in case path is absolute
-            sub_path = relpath(path, start=self.working_tree_dir)
-            # We use subprocess here because gitpython seems to add a
-            # /refs/heads/ prefix to any branch you give it,
-            # and this breaks the repo checks.
-
-            cmd = (
-                f"git submodule add -b {branch} --name {name} {url} {sub_path}"
-            )
-            subprocess.run(
-                cmd,
-                cwd=self.working_tree_dir,
-                check=True,
-            )
+            with span("create_submodule", "git", url=url):
+                if options.offline or options.filter is not None:
+                    # git submodule add can neither clone partially nor from
+                    # another url, so the submodule is cloned first and then
+                    # added as an existing repository
+                    source = url
+                    if options.offline:
+                        init_bare_repo(mirror, branch)
+                        # Local paths ignore --depth, file urls do not
+                        source = Path(mirror).as_uri()
+                    if options.filter is not None:
+                        clone_args.append(f"--filter={options.filter}")
+
+                    self._run_git(
+                        "-c",
+                        "protocol.file.allow=always",
+                        "clone",
+                        "-b",
+                        branch,
+                        *clone_args,
+                        "--",
+                        source,
+                        sub_path,
+                    )
+                    self._run_git(
+                        "-C", sub_path, "remote", "set-url", "origin", url
+                    )
+                    self._run_git(
+                        "submodule",
+                        "add",
+                        "-b",
+                        branch,
+                        "--name",
+                        name,
+                        "--",
+                        url,
+                        sub_path,
+                    )
+                    self._run_git("submodule", "absorbgitdirs", "--", sub_path)
+                else:
+                    self._run_git(
+                        "submodule",
+                        "add",
+                        "-b",
+                        branch,
+                        "--name",
+                        name,
+                        *clone_args,
+                        "--",
+                        url,
+                        sub_path,
+                    )
 
         except subprocess.CalledProcessError as e:
             logging.error(
-                "Cannot add {} as a submodule, error: {}".format(path, e)
+                "Cannot add {} as a submodule, error: {}\n{}".format(
+                    path, e, e.stderr.decode(errors="replace")
+                )
             )
             raise e
         except Exception as e:
@@ -156,11 +423,131 @@ class RepoWrapper(Repo):
             )
 
 
+@dataclass
+class SubmoduleOptions:
+    """How to clone a new submodule.
+
+    Mirrors are bare repositories named like the repository they mirror,
+    e.g. `EPICS-device.git`, in the mirror directory.
+
+    Attributes:
+        depth: the number of commits to clone, all if None
+        filter: a partial clone filter, e.g. `blob:none`
+        mirror_dir: the directory of local mirrors, `MIRROR_DIR` if None.
+            Objects in the mirror of the submodule are used instead of
+            downloading them
+        offline: clone the submodule from its mirror instead of its url,
+            making the mirror with an empty commit if it does not exist
+
+    """
+
+    depth: int | None = None
+    filter: str | None = None
+    mirror_dir: str | None = None
+    offline: bool = False
+
+    def mirror_of(self, url: str) -> str:
+        """Get the path to the mirror of a repository."""
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        if not name.endswith(".git"):
+            name += ".git"
+        return os.path.join(self.mirror_dir or MIRROR_DIR, name)
+
+
+def init_bare_repo(path: str, branch: str = "main") -> None:
+    """Make a bare repository with a branch, unless it exists already.
+
+    The branch starts with an empty commit, so the repository can be cloned
+    like a new repository on GitHub.
+
+    Args:
+        path: where to make the repository
+        branch: the branch to make
+
+    """
+    if os.path.isdir(path):
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    Repo.init(path, bare=True, initial_branch=branch)
+    tree = _run_git(path, "mktree").strip()
+    commit = _run_git(
+        path, "commit-tree", tree, input="Initial commit"
+    ).strip()
+    _run_git(path, "update-ref", f"refs/heads/{branch}", commit)
+
+
+def _run_git(cwd: str, *args: str, input: str = "") -> str:
+    """Run a git command in a directory with input on stdin."""
+    count_subprocess()
+    # Bytes keep newlines as they are on Windows
+    return subprocess.run(
+        ["git", *args],
+        input=input.encode(),
+        cwd=cwd,
+        capture_output=True,
+        check=True,
+    ).stdout.decode()
+
+
+# Repositories opened by get_repo, by the real path of their working tree
+_repos: dict[str, RepoWrapper] = {}
+_repos_lock = threading.Lock()
+
+
+def get_repo(path: str) -> RepoWrapper:
+    """Get the shared handle of a repository, opening it the first time.
+
+    Handles are shared by all steps and devices of a run, so each repository
+    reads its config once and its persistent `git cat-file --batch`
+    processes are reused instead of being started for every step. Steps in
+    the same repository never run at the same time, so a handle is only
+    used by one thread at a time.
+
+    Args:
+        path: The path to the git repository
+
+    Raises:
+        CannotOpenRepoError: if there is no git repository at the path
+
+    """
+    key = os.path.realpath(path)
+    with _repos_lock:
+        repo = _repos.get(key)
+        # The repository may have been removed since it was opened
+        if repo is None or not os.path.isdir(repo.git_dir):
+            if repo is not None:
+                del _repos[key]
+                repo.close()
+            repo = RepoWrapper(path, dirty_check=_dirty_check_of(key))
+            _repos[key] = repo
+        return repo
+
+
+def _dirty_check_of(real_path: str) -> DirtyCheck:
+    for path, dirty_check in DIRTY_CHECKS.items():
+        if os.path.realpath(path) == real_path:
+            return dirty_check
+    return DirtyCheck.FULL
+
+
+@atexit.register
+def close_repos() -> None:
+    """Close the shared repository handles and their git processes."""
+    with _repos_lock:
+        for repo in _repos.values():
+            repo.close()
+        _repos.clear()
+
+
 @contextmanager
 def commit_changes(
     repo_path: str,
     branch: str,
     msg: str,
+    paths: Iterable[str] = (),
+    changes: FileChanges | None = None,
+    plumbing: bool = False,
 ) -> Generator[RepoWrapper, None, None]:
     """Switches to a branch and makes commit.
 
@@ -168,12 +555,17 @@ def commit_changes(
         repo_path: Path to the repo
         branch: branch to commit on
         msg: commit message
-        confirm_commit: prompt the user to confirm the commit
+        paths: the paths the changes are made in, which must not have
+            uncommitted changes if the repo's dirty check is scoped
+        changes: the files changed within the block, only the added and
+            modified files are committed if given, otherwise all changes
+        plumbing: commit the changed files with git plumbing commands
+            instead of `git add` and `git commit`, see `commit_files`
 
     """
-    repo = RepoWrapper(repo_path)
+    repo = get_repo(repo_path)
 
-    if repo.is_dirty(untracked_files=True):
+    if repo.is_dirty_in(paths):
         raise FailedToSwitchBranchError(repo, branch, "Repo is dirty.")
 
     try:
@@ -205,4 +597,43 @@ def commit_changes(
 
     yield repo
 
-    repo.commit_all(msg)
+    if changes is None:
+        repo.commit_all(msg)
+    elif plumbing:
+        repo.commit_files(msg, changes.added + changes.modified)
+    else:
+        repo.commit_all(msg, changes.added + changes.modified)
+
+
+@contextmanager
+def restoring_branches(
+    repo_paths: Iterable[str],
+) -> Generator[None, None, None]:
+    """Switch repositories back to their branches when the block exits.
+
+    Each device is committed on its own ticket branch, which is only
+    allowed from main/master, so the next device of a batch has to start
+    from the branches the repositories were on. Repositories which do not
+    exist yet or have a detached HEAD are left as they are.
+
+    Args:
+        repo_paths: Paths to the repositories
+
+    """
+    branches = {}
+    for path in repo_paths:
+        try:
+            branch = get_repo(path).active_branch_or_none
+        except CannotOpenRepoError:
+            continue
+        if branch is not None:
+            branches[path] = branch
+
+    try:
+        yield
+    finally:
+        for path, branch in branches.items():
+            try:
+                get_repo(path).switch(branch)
+            except FailedToSwitchBranchError as e:
+                logging.warning(e)
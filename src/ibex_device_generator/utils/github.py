@@ -1,6 +1,9 @@
 """GitHub related helper functions."""
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from os import getenv
 
 import requests
 
@@ -10,12 +13,26 @@ from ibex_device_generator.exc import (
     NoGitHubTokenError,
 )
 from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.github_session import github_session
 from ibex_device_generator.utils.placeholders import GITHUB_REPO_NAME
+from ibex_device_generator.utils.trace import span
 
 ORGANIZATION_NAME = "ISISComputingGroup"
 EPICS_REPO_NAME = "EPICS"
 IBEX_CLIENT_REPO_NAME = "ibex_gui"
 
+# Can point to a stand-in server for tests and benchmarks
+GITHUB_API_URL = getenv(
+    "IBEX_DEVICE_GENERATOR_GITHUB_API", "https://api.github.com"
+)
+
+# Teams of the organisation and their permission for device repositories
+TEAM_PERMISSIONS = {
+    "ICP-Write": "push",
+    "ICP-WriteAndMerge": "maintain",
+    "ICP-Read": "read",
+}
+
 
 def create_github_repository(device: DeviceInfo, github_token: str) -> None:
     """Create a public repo in the ISIS Computing Group organization.
@@ -28,18 +45,16 @@ def create_github_repository(device: DeviceInfo, github_token: str) -> None:
     if github_token is None:
         raise NoGitHubTokenError()
 
-    response: requests.Response = requests.post(
-        f"https://api.github.com/orgs/{ORGANIZATION_NAME}/repos",
-        headers={
-            "Accept": "application/vnd.github+json",
-            "Authorization": f"token {github_token}",
-        },
-        json={
-            "name": device[GITHUB_REPO_NAME],
-            "visibility": "public",
-            "auto_init": True,
-        },
-    )
+    with span("POST repository", "github"):
+        response: requests.Response = github_session().post(
+            f"{GITHUB_API_URL}/orgs/{ORGANIZATION_NAME}/repos",
+            headers={"Authorization": f"token {github_token}"},
+            json={
+                "name": device[GITHUB_REPO_NAME],
+                "visibility": "public",
+                "auto_init": True,
+            },
+        )
 
     if response.status_code == requests.codes["created"]:
         logging.info(
@@ -66,14 +81,12 @@ def grant_permission(
         repository_name: The name of the repository.
 
     """
-    response: requests.Response = requests.put(
-        f"https://api.github.com/orgs/{ORGANIZATION_NAME}/teams/{team_name}/repos/{ORGANIZATION_NAME}/{repository_name}",
-        headers={
-            "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {github_token}",
-        },
-        json={"permission": permission},
-    )
+    with span("PUT team permission", "github", team=team_name):
+        response: requests.Response = github_session().put(
+            f"{GITHUB_API_URL}/orgs/{ORGANIZATION_NAME}/teams/{team_name}/repos/{ORGANIZATION_NAME}/{repository_name}",
+            headers={"Authorization": f"Bearer {github_token}"},
+            json={"permission": permission},
+        )
 
     if response.status_code == requests.codes["no_content"]:
         logging.info(
@@ -93,47 +106,62 @@ def grant_permissions_for_github_repository(
 ) -> None:
     """Grant permissions to teams for the GitHub repository.
 
+    The permissions of all teams are granted concurrently.
+
     Args:
         device: Provides name-based information about the device
         github_token: The GitHub authentication token.
 
+    Raises:
+        FailedToGrantPermissionError: for the first team, in the order of
+            `TEAM_PERMISSIONS`, whose permission could not be granted.
+
     """
     if github_token is None:
         raise NoGitHubTokenError()
 
-    grant_permission(
-        github_token,
-        "ICP-Write",
-        "push",
-        device[GITHUB_REPO_NAME],
-    )
-    grant_permission(
-        github_token,
-        "ICP-WriteAndMerge",
-        "maintain",
-        device[GITHUB_REPO_NAME],
-    )
-    grant_permission(
-        github_token,
-        "ICP-Read",
-        "read",
-        device[GITHUB_REPO_NAME],
-    )
-
-
-def does_github_issue_exist_and_is_open(issue_number: int) -> bool:
+    with ThreadPoolExecutor(len(TEAM_PERMISSIONS)) as executor:
+        futures = [
+            executor.submit(
+                copy_context().run,
+                grant_permission,
+                github_token,
+                team_name,
+                permission,
+                device[GITHUB_REPO_NAME],
+            )
+            for team_name, permission in TEAM_PERMISSIONS.items()
+        ]
+
+    for future in futures:
+        future.result()
+
+
+def does_github_issue_exist_and_is_open(
+    issue_number: int, github_token: str | None = None
+) -> bool:
     """Check whether GitHub issue exists and is open.
 
+    The request is authenticated if a token is given, which has a much
+    higher rate limit. An unchanged issue is answered from the cache.
+
     Args:
         issue_number: The GitHub issue/ticket number.
+        github_token: The GitHub authentication token, if any.
 
     Returns:
         Whether or not ticket exists and is open on GitHub.
 
     """
-    result = requests.get(
-        f"https://api.github.com/repos/{ORGANIZATION_NAME}/IBEX/issues/{issue_number}"
-    )
+    headers = {}
+    if github_token is not None:
+        headers["Authorization"] = f"Bearer {github_token}"
+
+    with span("GET issue", "github", issue=issue_number):
+        result = github_session().get(
+            f"{GITHUB_API_URL}/repos/{ORGANIZATION_NAME}/IBEX/issues/{issue_number}",
+            headers=headers,
+        )
     return result.ok and result.json()["state"] == "open"
 
 
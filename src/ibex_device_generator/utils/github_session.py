@@ -0,0 +1,214 @@
+"""HTTP session for the GitHub API.
+
+The session keeps connections alive, retries failed requests, paces
+requests to stay within GitHub's rate limit and caches GET responses on the
+disk so unchanged answers are revalidated with free 304 responses.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from requests.structures import CaseInsensitiveDict
+
+from ibex_device_generator.paths import CACHE_DIR
+
+GITHUB_CACHE_DIR = os.path.join(CACHE_DIR, "github")
+
+# Requests are spread over the rest of the rate limit window once less than
+# this share of the limit remains
+_PACING_THRESHOLD = 0.1
+
+
+class _GitHubRetry(Retry):
+    """Also retries secondary rate limits, which GitHub reports as 403."""
+
+    def is_retry(  # noqa: D102
+        self, method: str, status_code: int, has_retry_after: bool = False
+    ) -> bool:
+        if status_code == requests.codes["forbidden"] and has_retry_after:
+            return self.total is None or self.total > 0
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class _RateLimit:
+    """The rate limit of one GitHub identity as last reported by GitHub."""
+
+    def __init__(self) -> None:
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset: float | None = None
+        self._lock = threading.Lock()
+
+    def update(self, headers: CaseInsensitiveDict) -> None:
+        """Update the limit from the X-RateLimit headers of a response."""
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self._lock:
+            self.limit, self.remaining, self.reset = limit, remaining, reset
+
+    def acquire(self) -> float:
+        """Take a request from the limit.
+
+        Returns:
+            How long to wait before sending the request, in seconds.
+
+        """
+        with self._lock:
+            if self.remaining is None or self.reset is None:
+                return 0
+
+            window = self.reset - time.time()
+            if window <= 0:
+                return 0
+
+            remaining = self.remaining
+            self.remaining -= 1
+            if remaining <= 0:
+                return window
+            if remaining > self.limit * _PACING_THRESHOLD:
+                return 0
+            return window / remaining
+
+
+class GitHubSession(requests.Session):
+    """A session pacing requests by the rate limit and caching GETs.
+
+    Each identity, i.e. Authorization header, has its own rate limit. GET
+    responses with an ETag are cached on the disk per URL and identity and
+    later requests ask GitHub if they changed with If-None-Match.
+    """
+
+    def __init__(self) -> None:
+        """Make a session with no known rate limits."""
+        super().__init__()
+        self._rate_limits: dict[str, _RateLimit] = {}
+        self._lock = threading.Lock()
+
+    def _rate_limit(self, identity: str) -> _RateLimit:
+        with self._lock:
+            return self._rate_limits.setdefault(identity, _RateLimit())
+
+    def request(  # noqa: D102
+        self, method: str, url: str, **kwargs: Any
+    ) -> requests.Response:
+        headers = dict(kwargs.pop("headers", None) or {})
+        identity = headers.get("Authorization", "")
+        cache_path = None
+        cached = None
+
+        if method.upper() == "GET":
+            cache_path = _cache_path(url, identity)
+            cached = _load_cached_response(cache_path)
+            if cached is not None:
+                headers["If-None-Match"] = cached["etag"]
+
+        rate_limit = self._rate_limit(identity)
+        delay = rate_limit.acquire()
+        if delay > 0:
+            logging.info(
+                f"Waiting {delay:.1f}s to stay within GitHub's rate limit."
+            )
+            time.sleep(delay)
+
+        response = super().request(method, url, headers=headers, **kwargs)
+        rate_limit.update(response.headers)
+
+        if cached is not None and response.status_code == 304:
+            return _cached_response(cached, response)
+
+        etag = response.headers.get("ETag")
+        if cache_path is not None and response.ok and etag:
+            _save_cached_response(cache_path, etag, response)
+
+        return response
+
+
+def _cache_path(url: str, identity: str) -> str:
+    key = hashlib.sha256(f"{identity}\n{url}".encode()).hexdigest()
+    return os.path.join(GITHUB_CACHE_DIR, f"{key}.json")
+
+
+def _load_cached_response(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached_response(
+    path: str, etag: str, response: requests.Response
+) -> None:
+    """Cache a response, failing to do so is not an error."""
+    cached = {
+        "etag": etag,
+        "status_code": response.status_code,
+        "content_type": response.headers.get("Content-Type"),
+        "content": response.text,
+    }
+    try:
+        os.makedirs(GITHUB_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=GITHUB_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.debug(f"Could not cache GitHub response: {e}")
+
+
+def _cached_response(
+    cached: dict, not_modified: requests.Response
+) -> requests.Response:
+    """Make the response of a 304 from the cached response."""
+    response = requests.Response()
+    response.status_code = cached["status_code"]
+    response.headers = CaseInsensitiveDict(not_modified.headers)
+    if cached["content_type"] is not None:
+        response.headers["Content-Type"] = cached["content_type"]
+    response._content = cached["content"].encode()
+    response.encoding = "utf-8"
+    response.url = not_modified.url
+    response.request = not_modified.request
+    response.reason = "OK (cached)"
+    return response
+
+
+@lru_cache(maxsize=None)
+def github_session() -> GitHubSession:
+    """Get the session shared by all GitHub API requests.
+
+    Connections are kept alive and pooled. Idempotent requests are retried
+    with backoff on server errors and rate limits, waiting as long as
+    GitHub asks to in the Retry-After header.
+    """
+    retry = _GitHubRetry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[
+            requests.codes["too_many_requests"],
+            requests.codes["internal_server_error"],
+            requests.codes["bad_gateway"],
+            requests.codes["service_unavailable"],
+            requests.codes["gateway_timeout"],
+        ],
+        raise_on_status=False,
+    )
+    session = GitHubSession()
+    session.mount("https://", HTTPAdapter(pool_maxsize=10, max_retries=retry))
+    session.mount("http://", HTTPAdapter(pool_maxsize=10, max_retries=retry))
+    session.headers["Accept"] = "application/vnd.github+json"
+    return session
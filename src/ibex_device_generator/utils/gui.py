@@ -1,14 +1,28 @@
 """Helper functions for IBEX gui manipulation."""
 
+import hashlib
+import json
 import logging
 import os
+import tempfile
+from io import BytesIO
+from os import PathLike
+from typing import Iterable
 
 from lxml import etree
 from lxml.etree import ElementTree
 
 from ibex_device_generator.exc import IBEXDeviceGeneratorError
-from ibex_device_generator.paths import OPI_RESOURCES
+from ibex_device_generator.paths import CACHE_DIR, OPI_RESOURCES
 from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import (
+    disk_path,
+    encode_text,
+    hash_file,
+    locked,
+    read_file,
+    write_file,
+)
 from ibex_device_generator.utils.placeholders import OPI_KEY
 from ibex_device_generator.utils.templates import DeviceTemplate
 
@@ -26,6 +40,9 @@ class DuplicateOPIKeyError(IBEXDeviceGeneratorError):
         return "OPI key '%s' already exists in opi_info.xml" % self.opi_key
 
 
+OPI_INFO = os.path.join(OPI_RESOURCES, "opi_info.xml")
+OPI_KEY_INDEX_DIR = os.path.join(CACHE_DIR, "opi_keys")
+
 # Following xml entry is used in opi_info.xml which holds the
 # collection of available device screens (entries) for the gui.
 # fmt: off
@@ -69,34 +86,262 @@ def _generate_opi_entry(device: DeviceInfo) -> ElementTree:
     )
 
 
-def add_device_opi_to_opi_info(device: DeviceInfo) -> None:
+def add_device_opi_to_opi_info(
+    device: DeviceInfo, opi_info_path: PathLike = OPI_INFO
+) -> None:
     """Add some basic template information to the opi_info.xml file.
 
     Args:
         device: Key to identify to OPI to the GUI
+        opi_info_path: Path to the opi_info.xml file
+
+    Raises:
+        DuplicateOPIKeyError: if the device's OPI key already exists.
+
+    """
+    duplicates = add_device_opis_to_opi_info([device], opi_info_path)
+    if duplicates:
+        raise duplicates[0]
+
+
+def add_device_opis_to_opi_info(
+    devices: Iterable[DeviceInfo],
+    opi_info_path: PathLike = OPI_INFO,
+    streaming: bool = True,
+) -> list[DuplicateOPIKeyError]:
+    """Add entries for many devices to the opi_info.xml file at once.
+
+    The file is read and written only once. Devices whose OPI key already
+    exists, in the file or earlier in the batch, are skipped and reported.
+
+    By default the new entries are spliced in before the closing `</opis>`
+    tag and the rest of the file is kept byte for byte. Otherwise, or if the
+    closing tag cannot be found, the whole document is parsed and pretty
+    printed again.
+
+    Args:
+        devices: The devices to add OPI entries for
+        opi_info_path: Path to the opi_info.xml file
+        streaming: Whether to insert entries without rewriting the file
+
+    Returns:
+        An error for every device that was skipped because of its OPI key.
 
     """
     log = logging.getLogger("rich")
-    log.info("Adding entry for device screen into opi_info.xml")
-
-    opi_info_path = os.path.join(OPI_RESOURCES, "opi_info.xml")
-    with open(opi_info_path) as f:
-        # Remove blank on input or pretty printing won't work later
-        opi_xml = etree.parse(f, etree.XMLParser(remove_blank_text=True))
-
-    opis = opi_xml.find("opis")
-    opi_key = device[OPI_KEY]
-    if any(entry.find("key").text == opi_key for entry in opis):
-        raise DuplicateOPIKeyError(opi_key)
-
-    opis.append(_generate_opi_entry(device))
-    with open(opi_info_path, "w") as f:
-        f.write(
-            etree.tostring(
-                opi_xml,
-                pretty_print=True,
-                encoding="UTF-8",
-                xml_declaration=True,
-                standalone="yes",
-            ).decode()
+    log.info("Adding entries for device screens into opi_info.xml")
+
+    with locked(opi_info_path):
+        content = read_file(opi_info_path)
+        opi_keys = _opi_keys_of_content(opi_info_path, content)
+        duplicates = []
+        entries = []
+
+        for device in devices:
+            opi_key = device[OPI_KEY]
+            if opi_key in opi_keys:
+                duplicates.append(DuplicateOPIKeyError(opi_key))
+                continue
+
+            entries.append(_generate_opi_entry(device))
+            opi_keys.add(opi_key)
+
+        if not entries:
+            return duplicates
+
+        new_content = (
+            _insert_opi_entries(content, entries) if streaming else None
         )
+        if new_content is None:
+            new_content = _append_opi_entries(content, entries)
+
+        write_file(opi_info_path, new_content)
+
+        # Nothing is indexed for content that is only kept in memory
+        if disk_path(opi_info_path) is not None:
+            _save_opi_key_index(
+                opi_info_path,
+                opi_keys,
+                None,
+                len(new_content),
+                hashlib.sha256(new_content).hexdigest(),
+            )
+
+        return duplicates
+
+
+def get_opi_keys(opi_info_path: PathLike = OPI_INFO) -> set[str]:
+    """Get the keys of all OPIs in the opi_info.xml file.
+
+    Keys are read from an index cached outside of the GUI source tree. The
+    index is used if the file has the same size and modification time as
+    when it was indexed or otherwise if it has the same hash. The file is
+    parsed and indexed again if it has changed.
+
+    Args:
+        opi_info_path: Path to the opi_info.xml file
+
+    Returns:
+        The set of OPI keys.
+
+    """
+    # Writes which are not yet published are not indexed
+    if disk_path(opi_info_path) != opi_info_path:
+        return _read_opi_keys(read_file(opi_info_path))
+
+    stat = os.stat(opi_info_path)
+    index = _load_opi_key_index(opi_info_path)
+    if index is not None and index["size"] == stat.st_size:
+        if index["mtime_ns"] == stat.st_mtime_ns:
+            return set(index["keys"])
+
+        if index["sha256"] == hash_file(opi_info_path):
+            _save_opi_key_index(
+                opi_info_path,
+                index["keys"],
+                stat.st_mtime_ns,
+                index["size"],
+                index["sha256"],
+            )
+            return set(index["keys"])
+
+    content = read_file(opi_info_path)
+    opi_keys = _read_opi_keys(content)
+    _save_opi_key_index(
+        opi_info_path,
+        opi_keys,
+        stat.st_mtime_ns,
+        len(content),
+        hashlib.sha256(content).hexdigest(),
+    )
+    return opi_keys
+
+
+def is_opi_key_taken(opi_key: str, opi_info_path: PathLike = OPI_INFO) -> bool:
+    """Check if an OPI key already exists in the opi_info.xml file."""
+    return opi_key in get_opi_keys(opi_info_path)
+
+
+def _opi_key_index_path(opi_info_path: PathLike) -> str:
+    name = hashlib.sha256(os.path.realpath(opi_info_path).encode()).hexdigest()
+    return os.path.join(OPI_KEY_INDEX_DIR, f"{name}.json")
+
+
+def _load_opi_key_index(opi_info_path: PathLike) -> dict | None:
+    try:
+        with open(_opi_key_index_path(opi_info_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_opi_key_index(
+    opi_info_path: PathLike,
+    opi_keys: Iterable[str],
+    mtime_ns: int | None,
+    size: int,
+    sha256: str,
+) -> None:
+    """Write the key index of opi_info.xml, replacing the previous one.
+
+    The index is only a cache, so failing to write it is not an error.
+    """
+    index = {
+        "path": os.path.realpath(opi_info_path),
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "sha256": sha256,
+        "keys": sorted(opi_keys),
+    }
+    try:
+        os.makedirs(OPI_KEY_INDEX_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=OPI_KEY_INDEX_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, _opi_key_index_path(opi_info_path))
+    except OSError as e:
+        logging.debug("Could not write OPI key index: %s", e)
+
+
+def _opi_keys_of_content(opi_info_path: PathLike, content: bytes) -> set[str]:
+    """Get the OPI keys from the index if it matches the content."""
+    index = _load_opi_key_index(opi_info_path)
+    if (
+        index is not None
+        and index["size"] == len(content)
+        and index["sha256"] == hashlib.sha256(content).hexdigest()
+    ):
+        return set(index["keys"])
+    return _read_opi_keys(content)
+
+
+def _read_opi_keys(content: bytes) -> set[str]:
+    """Collect the keys of all OPI entries without building the full tree."""
+    opi_keys = set()
+    for _, key in etree.iterparse(BytesIO(content), tag="key"):
+        entry = key.getparent()
+        opis = entry.getparent()
+        if entry.tag == "entry" and opis is not None and opis.tag == "opis":
+            opi_keys.add(key.text)
+            # Drop the entries already seen to keep memory use flat
+            while entry.getprevious() is not None:
+                del opis[0]
+    return opi_keys
+
+
+def _insert_opi_entries(
+    content: bytes, entries: list[ElementTree]
+) -> bytes | None:
+    """Splice entries in before the closing opis tag.
+
+    Args:
+        content: the content of opi_info.xml
+        entries: the entries to insert
+
+    Returns:
+        The new content of opi_info.xml or None if the closing tag was not
+        found on a line of its own.
+
+    """
+    closing_tag = content.rfind(b"</opis>")
+    if closing_tag == -1:
+        return None
+
+    line_start = content.rfind(b"\n", 0, closing_tag) + 1
+    closing_indent = content[line_start:closing_tag]
+    if closing_indent.strip():
+        return None
+
+    newline = b"\r\n" if b"\r\n" in content else b"\n"
+    # The opis element is one level deep so it is indented by one unit
+    indent_unit = closing_indent or b"  "
+    entry_indent = indent_unit * 2
+
+    inserted = []
+    for entry in entries:
+        etree.indent(entry, space=indent_unit.decode(), level=2)
+        serialised = etree.tostring(entry, encoding="UTF-8")
+        inserted.append(
+            entry_indent + serialised.replace(b"\n", newline) + newline
+        )
+
+    return content[:line_start] + b"".join(inserted) + content[line_start:]
+
+
+def _append_opi_entries(content: bytes, entries: list[ElementTree]) -> bytes:
+    """Append entries to the opis and pretty print the whole document."""
+    # Remove blank on input or pretty printing won't work later
+    opi_xml = etree.parse(
+        BytesIO(content), etree.XMLParser(remove_blank_text=True)
+    )
+    opi_xml.find("opis").extend(entries)
+
+    return encode_text(
+        etree.tostring(
+            opi_xml,
+            pretty_print=True,
+            encoding="UTF-8",
+            xml_declaration=True,
+            standalone="yes",
+        ).decode()
+    )
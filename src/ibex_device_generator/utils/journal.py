@@ -0,0 +1,161 @@
+"""Journal of the generator steps completed for a device."""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from os import PathLike
+from threading import Lock
+
+from git import GitCommandError
+
+import ibex_device_generator.utils.placeholders as p
+from ibex_device_generator.exc import CannotOpenRepoError
+from ibex_device_generator.paths import CACHE_DIR
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import FileChanges
+from ibex_device_generator.utils.git_utils import get_repo
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, "journals")
+
+
+class StepJournal:
+    """Records the completed steps of generating a device for a ticket.
+
+    Every completed step is written to a JSON file in the cache directory
+    with the files it wrote and the commit it made, so a failed run can be
+    resumed without repeating them. Steps may complete concurrently.
+    """
+
+    def __init__(
+        self, device: DeviceInfo, ticket_num: int, resume: bool = False
+    ) -> None:
+        """Open the journal of a device and ticket.
+
+        Args:
+            device: the device being generated
+            ticket_num: the ticket the device is generated for
+            resume: whether to keep the steps completed by a previous run,
+                otherwise the journal starts empty
+
+        """
+        self.path = os.path.join(
+            JOURNAL_DIR, f"Ticket{ticket_num}_{device[p.IOC_NAME]}.json"
+        )
+        self.device = {
+            "ioc_name": device[p.IOC_NAME],
+            "device_name": device[p.DEVICE_NAME],
+            "device_count": device[p.DEVICE_COUNT],
+        }
+        self.ticket_num = ticket_num
+        self.steps: dict[str, dict] = {}
+        self._lock = Lock()
+
+        if resume:
+            self.steps = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable journal {self.path}: {e}")
+            return {}
+
+        if journal.get("device") != self.device:
+            logging.warning(
+                f"Ignoring journal {self.path}, it was written for"
+                f" {journal.get('device')}."
+            )
+            return {}
+
+        return journal["steps"]
+
+    def is_complete(self, step: str) -> bool:
+        """Check if a step was completed and its outputs still exist.
+
+        Args:
+            step: the name of the step
+
+        Returns:
+            True if the step is in the journal, every file it wrote exists
+            and its commit, if it made one, is in its repository.
+
+        """
+        entry = self.steps.get(step)
+        if entry is None:
+            return False
+
+        missing = [
+            path for path in entry["outputs"] if not os.path.exists(path)
+        ]
+        if missing:
+            logging.warning(
+                f"Step '{step}' has to run again, its output {missing[0]}"
+                " no longer exists."
+            )
+            return False
+
+        if entry["commit"] is not None and not _commit_exists(
+            entry["repo_path"], entry["commit"]
+        ):
+            logging.warning(
+                f"Step '{step}' has to run again, its commit"
+                f" {entry['commit'][:9]} is not in {entry['repo_path']}."
+            )
+            return False
+
+        return True
+
+    def record(
+        self,
+        step: str,
+        repo_path: PathLike | None,
+        changes: FileChanges | None,
+        commit: str | None,
+    ) -> None:
+        """Record a completed step and write the journal.
+
+        Args:
+            step: the name of the step
+            repo_path: path to the repository modified by the step
+            changes: the files written by the step, if any
+            commit: sha of the commit made by the step, if any
+
+        """
+        outputs = []
+        if changes is not None:
+            paths = changes.added + changes.modified + changes.unchanged
+            outputs = [os.fspath(path) for path in paths]
+
+        with self._lock:
+            self.steps[step] = {
+                "repo_path": repo_path,
+                "outputs": outputs,
+                "commit": commit,
+                "completed": time.time(),
+            }
+            self._save()
+
+    def _save(self) -> None:
+        journal = {
+            "ticket": self.ticket_num,
+            "device": self.device,
+            "steps": self.steps,
+        }
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=JOURNAL_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(journal, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _commit_exists(repo_path: PathLike, sha: str) -> bool:
+    try:
+        get_repo(repo_path).git.cat_file("-e", f"{sha}^{{commit}}")
+    except (CannotOpenRepoError, GitCommandError):
+        return False
+    return True
@@ -0,0 +1,172 @@
+"""Advisory locks on files shared by generator processes."""
+
+import hashlib
+import os
+import socket
+import tempfile
+import time
+from os import PathLike
+from types import TracebackType
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), "ibex_device_generator-locks")
+
+_POLL_INTERVAL = 0.05
+# Lock files without an owner older than this were left behind by a
+# process that died before writing its PID
+_STALE_LOCK_AGE = 60
+
+# Windows API constants used to check whether a process is running
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_STILL_ACTIVE = 259
+_ERROR_ACCESS_DENIED = 5
+
+
+class FileLock:
+    """An advisory lock on a file shared by generator processes.
+
+    The lock is taken on a separate lock file in the temporary directory, as
+    shared files are replaced by renaming them. Where `fcntl` is available
+    the lock file is locked with `flock`, which the OS releases if the
+    process dies. Otherwise the lock file is created exclusively, with the
+    host and PID of the process holding the lock, and removed on release. A
+    lock file is stale if the process holding the lock is no longer running.
+
+    Locks are not reentrant and block threads of the same process too.
+    """
+
+    def __init__(self, path: PathLike) -> None:
+        """Make a lock for a file, it is not acquired yet."""
+        self.path = path
+        name = hashlib.sha256(os.path.realpath(path).encode()).hexdigest()
+        self.lock_path = os.path.join(LOCK_DIR, f"{name}.lock")
+        self._fd: int | None = None
+
+    def acquire(self) -> None:
+        """Block until the lock is acquired."""
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        if fcntl is not None:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            self._fd = fd
+            return
+
+        while True:
+            try:
+                fd = os.open(
+                    self.lock_path, os.O_RDWR | os.O_CREAT | os.O_EXCL
+                )
+            except FileExistsError:
+                self._remove_if_stale()
+                time.sleep(_POLL_INTERVAL)
+                continue
+
+            try:
+                os.write(fd, _lock_owner().encode())
+            except BaseException:
+                os.close(fd)
+                os.remove(self.lock_path)
+                raise
+            self._fd = fd
+            return
+
+    def release(self) -> None:
+        """Release the lock, doing nothing if it is not held."""
+        if self._fd is None:
+            return
+
+        fd, self._fd = self._fd, None
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        else:
+            os.close(fd)
+            os.remove(self.lock_path)
+
+    def _remove_if_stale(self) -> None:
+        try:
+            with open(self.lock_path) as f:
+                owner = f.read()
+            if owner:
+                stale = _is_owner_gone(owner)
+            else:
+                # The owner has not written its PID yet or died before
+                age = time.time() - os.stat(self.lock_path).st_mtime
+                stale = age > _STALE_LOCK_AGE
+
+            if stale:
+                os.remove(self.lock_path)
+        except (FileNotFoundError, PermissionError):
+            # Released meanwhile, or being removed on Windows
+            pass
+
+    def __enter__(self) -> "FileLock":  # noqa: D105
+        self.acquire()
+        return self
+
+    def __exit__(  # noqa: D105
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+
+def _lock_owner() -> str:
+    return f"{socket.gethostname()}\n{os.getpid()}\n"
+
+
+def _is_owner_gone(owner: str) -> bool:
+    """Check whether the process which wrote a lock owner has died.
+
+    The process can only be checked on this host, locks of other hosts are
+    never broken.
+    """
+    host, _, pid = owner.strip().rpartition("\n")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    return not is_process_running(int(pid))
+
+
+def is_process_running(pid: int) -> bool:
+    """Check whether a process of this host is still running."""
+    if os.name == "nt":
+        return _is_windows_process_running(pid)
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process belongs to another user
+        return True
+    return True
+
+
+def _is_windows_process_running(pid: int) -> bool:
+    # os.kill terminates processes on Windows, so ask the Windows API
+    import ctypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    handle = kernel32.OpenProcess(
+        _PROCESS_QUERY_LIMITED_INFORMATION, False, pid
+    )
+    if not handle:
+        return ctypes.get_last_error() == _ERROR_ACCESS_DENIED
+
+    try:
+        exit_code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == _STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
@@ -0,0 +1,103 @@
+"""Profile the steps of the generator with cProfile and tracemalloc."""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import tracemalloc
+from contextlib import contextmanager
+from os import PathLike
+from typing import Generator
+
+
+class StepProfiler:
+    """Profiles each step and writes its statistics into a directory.
+
+    Every step is profiled with cProfile and its statistics are written to a
+    numbered `.pstats` file, which can be loaded with `pstats` or viewers
+    such as snakeviz. A summary of the functions taking the most time is
+    logged after each step and optionally of the lines allocating the most
+    memory too.
+
+    cProfile only profiles the thread a step runs in, so files written
+    concurrently by `jobs` threads are not included.
+    """
+
+    def __init__(
+        self, directory: PathLike, memory: bool = False, top: int = 10
+    ) -> None:
+        """Make a profiler.
+
+        Args:
+            directory: where to write the statistics of each step
+            memory: whether to trace memory allocations with tracemalloc
+            top: the number of hotspots to show in each summary
+
+        """
+        self.directory = directory
+        self.memory = memory
+        self.top = top
+        self._count = 0
+
+    @contextmanager
+    def profile(self, step: str) -> Generator[None, None, None]:
+        """Profile everything run within the block as a step.
+
+        Args:
+            step: the name of the step
+
+        """
+        self._count += 1
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", step).strip("_").lower()
+        stats_path = os.path.join(
+            self.directory, f"{self._count:02d}_{slug}.pstats"
+        )
+
+        # Memory may already be traced, e.g. with python -X tracemalloc
+        start_tracing = self.memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        elif self.memory:
+            tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            snapshot, peak = None, 0
+            if self.memory:
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+            if start_tracing:
+                tracemalloc.stop()
+
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(stats_path)
+            self._log_summary(step, stats_path, profiler, snapshot, peak)
+
+    def _log_summary(
+        self,
+        step: str,
+        stats_path: str,
+        profiler: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot | None,
+        peak: int,
+    ) -> None:
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        summary = [
+            f"Profile of '{step}' written to {stats_path}",
+            out.getvalue(),
+        ]
+
+        if snapshot is not None:
+            summary.append(f"Peak memory allocated: {peak / 1024:.1f} KiB")
+            for statistic in snapshot.statistics("lineno")[: self.top]:
+                summary.append(str(statistic))
+
+        logging.info("\n".join(summary), extra={"highlighter": None})
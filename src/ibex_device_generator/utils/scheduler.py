@@ -0,0 +1,128 @@
+"""Schedule generator steps by their dependencies."""
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+@dataclass
+class Step:
+    """A step of the generator.
+
+    Attributes:
+        name: what the step does, also used as its commit message
+        repo_path: path to the repository modified by the step, if any
+        action: the function to execute as this step
+        args: positional arguments for the action
+        kwargs: keyword arguments for the action
+        after: actions of the steps which must finish before this one
+        outputs: the files and directories the step writes to in its
+            repository, the whole repository if there are none
+        generated_only: whether the step only writes generated files, so
+            they can be committed without scanning the working tree
+
+    """
+
+    name: str
+    repo_path: str | None
+    action: Callable[..., None]
+    args: tuple[Any, ...] = ()
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    after: tuple[Callable[..., None], ...] = ()
+    outputs: tuple[str, ...] = ()
+    generated_only: bool = False
+
+
+def step_dependencies(steps: list[Step]) -> dict[int, set[int]]:
+    """Get the indices of the steps each step has to wait for.
+
+    Besides the explicit dependencies, a step waits for the previous step
+    modifying the same repository so commits to a repository are made in the
+    order the steps are listed. Dependencies on actions which are not among
+    the steps, e.g. skipped in a dry run, are ignored.
+
+    Args:
+        steps: the steps in the order they are listed
+
+    Returns:
+        The indices of the dependencies by the index of each step.
+
+    Raises:
+        ValueError: if a step depends on a step listed after it.
+
+    """
+    index_of_action = {step.action: i for i, step in enumerate(steps)}
+    last_step_in_repo: dict[str, int] = {}
+    dependencies = {}
+
+    for i, step in enumerate(steps):
+        depends_on = {
+            index_of_action[action]
+            for action in step.after
+            if action in index_of_action
+        }
+        if any(dependency >= i for dependency in depends_on):
+            raise ValueError(
+                f"Step '{step.name}' depends on a step listed after it."
+            )
+
+        if step.repo_path is not None:
+            if step.repo_path in last_step_in_repo:
+                depends_on.add(last_step_in_repo[step.repo_path])
+            last_step_in_repo[step.repo_path] = i
+
+        dependencies[i] = depends_on
+
+    return dependencies
+
+
+def run_concurrently(
+    steps: list[Step], run_step: Callable[[Step], None]
+) -> None:
+    """Run every step as soon as the steps it depends on have finished.
+
+    Independent steps run at the same time on a thread pool, so the total
+    time is that of the longest chain of dependent steps. Every step runs in
+    a copy of the caller's context. Once a step fails no more steps are
+    started and the error is raised when the running steps have finished.
+
+    Args:
+        steps: the steps in the order they are listed
+        run_step: the function running a single step
+
+    """
+    dependencies = step_dependencies(steps)
+    pending = list(range(len(steps)))
+    finished: set[int] = set()
+    running: dict[Future, int] = {}
+    error: BaseException | None = None
+
+    with ThreadPoolExecutor(max(len(steps), 1)) as executor:
+        while pending or running:
+            if error is None:
+                for i in [i for i in pending if dependencies[i] <= finished]:
+                    pending.remove(i)
+                    future = executor.submit(
+                        copy_context().run, run_step, steps[i]
+                    )
+                    running[future] = i
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                if future.exception() is None:
+                    finished.add(i)
+                elif error is None:
+                    error = future.exception()
+
+    if error is not None:
+        raise error
@@ -2,7 +2,6 @@
 
 import logging
 import os
-from os import PathLike
 
 import ibex_device_generator.utils.placeholders as p
 from ibex_device_generator.exc import CommandNotFoundError
@@ -11,151 +10,209 @@ from ibex_device_generator.paths import (
     EPICS,
     EPICS_SUPPORT,
     IOC_ROOT,
-    OPI_RESOURCES,
 )
 from ibex_device_generator.utils.command import run_make_command_in
 from ibex_device_generator.utils.device_info import DeviceInfo
-from ibex_device_generator.utils.file_system import add_to_makefile_list
-from ibex_device_generator.utils.git_utils import RepoWrapper
+from ibex_device_generator.utils.file_system import (
+    FileChanges,
+    FileStatus,
+    add_to_makefile_lists,
+    staged_output,
+)
+from ibex_device_generator.utils.git_utils import SubmoduleOptions, get_repo
 from ibex_device_generator.utils.github import github_repo_url
 from ibex_device_generator.utils.gui import (
+    OPI_INFO,
     DuplicateOPIKeyError,
     add_device_opi_to_opi_info,
+    add_device_opis_to_opi_info,
 )
 from ibex_device_generator.utils.rich_utils import rich_print, tree_from_paths
 from ibex_device_generator.utils.templates import (
     get_template,
     populate_template_dir,
+    populate_template_dir_for_each,
 )
 
 
-def create_submodule(device: DeviceInfo) -> None:
-    """Add a new submodule to EPICS top."""
-    epics_repo = RepoWrapper(EPICS)
+def create_submodule(
+    device: DeviceInfo,
+    jobs: int = 1,
+    dry_run: bool = False,
+    submodule_options: SubmoduleOptions | None = None,
+) -> FileChanges:
+    """Add a new submodule to EPICS top, cloned with the given options."""
+    if dry_run:
+        logging.info("Dry run, not adding the submodule with git.")
+    else:
+        epics_repo = get_repo(EPICS)
+
+        epics_repo.create_submodule(
+            device[p.DEVICE_SUPPORT_MODULE_NAME],
+            github_repo_url(device[p.GITHUB_REPO_NAME]),
+            device[p.SUPPORT_MASTER_PATH],
+            submodule_options,
+        )
 
-    epics_repo.create_submodule(
-        device[p.DEVICE_SUPPORT_MODULE_NAME],
-        github_repo_url(device[p.GITHUB_REPO_NAME]),
-        device[p.SUPPORT_MASTER_PATH],
-    )
+    with staged_output(EPICS):
+        # Copy additional template files
+        changes = populate_template_dir(
+            get_template("3"), EPICS, device, jobs=jobs
+        )
 
-    # Copy additional template files
-    added_files = populate_template_dir(get_template("3"), EPICS, device)
+        did_modify_makefile = add_to_makefile_lists(
+            EPICS_SUPPORT, {"SUPPDIRS": [device[p.DEVICE_SUPPORT_MODULE_NAME]]}
+        )
 
-    did_modify_makefile = add_to_makefile_list(
-        EPICS_SUPPORT, "SUPPDIRS", device[p.DEVICE_SUPPORT_MODULE_NAME]
+    changes.record(
+        os.path.join(EPICS_SUPPORT, "Makefile"),
+        FileStatus.MODIFIED if did_modify_makefile else FileStatus.UNCHANGED,
     )
 
-    log_file_changes(
-        added_files=added_files,
-        modified_files=(
-            [os.path.join(EPICS_SUPPORT, "Makefile")]
-            if did_modify_makefile
-            else []
-        ),
-    )
+    log_file_changes(changes)
+    return changes
 
 
-def create_submodule_structure(device: DeviceInfo) -> None:
+def create_submodule_structure(
+    device: DeviceInfo, jobs: int = 1, dry_run: bool = False
+) -> FileChanges:
     """Add basic files into support module folder."""
-    added_files = populate_template_dir(get_template("4"), EPICS, device)
+    with staged_output(EPICS):
+        changes = populate_template_dir(
+            get_template("4"), EPICS, device, jobs=jobs
+        )
 
     # Run make
-    try:
-        run_make_command_in(device[p.SUPPORT_MASTER_PATH])
-    except CommandNotFoundError as e:
-        logging.warning(e)
+    if not dry_run:
+        try:
+            run_make_command_in(device[p.SUPPORT_MASTER_PATH])
+        except CommandNotFoundError as e:
+            logging.warning(e)
 
-    log_file_changes(added_files=added_files)
+    log_file_changes(changes)
+    return changes
 
 
-def create_ioc_from_template(device: DeviceInfo) -> None:
+def create_ioc_from_template(
+    device: DeviceInfo, jobs: int = 1, dry_run: bool = False
+) -> FileChanges:
     """Add basic files into ioc/master's relevant directory for the device."""
-    # For 1st and main IOC app
-    added_files = populate_template_dir(get_template("5_1"), EPICS, device)
+    with staged_output(EPICS):
+        # For 1st and main IOC app
+        changes = populate_template_dir(
+            get_template("5_1"), EPICS, device, jobs=jobs
+        )
 
-    # For nth IOC apps
-    for i in range(2, device[p.DEVICE_COUNT] + 1):
-        subs = device
-        subs[p.INDEX] = "{:02d}".format(i)
+        # For nth IOC apps
+        changes.extend(
+            populate_template_dir_for_each(
+                get_template("5_2"),
+                EPICS,
+                device,
+                p.INDEX,
+                [
+                    "{:02d}".format(i)
+                    for i in range(2, device[p.DEVICE_COUNT] + 1)
+                ],
+                jobs=jobs,
+            )
+        )
 
-        added_files.extend(
-            populate_template_dir(get_template("5_2"), EPICS, subs)
+        # Add IOC to Makefile
+        did_modify_makefile = add_to_makefile_lists(
+            IOC_ROOT, {"IOCDIRS": [device[p.IOC_NAME]]}
         )
 
-    # Add IOC to Makefile
-    did_modify_makefile = add_to_makefile_list(
-        IOC_ROOT, "IOCDIRS", device[p.IOC_NAME]
-    )
-    modified_files = (
-        [os.path.join(IOC_ROOT, "Makefile")] if did_modify_makefile else []
+    changes.record(
+        os.path.join(IOC_ROOT, "Makefile"),
+        FileStatus.MODIFIED if did_modify_makefile else FileStatus.UNCHANGED,
     )
 
     # Run make
-    try:
-        run_make_command_in(device[p.IOC_PATH])
-    except CommandNotFoundError as e:
-        logging.warning(e)
+    if not dry_run:
+        try:
+            run_make_command_in(device[p.IOC_PATH])
+        except CommandNotFoundError as e:
+            logging.warning(e)
 
-    log_file_changes(
-        added_files=added_files,
-        modified_files=modified_files,
-    )
+    log_file_changes(changes)
+    return changes
 
 
-def add_test_framework(device: DeviceInfo) -> None:
+def add_test_framework(device: DeviceInfo, jobs: int = 1) -> FileChanges:
     """Add files for testing device in support directory."""
-    added_files = populate_template_dir(get_template("6"), EPICS, device)
-    log_file_changes(added_files=added_files)
+    with staged_output(EPICS):
+        changes = populate_template_dir(
+            get_template("6"), EPICS, device, jobs=jobs
+        )
+    log_file_changes(changes)
+    return changes
 
 
-def add_lewis_emulator(device: DeviceInfo) -> None:
+def add_lewis_emulator(device: DeviceInfo, jobs: int = 1) -> FileChanges:
     """Add lewis emulator files in support directory."""
-    added_files = populate_template_dir(get_template("7"), EPICS, device)
-    log_file_changes(added_files=added_files)
+    with staged_output(EPICS):
+        changes = populate_template_dir(
+            get_template("7"), EPICS, device, jobs=jobs
+        )
+    log_file_changes(changes)
+    return changes
 
 
-def add_opi_to_gui(device: DeviceInfo) -> None:
+def add_opi_to_gui(
+    device: DeviceInfo, jobs: int = 1, add_opi_info: bool = True
+) -> FileChanges:
     """Add basic OPI with device key and add this into opi_info.xml."""
-    added_files = populate_template_dir(get_template("8"), CLIENT_SRC, device)
+    with staged_output(CLIENT_SRC):
+        changes = populate_template_dir(
+            get_template("8"), CLIENT_SRC, device, jobs=jobs
+        )
+
+        if add_opi_info:
+            try:
+                add_device_opi_to_opi_info(device)
+                changes.record(OPI_INFO, FileStatus.MODIFIED)
+            except DuplicateOPIKeyError as e:
+                logging.warning(e)
+                changes.record(OPI_INFO, FileStatus.UNCHANGED)
+
+    log_file_changes(changes)
+    return changes
+
 
-    try:
-        add_device_opi_to_opi_info(device)
-        modified_files = [os.path.join(OPI_RESOURCES, "opi_info.xml")]
-    except DuplicateOPIKeyError as e:
+def add_opis_to_opi_info(devices: list[DeviceInfo]) -> FileChanges:
+    """Add the OPIs of many devices into opi_info.xml in one write."""
+    changes = FileChanges()
+    with staged_output(CLIENT_SRC):
+        duplicates = add_device_opis_to_opi_info(devices)
+
+    for e in duplicates:
         logging.warning(e)
-        modified_files = []
+    changes.record(
+        OPI_INFO,
+        (
+            FileStatus.UNCHANGED
+            if len(duplicates) == len(devices)
+            else FileStatus.MODIFIED
+        ),
+    )
 
-    log_file_changes(added_files=added_files, modified_files=modified_files)
+    log_file_changes(changes)
+    return changes
 
 
-def log_file_changes(
-    added_files: list[PathLike] = [],
-    modified_files: list[PathLike] = [],
-    removed_files: list[PathLike] = [],
-) -> None:
+def log_file_changes(changes: FileChanges) -> None:
     """Print file trees to the user."""
-    if added_files:
-        logging.info(
-            "[green]Added the following files:\n"
-            + rich_print(
-                tree_from_paths(sorted(added_files, key=str.lower)),
-            ),
-            extra={"markup": True, "highlighter": None},
-        )
-    if modified_files:
-        logging.info(
-            "[yellow]Modified the following files:\n"
-            + rich_print(
-                tree_from_paths(sorted(modified_files, key=str.lower)),
-            ),
-            extra={"markup": True, "highlighter": None},
-        )
-    if removed_files:
-        logging.info(
-            "[red]Removed the following files:\n"
-            + rich_print(
-                tree_from_paths(sorted(removed_files, key=str.lower)),
-            ),
-            extra={"markup": True, "highlighter": None},
-        )
+    for files, description in (
+        (changes.added, "[green]Added the following files:\n"),
+        (changes.modified, "[yellow]Modified the following files:\n"),
+        (changes.unchanged, "[dim]The following files were up to date:\n"),
+    ):
+        if files:
+            logging.info(
+                description
+                + rich_print(
+                    tree_from_paths(sorted(files, key=str.lower)),
+                ),
+                extra={"markup": True, "highlighter": None},
+            )
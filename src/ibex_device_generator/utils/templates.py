@@ -1,14 +1,37 @@
 """Template handling."""
 
+import hashlib
+import json
 import logging
 import os
 import posixpath
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import asdict, dataclass
+from functools import lru_cache
 from importlib.abc import Traversable
 from importlib.resources import files
 from os import PathLike
 from string import Template
+from threading import Lock
+from typing import Any, Iterable, Mapping
 
+from ibex_device_generator.paths import PROJECT_ROOT, TEMPLATES_DIR
 from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import (
+    FileChanges,
+    FileStatus,
+    copy_file,
+    encode_text,
+    file_status,
+    makedirs,
+    write_file,
+)
+from ibex_device_generator.utils.trace import span
+
+TEMPLATE_CACHE_SIZE = 512
+""" Maximum number of compiled templates kept in each cache """
 
 
 class DeviceTemplate(Template):
@@ -18,17 +41,379 @@ class DeviceTemplate(Template):
 
     def apply(self, device: DeviceInfo) -> str:
         """Apply device substitutions to a template."""
-        return self.substitute(device)
+        return compile_template(self.template).render(device)
+
+
+class CompiledTemplate:
+    """A device template parsed once into literal text and placeholders.
+
+    Rendering only joins the literal segments with the substituted values, so
+    the same template can be applied to many substitution maps without
+    re-scanning the text. Behaves like `DeviceTemplate.substitute`.
+    """
+
+    def __init__(self, template: str) -> None:
+        """Parse a template into a reusable substitution plan.
+
+        Args:
+            template: the template text
+
+        Raises:
+            ValueError: if the template contains an ill-formed placeholder.
+
+        """
+        literals = []
+        placeholders = []
+        literal = []
+        position = 0
+
+        for match in DeviceTemplate.pattern.finditer(template):
+            literal.append(template[position : match.start()])
+            position = match.end()
+
+            name = match.group("named") or match.group("braced")
+            if name is not None:
+                literals.append("".join(literal))
+                placeholders.append(name)
+                literal = []
+            elif match.group("escaped") is not None:
+                literal.append(DeviceTemplate.delimiter)
+            else:
+                lines = template[: match.start("invalid")].splitlines(
+                    keepends=True
+                )
+                raise ValueError(
+                    "Invalid placeholder in string: line %d, col %d"
+                    % (len(lines) or 1, len(lines[-1]) if lines else 1)
+                )
+
+        literal.append(template[position:])
+        literals.append("".join(literal))
+
+        self.template = template
+        self._literals = tuple(literals)
+        self._placeholders = tuple(placeholders)
+
+    @classmethod
+    def _from_parts(
+        cls, literals: list[str], placeholders: list[str]
+    ) -> "CompiledTemplate":
+        compiled = cls.__new__(cls)
+        compiled._literals = tuple(literals)
+        compiled._placeholders = tuple(placeholders)
+
+        delimiter = DeviceTemplate.delimiter
+        parts = [literals[0].replace(delimiter, delimiter * 2)]
+        for name, literal in zip(placeholders, literals[1:]):
+            parts.append(f"{delimiter}{{{name}}}")
+            parts.append(literal.replace(delimiter, delimiter * 2))
+        compiled.template = "".join(parts)
+
+        return compiled
+
+    @property
+    def placeholders(self) -> frozenset[str]:
+        """Names of all placeholders used in the template."""
+        return frozenset(self._placeholders)
+
+    def render(self, substitutions: Mapping[str, Any]) -> str:
+        """Substitute placeholders with values from the mapping.
+
+        Args:
+            substitutions: the map of substitutions in the form of
+                {key: substitution}
+
+        Returns:
+            The template text with all placeholders substituted.
+
+        Raises:
+            KeyError: if a placeholder is missing from the substitutions.
+
+        """
+        parts = [self._literals[0]]
+        for name, literal in zip(self._placeholders, self._literals[1:]):
+            parts.append(str(substitutions[name]))
+            parts.append(literal)
+        return "".join(parts)
+
+    def partial(
+        self, substitutions: Mapping[str, Any], keep: Iterable[str]
+    ) -> "CompiledTemplate":
+        """Substitute all placeholders except the ones to keep.
+
+        Args:
+            substitutions: the map of substitutions in the form of
+                {key: substitution}
+            keep: the placeholders to leave in the template
+
+        Returns:
+            A compiled template containing only the kept placeholders.
+
+        Raises:
+            KeyError: if a placeholder is missing from the substitutions.
+
+        """
+        keep = set(keep)
+        literals = [self._literals[0]]
+        placeholders = []
+        for name, literal in zip(self._placeholders, self._literals[1:]):
+            if name in keep:
+                placeholders.append(name)
+                literals.append(literal)
+            else:
+                literals[-1] += str(substitutions[name]) + literal
+        return CompiledTemplate._from_parts(literals, placeholders)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(template: str) -> CompiledTemplate:
+    """Get the compiled form of a template string, parsing it only once."""
+    return CompiledTemplate(template)
+
+
+class TemplateFileCache:
+    """Bounded LRU cache of compiled template files.
+
+    Template files are read and parsed on first use and reused afterwards,
+    keyed by their path and content hash from the template manifest.
+    """
+
+    def __init__(self, maxsize: int = TEMPLATE_CACHE_SIZE) -> None:
+        """Create an empty cache holding at most `maxsize` templates."""
+        self.maxsize = maxsize
+        self._compiled: OrderedDict[tuple[str, str], CompiledTemplate] = (
+            OrderedDict()
+        )
+        self._lock = Lock()
+
+    def get(self, template: Traversable) -> CompiledTemplate:
+        """Get the compiled template for a template file.
+
+        Args:
+            template: the template that is a Traversable representing a file
+
+        Returns:
+            The compiled template of the file's content.
+
+        """
+        template_path = _template_path(template)
+        key = (
+            template_path,
+            get_template_manifest().files[template_path].sha256,
+        )
+
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                return compiled
+
+        compiled = CompiledTemplate(template.read_text())
+
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.maxsize:
+                self._compiled.popitem(last=False)
+
+        return compiled
+
+    def clear(self) -> None:
+        """Remove all compiled templates from the cache."""
+        with self._lock:
+            self._compiled.clear()
+
+    def __len__(self) -> int:
+        """Get the number of compiled templates in the cache."""
+        return len(self._compiled)
+
+
+template_file_cache = TemplateFileCache()
 
 
 # __pycache__ folders get added to template directories when this package is
 # installed through pip
 ignore_dirs = {"__pycache__"}
 
+TEMPLATE_MANIFEST_NAME = "template_manifest.json"
+""" Name of the template manifest file in the package root """
+
+
+@dataclass(frozen=True)
+class TemplateManifestEntry:
+    """A template file as recorded in the template manifest."""
+
+    path: str
+    """ Path relative to the templates directory, separated by '/' """
+
+    size: int
+    """ Size of the template file in bytes """
+
+    sha256: str
+    """ Hash of the template file's content """
+
+    has_placeholders: bool
+    """ Whether the content contains the delimiter and needs substitution """
+
+    placeholders: tuple[str, ...]
+    """ Placeholders used in the content of the file """
+
+
+class TemplateManifest:
+    """Index of all files within the templates directory.
+
+    The manifest is generated when the templates change and shipped with the
+    package, so templates can be located without walking the package tree.
+    """
+
+    def __init__(self, entries: Iterable[TemplateManifestEntry]) -> None:
+        """Make a manifest from its entries."""
+        self.files = {
+            entry.path: entry
+            for entry in sorted(entries, key=lambda entry: entry.path)
+        }
+        self.dirs = {""}
+        for path in self.files:
+            parent = posixpath.dirname(path)
+            while parent not in self.dirs:
+                self.dirs.add(parent)
+                parent = posixpath.dirname(parent)
+
+    def is_file(self, path: str) -> bool:
+        """Check whether path is a template file."""
+        return path in self.files
+
+    def is_dir(self, path: str) -> bool:
+        """Check whether path is a template directory."""
+        return path in self.dirs
+
+    def files_under(self, path: str) -> list[TemplateManifestEntry]:
+        """Get all template files within a template directory.
+
+        Args:
+            path: the template directory relative to the templates directory
+
+        Returns:
+            The entries of all files in the directory and its subdirectories
+            ordered by path.
+
+        """
+        prefix = f"{path}/" if path else ""
+        return [
+            entry
+            for entry_path, entry in self.files.items()
+            if entry_path.startswith(prefix)
+        ]
+
+    def __eq__(self, other: object) -> bool:
+        """Compare manifests by their entries."""
+        if not isinstance(other, TemplateManifest):
+            return NotImplemented
+        return self.files == other.files
+
+    def to_json(self) -> str:
+        """Serialise the manifest."""
+        return (
+            json.dumps(
+                {"files": [asdict(entry) for entry in self.files.values()]},
+                indent=2,
+            )
+            + "\n"
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "TemplateManifest":
+        """Deserialise a manifest."""
+        return cls(
+            TemplateManifestEntry(
+                path=entry["path"],
+                size=entry["size"],
+                sha256=entry["sha256"],
+                has_placeholders=entry["has_placeholders"],
+                placeholders=tuple(entry["placeholders"]),
+            )
+            for entry in json.loads(text)["files"]
+        )
+
+
+def build_template_manifest(
+    templates_dir: PathLike = TEMPLATES_DIR,
+) -> TemplateManifest:
+    """Build the template manifest by walking the templates directory.
+
+    Args:
+        templates_dir: the templates directory on the disk
+
+    Returns:
+        The manifest of all template files, excluding `ignore_dirs`.
+
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(templates_dir):
+        dirnames[:] = [name for name in dirnames if name not in ignore_dirs]
+
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            with open(file_path, "rb") as f:
+                content = f.read()
+
+            text = content.decode("utf-8")
+            relative_path = os.path.relpath(file_path, templates_dir)
+
+            entries.append(
+                TemplateManifestEntry(
+                    path=relative_path.replace(os.sep, posixpath.sep),
+                    size=len(content),
+                    sha256=hashlib.sha256(content).hexdigest(),
+                    has_placeholders=DeviceTemplate.delimiter in text,
+                    placeholders=tuple(
+                        sorted(CompiledTemplate(text).placeholders)
+                    ),
+                )
+            )
+
+    return TemplateManifest(entries)
+
+
+def write_template_manifest() -> None:
+    """Regenerate the template manifest shipped with the package."""
+    manifest_path = os.path.join(PROJECT_ROOT, TEMPLATE_MANIFEST_NAME)
+    with open(manifest_path, "w", newline="\n") as f:
+        f.write(build_template_manifest().to_json())
+
+
+@lru_cache(maxsize=None)
+def get_template_manifest() -> TemplateManifest:
+    """Load the template manifest shipped with the package."""
+    return TemplateManifest.from_json(
+        files("ibex_device_generator")
+        .joinpath(TEMPLATE_MANIFEST_NAME)
+        .read_text()
+    )
+
+
+def _templates_root() -> Traversable:
+    return files("ibex_device_generator").joinpath("templates")
+
+
+def _template_path(template: Traversable) -> str:
+    """Get the manifest path of a template resource."""
+    root = str(_templates_root()).rstrip("/\\")
+    path = str(template)
+
+    if not path.startswith(root):
+        raise ValueError(
+            f"'{template}' is not within the templates directory."
+        )
+
+    return path[len(root) :].replace("\\", posixpath.sep).strip(posixpath.sep)
+
 
 def get_template(*pathsegments: str) -> Traversable:
     """Get a resource located in ibex_device_generator.templates.
 
+    The template is looked up in the template manifest, the package tree
+    itself is not accessed.
+
     Args:
         *pathsegments: Segments as subdirectories within the
             `templates/` directory. If called without any arguments, it returns
@@ -39,13 +424,173 @@ def get_template(*pathsegments: str) -> Traversable:
         directory/file
 
     """
-    descendants = posixpath.sep.join(pathsegments)
-    item = files("ibex_device_generator.templates").joinpath(descendants)
+    descendants = posixpath.sep.join(pathsegments).strip(posixpath.sep)
+    manifest = get_template_manifest()
 
-    if item.is_file() or item.is_dir():
-        return item
+    if manifest.is_file(descendants) or manifest.is_dir(descendants):
+        return _templates_root().joinpath(descendants)
     else:
-        raise ValueError(f"Template does not exist at '{item}'")
+        raise ValueError(f"Template does not exist at '{descendants}'")
+
+
+@dataclass(frozen=True)
+class _TemplateFilePlan:
+    """A template file prepared for populating.
+
+    The destination path and content are compiled, so populating the same
+    template file many times does not require parsing it again.
+    """
+
+    template: Traversable
+    entry: TemplateManifestEntry
+    destination: tuple[CompiledTemplate, ...]
+    """ Compiled segments of the destination relative to the target dir """
+
+    content: CompiledTemplate | None
+    """ Compiled content or None if the file is copied as it is """
+
+    def partial(
+        self, substitutions: Mapping[str, Any], keep: Iterable[str]
+    ) -> "_TemplateFilePlan":
+        """Substitute everything except the placeholders to keep."""
+        return _TemplateFilePlan(
+            self.template,
+            self.entry,
+            tuple(
+                segment.partial(substitutions, keep)
+                for segment in self.destination
+            ),
+            (
+                self.content.partial(substitutions, keep)
+                if self.content is not None
+                else None
+            ),
+        )
+
+
+def _plan_template_file(
+    template: Traversable, destination: Iterable[str]
+) -> _TemplateFilePlan:
+    entry = get_template_manifest().files.get(_template_path(template))
+    if entry is None:
+        raise ValueError(f"Template at '{template}' is not a file.")
+
+    return _TemplateFilePlan(
+        template,
+        entry,
+        tuple(compile_template(segment) for segment in destination),
+        template_file_cache.get(template) if entry.has_placeholders else None,
+    )
+
+
+def _plan_template_dir(template: Traversable) -> list[_TemplateFilePlan]:
+    template_path = _template_path(template)
+    manifest = get_template_manifest()
+
+    if not manifest.is_dir(template_path):
+        raise ValueError(f"Template at '{template}' is not a directory.")
+
+    plan = []
+    for entry in manifest.files_under(template_path):
+        relative_path = posixpath.relpath(entry.path, template_path or ".")
+        plan.append(
+            _plan_template_file(
+                template.joinpath(relative_path),
+                relative_path.split(posixpath.sep),
+            )
+        )
+    return plan
+
+
+@dataclass(frozen=True)
+class _RenderedFile:
+    """A template file rendered in memory, ready to be written."""
+
+    template: Traversable
+    entry: TemplateManifestEntry
+    destination: str
+    content: bytes | None
+    """ Substituted content or None if the template is copied as it is """
+
+
+def _render_planned_file(
+    plan: _TemplateFilePlan, into: PathLike, substitutions: Mapping[str, Any]
+) -> _RenderedFile:
+    return _RenderedFile(
+        plan.template,
+        plan.entry,
+        os.path.join(
+            into,
+            *(segment.render(substitutions) for segment in plan.destination),
+        ),
+        (
+            encode_text(plan.content.render(substitutions))
+            if plan.content is not None
+            else None
+        ),
+    )
+
+
+def _write_rendered_file(rendered: _RenderedFile) -> FileStatus:
+    logging.debug(
+        (
+            f"Using template file '{rendered.template}'\n"
+            f"to populate '{rendered.destination}'"
+        )
+    )
+
+    if rendered.content is not None:
+        return write_file(rendered.destination, rendered.content)
+
+    status = file_status(
+        rendered.destination, rendered.entry.size, rendered.entry.sha256
+    )
+    if status is not FileStatus.UNCHANGED:
+        copy_file(rendered.template, rendered.destination)
+    return status
+
+
+def _write_rendered_files(
+    rendered_files: list[_RenderedFile], jobs: int = 1
+) -> FileChanges:
+    """Write rendered files to the disk.
+
+    Files that already exist with the same content are not rewritten.
+
+    Args:
+        rendered_files: the files to write
+        jobs: the number of files to write concurrently
+
+    Returns:
+        The paths of the files in the order they were given.
+
+    """
+    for directory in dict.fromkeys(
+        os.path.dirname(rendered.destination) for rendered in rendered_files
+    ):
+        makedirs(directory)
+
+    with span("write files", "io", files=len(rendered_files), jobs=jobs):
+        if jobs > 1 and len(rendered_files) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                # Each write runs in a copy of this context to see staged
+                # output
+                futures = [
+                    executor.submit(
+                        copy_context().run, _write_rendered_file, rendered
+                    )
+                    for rendered in rendered_files
+                ]
+                statuses = [future.result() for future in futures]
+        else:
+            statuses = [
+                _write_rendered_file(rendered) for rendered in rendered_files
+            ]
+
+    changes = FileChanges()
+    for rendered, status in zip(rendered_files, statuses):
+        changes.record(rendered.destination, status)
+    return changes
 
 
 def populate_template_file(
@@ -53,6 +598,9 @@ def populate_template_file(
 ) -> PathLike:
     """Populate a single template file into a directory on the disk.
 
+    Files without placeholders are copied byte for byte, without decoding
+    or newline translation.
+
     Args:
         template: the template that is a Traversable representing a file
         into: the destination into which resulting file is put
@@ -66,37 +614,25 @@ def populate_template_file(
         ValueError: if the template is not a file.
 
     """
-    if not template.is_file():
-        raise ValueError(f"Template at '{template}' is not a file.")
-
-    substituted_destination = os.path.join(
-        into, DeviceTemplate(template.name).substitute(substitutions)
-    )
-
-    logging.debug(
-        (
-            f"Using template file '{template}'\n"
-            f"to populate '{substituted_destination}'"
-        )
+    rendered = _render_planned_file(
+        _plan_template_file(template, [template.name]), into, substitutions
     )
-
-    os.makedirs(os.path.dirname(substituted_destination), exist_ok=True)
-
-    with open(substituted_destination, "w") as file:
-        substituted_content = DeviceTemplate(template.read_text()).substitute(
-            substitutions
-        )
-
-        file.write(substituted_content)
-    return substituted_destination
+    makedirs(os.path.dirname(rendered.destination))
+    _write_rendered_file(rendered)
+    return rendered.destination
 
 
 def populate_template_dir(
-    template: Traversable, into: PathLike, substitutions: dict[str, str]
-) -> list[PathLike]:
+    template: Traversable,
+    into: PathLike,
+    substitutions: dict[str, str],
+    jobs: int = 1,
+) -> FileChanges:
     """Populate a template directory into a location on the disk.
 
-    This only creates folders that contain at least one file.
+    This only creates folders that contain at least one file. All files are
+    rendered in memory first and then written, by a pool of `jobs` threads
+    if more than one job is requested.
 
     Args:
         template: the template that is a Traversable representing either
@@ -104,34 +640,70 @@ def populate_template_dir(
         into: the destination into which resulting items are put
         substitutions: The map of substitutions in the form of
             {key: substitution}
+        jobs: the number of files to write concurrently
 
     Returns:
-        A list of paths to the new files made from the template.
+        The paths to the files made from the template, split by whether they
+        were added, modified or already up to date.
 
     """
-    if not template.is_dir():
-        raise ValueError(f"Template at '{template}' is not a directory.")
-
-    files = []
+    with span(
+        "populate_template_dir", "templates", template=_template_path(template)
+    ):
+        with span("render templates", "templates"):
+            rendered_files = [
+                _render_planned_file(plan, into, substitutions)
+                for plan in _plan_template_dir(template)
+            ]
+        return _write_rendered_files(rendered_files, jobs)
+
+
+def populate_template_dir_for_each(
+    template: Traversable,
+    into: PathLike,
+    substitutions: dict[str, str],
+    placeholder: str,
+    values: Iterable[str],
+    jobs: int = 1,
+) -> FileChanges:
+    """Populate a template directory once for each value of a placeholder.
+
+    The template directory is analysed once and everything that does not
+    depend on the placeholder is substituted up front. Only the placeholder's
+    slots are filled in for each value.
 
-    if template.name in ignore_dirs:
-        logging.debug(
-            f"[yellow]Ignoring template directory '{template}'",
-            extra={"markup": True},
-        )
-        return files
+    Args:
+        template: the template that is a Traversable representing a
+            directory.
+        into: the destination into which resulting items are put
+        substitutions: The map of substitutions in the form of
+            {key: substitution}
+        placeholder: the placeholder that takes a different value each time
+        values: the values of the placeholder
+        jobs: the number of files to write concurrently
 
-    for item in template.iterdir():
-        if item.is_file():
-            files.append(populate_template_file(item, into, substitutions))
+    Returns:
+        The paths to the files made from the template, in the order of the
+        values.
 
-        if item.is_dir():
-            substituted_destination = os.path.join(
-                into, DeviceTemplate(item.name).substitute(substitutions)
-            )
-            files.extend(
-                populate_template_dir(
-                    item, substituted_destination, substitutions
-                )
-            )
-    return files
+    """
+    with span(
+        "populate_template_dir_for_each",
+        "templates",
+        template=_template_path(template),
+    ):
+        with span("render templates", "templates"):
+            plan = [
+                file_plan.partial(substitutions, keep={placeholder})
+                for file_plan in _plan_template_dir(template)
+            ]
+            rendered_files = [
+                _render_planned_file(file_plan, into, {placeholder: value})
+                for value in values
+                for file_plan in plan
+            ]
+        return _write_rendered_files(rendered_files, jobs)
+
+
+if __name__ == "__main__":
+    write_template_manifest()
@@ -0,0 +1,144 @@
+"""Trace where a run of the generator spends its time.
+
+Spans are recorded while a `Tracer` is active and written in the Chrome
+trace event format, which can be loaded in Perfetto or chrome://tracing.
+Outside of `tracing()` spans and counters do nothing.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from os import PathLike
+from typing import Any, Generator
+
+FILES_WRITTEN = "files_written"
+BYTES_WRITTEN = "bytes_written"
+SUBPROCESSES = "subprocesses"
+
+
+@dataclass
+class Span:
+    """A timed section of a run with the I/O made within it.
+
+    Counters include the I/O of nested spans.
+    """
+
+    name: str
+    category: str
+    args: dict[str, Any]
+    parent: "Span | None"
+    start: int = field(default_factory=time.perf_counter_ns)
+    counters: dict[str, int] = field(
+        default_factory=lambda: dict.fromkeys(
+            (FILES_WRITTEN, BYTES_WRITTEN, SUBPROCESSES), 0
+        )
+    )
+
+
+class Tracer:
+    """Collects the spans of a run as Chrome trace events."""
+
+    def __init__(self) -> None:
+        """Make a tracer with no events."""
+        self.events: list[dict[str, Any]] = []
+        self._start = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def add(self, span: Span, end: int) -> None:
+        """Add a finished span as a complete event."""
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self._start) / 1000,
+            "dur": (end - span.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {**span.args, **span.counters},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, span: Span | None, counter: str, value: int) -> None:
+        """Add to a counter of a span and the spans it is nested in."""
+        with self._lock:
+            while span is not None:
+                span.counters[counter] += value
+                span = span.parent
+
+    def write(self, path: PathLike) -> None:
+        """Write the events to a Chrome trace event JSON file."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+        with open(path, "w") as f:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms"}, f, indent=1
+            )
+
+
+_active_tracer: ContextVar[Tracer | None] = ContextVar(
+    "active_tracer", default=None
+)
+_current_span: ContextVar[Span | None] = ContextVar(
+    "current_span", default=None
+)
+
+
+@contextmanager
+def tracing() -> Generator[Tracer, None, None]:
+    """Record the spans of everything run within the block.
+
+    Yields:
+        The tracer collecting the spans.
+
+    """
+    tracer = Tracer()
+    token = _active_tracer.set(tracer)
+    try:
+        with span("ibex_device_generator", "run"):
+            yield tracer
+    finally:
+        _active_tracer.reset(token)
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Generator[None, None, None]:
+    """Time a section of a run.
+
+    Args:
+        name: what is being done
+        category: the kind of work, e.g. step, git or github
+        **args: details shown with the span
+
+    """
+    tracer = _active_tracer.get()
+    if tracer is None:
+        yield
+        return
+
+    current = Span(name, category, args, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        tracer.add(current, time.perf_counter_ns())
+
+
+def count_file_written(size: int) -> None:
+    """Count a file of the given size written within the current span."""
+    tracer = _active_tracer.get()
+    if tracer is not None:
+        tracer.count(_current_span.get(), FILES_WRITTEN, 1)
+        tracer.count(_current_span.get(), BYTES_WRITTEN, size)
+
+
+def count_subprocess() -> None:
+    """Count a subprocess started within the current span."""
+    tracer = _active_tracer.get()
+    if tracer is not None:
+        tracer.count(_current_span.get(), SUBPROCESSES, 1)
@@ -0,0 +1,104 @@
+"""A local stand-in for the GitHub API used by tests and benchmarks."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any, Callable
+
+
+class GitHubStandIn:
+    """Serves canned GitHub API responses from a local HTTP server.
+
+    Responses are queued per method and path, the last response of a queue
+    is repeated. Unknown requests get a 404. Every request is recorded.
+
+    Use as a context manager and point `GITHUB_API_URL` to `url`.
+    """
+
+    def __init__(self) -> None:
+        """Make a stand-in with no responses, it is not serving yet."""
+        self.responses: dict[tuple[str, str], list[tuple]] = {}
+        self.requests: list[dict[str, Any]] = []
+        self.on_request: Callable[[str, str], None] | None = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.stand_in = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_port
+
+    def respond(
+        self,
+        method: str,
+        path: str,
+        status: int,
+        body: Any = None,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        """Queue a response to a request."""
+        self.responses.setdefault((method, path), []).append(
+            (status, body, headers or {})
+        )
+
+    def _next_response(self, method: str, path: str) -> tuple:
+        with self._lock:
+            queue = self.responses.get((method, path))
+            if not queue:
+                return 404, {"message": "Not Found"}, {}
+            return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def __enter__(self) -> "GitHubStandIn":  # noqa: D105
+        threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.01},
+            daemon=True,
+        ).start()
+        return self
+
+    def __exit__(  # noqa: D105
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self) -> None:
+        stand_in: GitHubStandIn = self.server.stand_in
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+
+        with stand_in._lock:
+            stand_in.requests.append(
+                {
+                    "method": self.command,
+                    "path": self.path,
+                    "headers": dict(self.headers),
+                    "json": json.loads(body) if body else None,
+                }
+            )
+        if stand_in.on_request is not None:
+            stand_in.on_request(self.command, self.path)
+
+        status, response_body, headers = stand_in._next_response(
+            self.command, self.path
+        )
+        content = b"" if response_body is None else json.dumps(response_body)
+        content = content.encode() if isinstance(content, str) else content
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_PUT = do_POST = do_PATCH = _handle  # noqa: N815
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Keep the test output quiet."""
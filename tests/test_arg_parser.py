@@ -0,0 +1,32 @@
+"""Test parsing the command line arguments."""
+
+from unittest import TestCase
+
+from ibex_device_generator.utils.arg_parser import parse_arguments
+
+
+class ParseArgumentsTests(TestCase):
+    """Test choosing the command and parsing its arguments."""
+
+    def test_generate_is_the_default_command(self) -> None:
+        """Check that a device is generated if no command is given."""
+        args = parse_arguments(
+            ["--device_name", "New Device", "ND1", "1", "--offline"]
+        )
+
+        self.assertEqual(args.command, "generate")
+        self.assertEqual(args.ioc_name, "ND1")
+        self.assertEqual(args.device_name, "New Device")
+        self.assertTrue(args.offline)
+
+    def test_options_are_parsed_before_and_after_command(self) -> None:
+        """Check that options before a command are not overridden."""
+        args = parse_arguments(
+            ["--log_level", "DEBUG", "batch", "devices.json", "--jobs", "4"]
+        )
+
+        self.assertEqual(args.command, "batch")
+        self.assertEqual(args.manifest, "devices.json")
+        self.assertEqual(args.log_level, "DEBUG")
+        self.assertEqual(args.jobs, 4)
+        self.assertFalse(args.dry_run)
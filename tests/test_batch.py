@@ -0,0 +1,275 @@
+"""Test loading device manifests for batch generation."""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import ibex_device_generator.utils.batch as batch
+import ibex_device_generator.utils.gui as gui
+import ibex_device_generator.utils.journal as journal
+from ibex_device_generator.exc import (
+    IBEXDeviceGeneratorError,
+    InvalidDeviceManifestError,
+)
+from ibex_device_generator.ibex_device_generator import IBEXDeviceGenerator
+from ibex_device_generator.utils.batch import (
+    BatchEntry,
+    find_duplicate_opi_keys,
+    load_device_manifest,
+    run_batch,
+)
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import FileChanges, write_file
+from ibex_device_generator.utils.git_utils import (
+    RepoWrapper,
+    SubmoduleOptions,
+)
+from ibex_device_generator.utils.gui import DuplicateOPIKeyError
+from ibex_device_generator.utils.placeholders import IOC_NAME
+from ibex_device_generator.utils.scheduler import Step
+
+OPI_INFO_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<opiDescriptions>
+  <opis>
+    <entry>
+      <key>OLD</key>
+    </entry>
+  </opis>
+</opiDescriptions>
+"""
+
+
+class DeviceManifestTests(TestCase):
+    """Test reading the devices to generate from manifest files."""
+
+    def setUp(self) -> None:
+        """Create a directory for manifests."""
+        self._tmpdir = TemporaryDirectory()
+        self.expected_entries = [
+            BatchEntry("ND1", 1234, "New Device 1", 3),
+            BatchEntry("ND2", 1235, "ND2", 2),
+        ]
+
+    def tearDown(self) -> None:
+        """Remove manifests."""
+        self._tmpdir.cleanup()
+
+    def _write_manifest(self, name: str, content: str) -> str:
+        path = os.path.join(self._tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_json_manifest(self) -> None:
+        """Check that devices are read from JSON with defaults applied."""
+        path = self._write_manifest(
+            "devices.json",
+            json.dumps(
+                {
+                    "devices": [
+                        {
+                            "ioc_name": "ND1",
+                            "device_name": "New Device 1",
+                            "device_count": 3,
+                            "ticket": 1234,
+                        },
+                        {"ioc_name": "ND2", "ticket": 1235},
+                    ]
+                }
+            ),
+        )
+
+        self.assertEqual(load_device_manifest(path), self.expected_entries)
+
+    def test_csv_manifest(self) -> None:
+        """Check that devices are read from CSV with defaults applied."""
+        path = self._write_manifest(
+            "devices.csv",
+            "ioc_name,device_name,device_count,ticket\n"
+            "ND1,New Device 1,3,1234\n"
+            "ND2,,,1235\n",
+        )
+
+        self.assertEqual(load_device_manifest(path), self.expected_entries)
+
+    def test_missing_column_raises_error(self) -> None:
+        """Check that devices without a ticket are rejected."""
+        path = self._write_manifest("devices.csv", "ioc_name\nND1\n")
+
+        with self.assertRaises(InvalidDeviceManifestError):
+            load_device_manifest(path)
+
+    def test_unsupported_file_type_raises_error(self) -> None:
+        """Check that unknown manifest formats are rejected."""
+        path = self._write_manifest("devices.txt", "ND1 1234")
+
+        with self.assertRaises(InvalidDeviceManifestError):
+            load_device_manifest(path)
+
+
+class RunBatchTests(TestCase):
+    """Test generating the devices of a batch."""
+
+    def setUp(self) -> None:
+        """Write an opi_info.xml file and stand in for the generator."""
+        self._tmpdir = TemporaryDirectory()
+        opi_info = os.path.join(self._tmpdir.name, "opi_info.xml")
+        with open(opi_info, "w") as f:
+            f.write(OPI_INFO_XML)
+
+        self.generator = patch.object(batch, "IBEXDeviceGenerator").start()
+        patch.object(batch, "OPI_INFO", opi_info).start()
+        patch.object(
+            gui,
+            "OPI_KEY_INDEX_DIR",
+            os.path.join(self._tmpdir.name, "index"),
+        ).start()
+        self.entries = [
+            BatchEntry("OLD", 1, "OLD"),
+            BatchEntry("ND1", 2, "New Device"),
+            BatchEntry("ND1", 3, "ND1"),
+        ]
+
+    def tearDown(self) -> None:
+        """Stop standing in for the generator and remove opi_info.xml."""
+        patch.stopall()
+        self._tmpdir.cleanup()
+
+    def test_duplicate_opi_keys_are_found_up_front(self) -> None:
+        """Check that keys in opi_info.xml and the batch are duplicates."""
+        errors = find_duplicate_opi_keys(self.entries)
+
+        self.assertIsInstance(errors[0], DuplicateOPIKeyError)
+        self.assertIsNone(errors[1])
+        self.assertIsInstance(errors[2], DuplicateOPIKeyError)
+
+    def test_devices_with_duplicate_opi_keys_are_not_generated(self) -> None:
+        """Check that only devices with a free OPI key are generated."""
+        results = run_batch(self.entries, dry_run=True)
+
+        self.assertEqual(
+            [result.succeeded for result in results], [False, True, False]
+        )
+        self.generator.assert_called_once()
+        self.assertFalse(self.generator.call_args.kwargs["add_opi_info"])
+
+    def test_opis_are_added_in_one_step(self) -> None:
+        """Check that the OPIs of all generated devices are added at once."""
+        results = run_batch(self.entries, dry_run=True, resume=True)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        generator = self.generator.return_value
+        generator.opi_info_step.assert_called_once()
+        self.assertEqual(
+            len(generator.opi_info_step.call_args.args[0]), len(self.entries)
+        )
+        generator.run.assert_called_with([generator.opi_info_step()])
+
+
+def _add_device_file(device: DeviceInfo, repo_path: str) -> FileChanges:
+    if device[IOC_NAME] == "FAIL":
+        raise IBEXDeviceGeneratorError("Device file cannot be written.")
+
+    path = os.path.join(repo_path, device[IOC_NAME])
+    changes = FileChanges()
+    changes.record(path, write_file(path, device[IOC_NAME].encode()))
+    return changes
+
+
+class GitBatchTests(TestCase):
+    """Test committing the devices of a batch in git repositories."""
+
+    def setUp(self) -> None:
+        """Make two repositories which steps add a file for each device to."""
+        self._tmpdir = TemporaryDirectory()
+        self.repos = [
+            self._make_repo(os.path.join(self._tmpdir.name, name))
+            for name in ("EPICS", "ibex_gui")
+        ]
+
+        def steps(generator: IBEXDeviceGenerator) -> list[Step]:
+            return [
+                Step(
+                    f"Add {os.path.basename(repo.working_tree_dir)} file",
+                    repo.working_tree_dir,
+                    _add_device_file,
+                    (generator.device, repo.working_tree_dir),
+                )
+                for repo in self.repos
+            ]
+
+        patch.object(IBEXDeviceGenerator, "steps", steps).start()
+        patch.object(
+            journal,
+            "JOURNAL_DIR",
+            os.path.join(self._tmpdir.name, "journals"),
+        ).start()
+
+    def tearDown(self) -> None:
+        """Remove the repositories."""
+        patch.stopall()
+        for repo in self.repos:
+            repo.close()
+        self._tmpdir.cleanup()
+
+    def _make_repo(self, path: str) -> RepoWrapper:
+        repo = RepoWrapper(path, init=True)
+        with repo.config_writer() as config:
+            config.set_value("user", "name", "Test")
+            config.set_value("user", "email", "test@example.com")
+        with open(os.path.join(path, "README.md"), "w") as f:
+            f.write("Hello there.")
+        repo.index.add(["README.md"])
+        repo.index.commit("Add README")
+        return repo
+
+    def _run_batch(self, entries: list[BatchEntry]) -> list:
+        return run_batch(
+            entries,
+            use_git=True,
+            github_token=None,
+            interactive=False,
+            submodule_options=SubmoduleOptions(offline=True),
+        )
+
+    def test_each_device_is_committed_on_its_own_ticket_branch(self) -> None:
+        """Check that devices after the first are committed from main."""
+        results = self._run_batch(
+            [
+                BatchEntry("DEVA", 201, "Dev A"),
+                BatchEntry("DEVB", 202, "Dev B"),
+            ]
+        )
+
+        self.assertTrue(all(result.succeeded for result in results))
+        for repo in self.repos:
+            self.assertEqual(str(repo.active_branch), "main")
+            self.assertEqual(
+                repo.git.ls_tree(
+                    "--name-only", "Ticket201_Add_IOC_Dev_A"
+                ).split(),
+                ["DEVA", "README.md"],
+            )
+            self.assertEqual(
+                repo.git.ls_tree(
+                    "--name-only", "Ticket202_Add_IOC_Dev_B"
+                ).split(),
+                ["DEVB", "README.md"],
+            )
+
+    def test_failed_device_is_reported_and_next_device_is_committed(
+        self,
+    ) -> None:
+        """Check that a failing device says why and does not stop others."""
+        results = self._run_batch(
+            [BatchEntry("FAIL", 201, "Fail"), BatchEntry("DEVB", 202, "Dev B")]
+        )
+
+        self.assertFalse(results[0].succeeded)
+        self.assertIn("Device file cannot be written.", results[0].message)
+        self.assertTrue(results[1].succeeded)
+        for repo in self.repos:
+            self.assertEqual(str(repo.active_branch), "main")
+            self.assertIn("Ticket202_Add_IOC_Dev_B", repo.branches)
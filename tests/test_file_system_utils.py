@@ -1,8 +1,30 @@
 # ruff: noqa: ANN201, D100, D101, D102, N802, E501
 
-from unittest import TestCase
+import os
+import socket
+import stat
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase, skipIf
+from unittest.mock import patch
 
-from ibex_device_generator.utils.file_system import _add_entry_to_list
+import ibex_device_generator.utils.file_system as file_system
+import ibex_device_generator.utils.locks as locks
+from ibex_device_generator.utils.file_system import (
+    FileStatus,
+    MakefileLists,
+    _add_entry_to_list,
+    add_to_makefile_list,
+    add_to_makefile_lists,
+    copy_file,
+    in_memory_output,
+    read_file,
+    remove_stale_stages,
+    staged_output,
+    write_file,
+)
 
 
 class FileSystemUtilsTests(TestCase):
@@ -84,3 +106,321 @@ class FileSystemUtilsTests(TestCase):
 
         # Assert
         self.assertEqual(iocdirs_input, actual_output)
+
+    def test_GIVEN_entry_is_prefix_of_existing_entry_WHEN_add_entry_to_list_text_THEN_entry_is_added(
+        self,
+    ):
+        iocdirs_input = ["IOCDIRS = AG3631A ABCD\n", "\n"]
+
+        actual_output = _add_entry_to_list(iocdirs_input, "IOCDIRS", "ABC")
+
+        self.assertEqual(
+            actual_output,
+            ["IOCDIRS = AG3631A ABCD\n", "IOCDIRS += ABC\n", "\n"],
+        )
+
+    def test_GIVEN_list_with_continuation_lines_WHEN_parse_makefile_lists_THEN_all_entries_are_found(
+        self,
+    ):
+        makefile_lists = MakefileLists(
+            [
+                "SUPPDIRS = ASYN \\\n",
+                "    STREAM # comment\n",
+                "OTHER = ASYN\n",
+            ]
+        )
+
+        self.assertEqual(
+            list(makefile_lists.entries["SUPPDIRS"]), ["ASYN", "STREAM"]
+        )
+        self.assertEqual(makefile_lists.ends["SUPPDIRS"], 1)
+        self.assertNotIn(("SUPPDIRS", "OTHER"), makefile_lists)
+
+    def test_GIVEN_many_entries_WHEN_add_to_makefile_lists_THEN_entries_are_added_in_order_once(
+        self,
+    ):
+        with TemporaryDirectory() as tmpdir:
+            makefile = os.path.join(tmpdir, "Makefile")
+            with open(makefile, "w") as f:
+                f.write("IOCDIRS = OLD\nIOCDIRS += OLDER\n\nall:\n")
+
+            modified = add_to_makefile_lists(
+                tmpdir, {"IOCDIRS": ["NEW1", "OLD", "NEW2"], "SUPPDIRS": ["S"]}
+            )
+
+            with open(makefile) as f:
+                content = f.read()
+
+        self.assertTrue(modified)
+        self.assertEqual(
+            content,
+            "IOCDIRS = OLD\nIOCDIRS += OLDER\nIOCDIRS += NEW1\n"
+            "IOCDIRS += NEW2\n\nall:\nSUPPDIRS += S\n",
+        )
+
+
+class StagedOutputTests(TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.root = os.path.join(self._tmpdir.name, "root")
+        os.makedirs(self.root)
+        self.existing_file = os.path.join(self.root, "Makefile")
+        with open(self.existing_file, "wb") as f:
+            f.write(b"old")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_GIVEN_staged_output_WHEN_writing_files_THEN_files_are_published_only_after_block(
+        self,
+    ):
+        # Arrange
+        new_file = os.path.join(self.root, "new_dir", "sub_dir", "file")
+
+        # Act
+        with staged_output(self.root):
+            write_file(new_file, b"new")
+            write_file(self.existing_file, b"changed")
+
+            # Assert
+            self.assertFalse(os.path.exists(new_file))
+            self.assertEqual(read_file(self.existing_file), b"changed")
+            with open(self.existing_file, "rb") as f:
+                self.assertEqual(f.read(), b"old")
+
+        # Assert
+        with open(new_file, "rb") as f:
+            self.assertEqual(f.read(), b"new")
+        with open(self.existing_file, "rb") as f:
+            self.assertEqual(f.read(), b"changed")
+        self.assertEqual(os.listdir(self._tmpdir.name), ["root"])
+
+    def test_GIVEN_staged_output_WHEN_block_raises_THEN_nothing_is_published(
+        self,
+    ):
+        # Act
+        with self.assertRaises(RuntimeError):
+            with staged_output(self.root):
+                write_file(os.path.join(self.root, "new_file"), b"new")
+                write_file(self.existing_file, b"changed")
+                raise RuntimeError()
+
+        # Assert
+        self.assertEqual(os.listdir(self.root), ["Makefile"])
+        with open(self.existing_file, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self._tmpdir.name), ["root"])
+
+    def test_GIVEN_root_in_repository_WHEN_staging_THEN_stage_is_outside_repository(
+        self,
+    ):
+        # Arrange
+        os.makedirs(os.path.join(self.root, ".git"))
+        sub_root = os.path.join(self.root, "base")
+
+        # Act
+        with staged_output(sub_root):
+            write_file(os.path.join(sub_root, "file"), b"new")
+
+            # Assert
+            self.assertEqual(len(os.listdir(self._tmpdir.name)), 2)
+            self.assertCountEqual(os.listdir(self.root), [".git", "Makefile"])
+
+        self.assertEqual(os.listdir(self._tmpdir.name), ["root"])
+
+    @skipIf(os.name == "nt", "file modes are not kept on Windows")
+    def test_GIVEN_executable_file_WHEN_staged_file_replaces_it_THEN_mode_is_kept(
+        self,
+    ):
+        # Arrange
+        os.chmod(self.existing_file, 0o755)
+        source = Path(self._tmpdir.name, "source")
+        source.write_bytes(b"copied")
+
+        # Act
+        with staged_output(self.root):
+            write_file(self.existing_file, b"changed")
+        mode_after_write = stat.S_IMODE(os.stat(self.existing_file).st_mode)
+        with staged_output(self.root):
+            copy_file(source, self.existing_file)
+
+        # Assert
+        self.assertEqual(mode_after_write, 0o755)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(self.existing_file).st_mode), 0o755
+        )
+        with open(self.existing_file, "rb") as f:
+            self.assertEqual(f.read(), b"copied")
+
+    def test_GIVEN_copy_fails_WHEN_copying_file_THEN_target_is_untouched(
+        self,
+    ):
+        # Arrange
+        source = Path(self._tmpdir.name, "source")
+        source.write_bytes(b"copied")
+
+        # Act
+        with patch("shutil.copyfile", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                copy_file(source, self.existing_file)
+
+        # Assert
+        self.assertEqual(os.listdir(self.root), ["Makefile"])
+        with open(self.existing_file, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+
+    def test_GIVEN_stages_of_dead_and_running_processes_WHEN_removing_stale_stages_THEN_only_dead_stage_is_removed(
+        self,
+    ):
+        # Arrange
+        host = socket.gethostname()
+        running = f".ibex_device_generator-stage-{host}-{os.getpid()}-abc"
+        dead = f".ibex_device_generator-stage-{host}-123-abc"
+        for name in (running, dead):
+            os.makedirs(os.path.join(self._tmpdir.name, name, "file"))
+
+        # Act
+        with patch.object(
+            file_system,
+            "is_process_running",
+            side_effect=lambda pid: pid == os.getpid(),
+        ):
+            remove_stale_stages(self.root)
+
+        # Assert
+        self.assertCountEqual(os.listdir(self._tmpdir.name), ["root", running])
+
+    def test_GIVEN_same_content_WHEN_writing_file_THEN_file_is_unchanged(
+        self,
+    ):
+        # Act
+        status = write_file(self.existing_file, b"old")
+
+        # Assert
+        self.assertEqual(status, FileStatus.UNCHANGED)
+
+
+class LockedTests(TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.root = self._tmpdir.name
+        self.makefile = os.path.join(self.root, "Makefile")
+        with open(self.makefile, "w") as f:
+            f.write("IOCDIRS = OLD\n")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _entries(self) -> list[str]:
+        with open(self.makefile) as f:
+            return [line.split()[-1] for line in f]
+
+    def test_GIVEN_many_processes_WHEN_adding_to_makefile_list_THEN_no_entry_is_lost(
+        self,
+    ):
+        entries = [f"IOC{i}" for i in range(8)]
+
+        with ProcessPoolExecutor(4) as executor:
+            list(
+                executor.map(
+                    add_to_makefile_list,
+                    [self.root] * len(entries),
+                    ["IOCDIRS"] * len(entries),
+                    entries,
+                )
+            )
+
+        self.assertCountEqual(self._entries(), ["OLD"] + entries)
+
+    def test_GIVEN_staged_update_WHEN_another_update_is_made_THEN_it_waits_for_publishing(
+        self,
+    ):
+        other_update = Thread(
+            target=add_to_makefile_list, args=(self.root, "IOCDIRS", "OTHER")
+        )
+
+        with staged_output(self.root):
+            add_to_makefile_list(self.root, "IOCDIRS", "STAGED")
+            other_update.start()
+            other_update.join(0.2)
+
+            self.assertTrue(other_update.is_alive())
+
+        other_update.join()
+        self.assertEqual(self._entries(), ["OLD", "STAGED", "OTHER"])
+
+    def test_GIVEN_no_fcntl_WHEN_lock_is_released_THEN_lock_file_is_removed(
+        self,
+    ):
+        with patch.object(locks, "fcntl", None):
+            lock = locks.FileLock(self.makefile)
+            with lock:
+                self.assertTrue(os.path.exists(lock.lock_path))
+
+            self.assertFalse(os.path.exists(lock.lock_path))
+
+    def _write_lock_file(self, lock: locks.FileLock, pid: int) -> None:
+        os.makedirs(locks.LOCK_DIR, exist_ok=True)
+        with open(lock.lock_path, "w") as f:
+            f.write(f"{socket.gethostname()}\n{pid}\n")
+        # Older than any time limit
+        os.utime(lock.lock_path, (0, 0))
+
+    def test_GIVEN_no_fcntl_WHEN_lock_holder_died_THEN_lock_is_broken(
+        self,
+    ):
+        with patch.object(locks, "fcntl", None), patch.object(
+            locks, "is_process_running", return_value=False
+        ):
+            lock = locks.FileLock(self.makefile)
+            self._write_lock_file(lock, 123)
+
+            with lock:
+                with open(lock.lock_path) as f:
+                    self.assertEqual(
+                        f.read(), f"{socket.gethostname()}\n{os.getpid()}\n"
+                    )
+
+    def test_GIVEN_no_fcntl_WHEN_old_lock_is_still_held_THEN_lock_is_not_broken(
+        self,
+    ):
+        with patch.object(locks, "fcntl", None):
+            lock = locks.FileLock(self.makefile)
+            self._write_lock_file(lock, os.getpid())
+            acquire = Thread(target=lock.acquire, daemon=True)
+
+            acquire.start()
+            acquire.join(0.2)
+
+            self.assertTrue(acquire.is_alive())
+            os.remove(lock.lock_path)
+            acquire.join()
+            lock.release()
+
+
+class InMemoryOutputTests(TestCase):
+    def test_GIVEN_in_memory_output_WHEN_writing_files_THEN_disk_is_untouched_and_changes_are_reported(
+        self,
+    ):
+        with TemporaryDirectory() as tmpdir:
+            # Arrange
+            existing_file = os.path.join(tmpdir, "Makefile")
+            new_file = os.path.join(tmpdir, "new_dir", "file")
+            with open(existing_file, "wb") as f:
+                f.write(b"DIRS += A\n")
+
+            # Act
+            with in_memory_output() as overlay:
+                with staged_output(tmpdir):
+                    write_file(existing_file, b"DIRS += A\nDIRS += B\n")
+                    write_file(new_file, b"new")
+
+            # Assert
+            self.assertEqual(os.listdir(tmpdir), ["Makefile"])
+            with open(existing_file, "rb") as f:
+                self.assertEqual(f.read(), b"DIRS += A\n")
+
+            changes = overlay.changes()
+            self.assertEqual(changes.added, [new_file])
+            self.assertEqual(changes.modified, [existing_file])
+            self.assertIn("+DIRS += B", overlay.diff())
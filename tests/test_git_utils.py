@@ -1,15 +1,29 @@
 # ruff: noqa: ANN201, D100, D101, D102
 
 import os
+import shutil
+from pathlib import Path
 from tempfile import TemporaryDirectory
-from unittest import TestCase
+from unittest import TestCase, skipIf
+from unittest.mock import patch
 
 from git import Repo
 from ibex_device_generator.exc import (
     CannotOpenRepoError,
     FailedToSwitchBranchError,
+    NothingToCommitError,
+)
+from ibex_device_generator.utils import git_utils
+from ibex_device_generator.utils.file_system import FileChanges
+from ibex_device_generator.utils.git_utils import (
+    DirtyCheck,
+    RepoWrapper,
+    SubmoduleOptions,
+    close_repos,
+    commit_changes,
+    get_repo,
+    init_bare_repo,
 )
-from ibex_device_generator.utils.git_utils import RepoWrapper, commit_changes
 
 
 class GitUtilTests(TestCase):
@@ -41,3 +55,315 @@ class GitUtilTests(TestCase):
             with self.assertRaises(FailedToSwitchBranchError):
                 with commit_changes(tmpdir, "mustafa", "Commit message"):
                     pass
+
+    def test_repo_handle_is_shared_for_the_same_directory(self):
+        with TemporaryDirectory() as tmpdir:
+            Repo.init(tmpdir)
+            link = os.path.join(tmpdir, "link")
+            os.symlink(tmpdir, link)
+            try:
+                self.assertIs(get_repo(tmpdir), get_repo(link))
+                self.assertIs(
+                    get_repo(tmpdir), get_repo(os.path.join(link, ""))
+                )
+            finally:
+                close_repos()
+
+    def test_repo_handle_is_reopened_after_closing_all(self):
+        with TemporaryDirectory() as tmpdir:
+            Repo.init(tmpdir)
+            try:
+                repo = get_repo(tmpdir)
+                close_repos()
+                self.assertIsNot(get_repo(tmpdir), repo)
+            finally:
+                close_repos()
+
+    def test_repo_handle_is_reopened_if_repo_was_removed(self):
+        with TemporaryDirectory() as tmpdir:
+            Repo.init(tmpdir)
+            try:
+                repo = get_repo(tmpdir)
+                shutil.rmtree(os.path.join(tmpdir, ".git"))
+                with self.assertRaises(CannotOpenRepoError):
+                    get_repo(tmpdir)
+                Repo.init(tmpdir)
+                self.assertIsNot(get_repo(tmpdir), repo)
+            finally:
+                close_repos()
+
+    def _repo_with_file(
+        self, tmpdir: str, dirty_check: DirtyCheck
+    ) -> RepoWrapper:
+        repo = RepoWrapper(tmpdir, init=True, dirty_check=dirty_check)
+        with repo.config_writer() as config:
+            config.set_value("user", "name", "Test")
+            config.set_value("user", "email", "test@example.com")
+        os.makedirs(os.path.join(tmpdir, "scope"))
+        with open(os.path.join(tmpdir, "scope", "tracked"), "w") as f:
+            f.write("tracked")
+        repo.index.add(["scope/tracked"])
+        repo.index.commit("Add tracked file")
+        return repo
+
+    def test_scoped_dirty_check_ignores_changes_outside_paths(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.SCOPED)
+            with open(os.path.join(tmpdir, "other"), "w") as f:
+                f.write("untracked")
+
+            self.assertFalse(repo.is_dirty_in([os.path.join(tmpdir, "scope")]))
+            self.assertTrue(repo.is_dirty_in())
+
+    def test_scoped_dirty_check_finds_changes_in_paths(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.SCOPED)
+            scope = os.path.join(tmpdir, "scope")
+
+            with open(os.path.join(scope, "untracked"), "w") as f:
+                f.write("untracked")
+            self.assertTrue(repo.is_dirty_in([scope]))
+
+            os.remove(os.path.join(scope, "untracked"))
+            with open(os.path.join(scope, "tracked"), "w") as f:
+                f.write("modified")
+            self.assertTrue(repo.is_dirty_in([scope]))
+
+    def test_full_dirty_check_finds_changes_outside_paths(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.FULL)
+            with open(os.path.join(tmpdir, "other"), "w") as f:
+                f.write("untracked")
+
+            self.assertTrue(repo.is_dirty_in([os.path.join(tmpdir, "scope")]))
+
+    def test_repo_handle_uses_dirty_check_of_its_path(self):
+        with TemporaryDirectory() as tmpdir:
+            Repo.init(tmpdir)
+            try:
+                with patch.object(
+                    git_utils, "DIRTY_CHECKS", {tmpdir: DirtyCheck.SCOPED}
+                ):
+                    self.assertIs(
+                        get_repo(tmpdir).dirty_check, DirtyCheck.SCOPED
+                    )
+            finally:
+                close_repos()
+
+    def test_commit_only_includes_changed_files(self):
+        with TemporaryDirectory() as tmpdir, TemporaryDirectory() as other:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.SCOPED)
+            scope = os.path.join(tmpdir, "scope")
+            changes = FileChanges()
+            try:
+                with commit_changes(
+                    tmpdir, "ticket", "Commit message", [scope], changes
+                ):
+                    with open(os.path.join(tmpdir, "unrelated"), "w") as f:
+                        f.write("unrelated")
+                    for name in ("new file", "[glob]"):
+                        with open(os.path.join(scope, name), "w") as f:
+                            f.write(name)
+                        changes.added.append(os.path.join(scope, name))
+                    changes.added.append(os.path.join(other, "outside"))
+            finally:
+                close_repos()
+
+            self.assertCountEqual(
+                repo.head.commit.stats.files,
+                ["scope/new file", "scope/[glob]"],
+            )
+            self.assertEqual(repo.untracked_files, ["unrelated"])
+
+    def test_commit_fails_if_changed_files_are_unchanged(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.FULL)
+            with open(os.path.join(tmpdir, "unrelated"), "w") as f:
+                f.write("unrelated")
+
+            with self.assertRaises(NothingToCommitError):
+                repo.commit_all(
+                    "Commit message",
+                    [os.path.join(tmpdir, "scope", "tracked")],
+                )
+
+    def test_commit_files_commits_only_given_files(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.FULL)
+            repo.switch("ticket")
+            with open(os.path.join(tmpdir, "unrelated"), "w") as f:
+                f.write("unrelated")
+            script = os.path.join(tmpdir, "scope", "run.sh")
+            with open(script, "w") as f:
+                f.write("#!/bin/sh")
+            os.chmod(script, 0o755)
+            tracked = os.path.join(tmpdir, "scope", "tracked")
+            with open(tracked, "w") as f:
+                f.write("modified")
+
+            repo.commit_files("Commit message", [script, tracked])
+
+            commit = repo.head.commit
+            self.assertEqual(str(repo.active_branch), "ticket")
+            self.assertEqual(commit.message, "Commit message")
+            self.assertCountEqual(
+                commit.stats.files, ["scope/run.sh", "scope/tracked"]
+            )
+            self.assertEqual(commit.tree["scope/run.sh"].mode, 0o100755)
+            self.assertEqual(
+                commit.tree["scope/tracked"].data_stream.read(), b"modified"
+            )
+            self.assertFalse(repo.is_dirty())
+            self.assertEqual(repo.untracked_files, ["unrelated"])
+
+    def test_commit_files_makes_first_commit(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = RepoWrapper(tmpdir, init=True)
+            with repo.config_writer() as config:
+                config.set_value("user", "name", "Test")
+                config.set_value("user", "email", "test@example.com")
+            with open(os.path.join(tmpdir, "README.md"), "w") as f:
+                f.write("Hello there.")
+
+            repo.commit_files(
+                "Commit message", [os.path.join(tmpdir, "README.md")]
+            )
+
+            self.assertEqual(repo.head.commit.parents, ())
+            self.assertEqual(
+                repo.head.commit.stats.files.keys(), {"README.md"}
+            )
+
+    @skipIf(os.name == "nt", "file names cannot contain newlines")
+    def test_commit_files_commits_paths_with_newlines(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.FULL)
+            odd = os.path.join(tmpdir, "scope", "new\nline")
+            with open(odd, "w") as f:
+                f.write("odd")
+            tracked = os.path.join(tmpdir, "scope", "tracked")
+            with open(tracked, "w") as f:
+                f.write("modified")
+
+            repo.commit_files("Commit message", [odd, tracked])
+
+            commit = repo.head.commit
+            self.assertEqual(
+                commit.tree["scope/new\nline"].data_stream.read(), b"odd"
+            )
+            self.assertEqual(
+                commit.tree["scope/tracked"].data_stream.read(), b"modified"
+            )
+
+    def test_commit_files_fails_if_files_are_unchanged(self):
+        with TemporaryDirectory() as tmpdir:
+            repo = self._repo_with_file(tmpdir, DirtyCheck.FULL)
+
+            with self.assertRaises(NothingToCommitError):
+                repo.commit_files(
+                    "Commit message",
+                    [os.path.join(tmpdir, "scope", "tracked")],
+                )
+
+
+class SubmoduleTests(TestCase):
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+        # Allow cloning local repositories as submodules
+        self._env = patch.dict(
+            os.environ,
+            {
+                "GIT_AUTHOR_NAME": "Test",
+                "GIT_AUTHOR_EMAIL": "test@example.com",
+                "GIT_COMMITTER_NAME": "Test",
+                "GIT_COMMITTER_EMAIL": "test@example.com",
+                "GIT_CONFIG_COUNT": "1",
+                "GIT_CONFIG_KEY_0": "protocol.file.allow",
+                "GIT_CONFIG_VALUE_0": "always",
+            },
+        )
+        self._env.start()
+        self.top = RepoWrapper(os.path.join(self.tmpdir, "top"), init=True)
+        self.mirror_dir = os.path.join(self.tmpdir, "mirrors")
+        self.sub_path = os.path.join(self.tmpdir, "top", "support", "dev")
+
+    def tearDown(self):
+        self.top.close()
+        self._env.stop()
+        self._tmpdir.cleanup()
+
+    def _upstream(self, commits: int) -> str:
+        path = os.path.join(self.tmpdir, "upstream.git")
+        init_bare_repo(path)
+        work = Repo.clone_from(path, os.path.join(self.tmpdir, "work"))
+        for i in range(commits):
+            with open(os.path.join(work.working_dir, "file"), "w") as f:
+                f.write(str(i))
+            work.index.add(["file"])
+            work.index.commit(f"Commit {i}")
+        work.remote().push("main")
+        work.close()
+        return Path(path).as_uri()
+
+    def test_submodule_is_added_from_url(self):
+        url = self._upstream(1)
+
+        self.top.create_submodule("dev", url, self.sub_path)
+
+        sub = Repo(self.sub_path)
+        self.assertEqual(sub.head.commit.message, "Commit 0")
+        self.assertEqual(len(list(sub.iter_commits())), 2)
+        sub.close()
+
+    def test_submodule_is_cloned_shallow_and_partial(self):
+        url = self._upstream(2)
+
+        self.top.create_submodule(
+            "dev", url, self.sub_path, SubmoduleOptions(1, "blob:none")
+        )
+
+        sub = Repo(self.sub_path)
+        self.assertEqual(len(list(sub.iter_commits())), 1)
+        self.assertEqual(
+            sub.git.config("remote.origin.partialclonefilter"), "blob:none"
+        )
+        self.assertEqual(sub.remote().url, url)
+        sub.close()
+        self.assertEqual(
+            self.top.git.config("-f", ".gitmodules", "submodule.dev.url"), url
+        )
+        # The submodule's git directory is in the parent repository
+        self.assertTrue(os.path.isfile(os.path.join(self.sub_path, ".git")))
+
+    def test_submodule_is_added_offline_from_new_mirror(self):
+        url = "https://github.com/ISISComputingGroup/EPICS-dev.git"
+        options = SubmoduleOptions(mirror_dir=self.mirror_dir, offline=True)
+
+        self.top.create_submodule("dev", url, self.sub_path, options)
+
+        self.assertTrue(
+            os.path.isdir(os.path.join(self.mirror_dir, "EPICS-dev.git"))
+        )
+        sub = Repo(self.sub_path)
+        self.assertEqual(sub.head.commit.message, "Initial commit")
+        self.assertEqual(sub.remote().url, url)
+        sub.close()
+        self.assertEqual(
+            self.top.git.config("-f", ".gitmodules", "submodule.dev.url"), url
+        )
+        self.assertIn(
+            "support/dev", self.top.git.diff("--cached", "--name-only")
+        )
+
+    def test_mirror_is_named_like_repository(self):
+        options = SubmoduleOptions(mirror_dir="mirrors")
+
+        self.assertEqual(
+            options.mirror_of("https://github.com/Group/EPICS-dev.git"),
+            os.path.join("mirrors", "EPICS-dev.git"),
+        )
+        self.assertEqual(
+            options.mirror_of("https://github.com/Group/EPICS-dev"),
+            os.path.join("mirrors", "EPICS-dev.git"),
+        )
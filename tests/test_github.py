@@ -0,0 +1,190 @@
+"""Test GitHub API requests against a local stand-in server."""
+
+import os
+import time
+from tempfile import TemporaryDirectory
+from threading import Barrier
+from unittest import TestCase
+from unittest.mock import patch
+
+import ibex_device_generator.utils.github as github
+import ibex_device_generator.utils.github_session as github_session
+from ibex_device_generator.exc import FailedToGrantPermissionError
+from ibex_device_generator.utils.arg_parser import parse_arguments
+from ibex_device_generator.utils.batch import BatchEntry, run_batch
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.github import (
+    TEAM_PERMISSIONS,
+    does_github_issue_exist_and_is_open,
+    grant_permissions_for_github_repository,
+)
+from ibex_device_generator.utils.github_session import _RateLimit
+from requests.structures import CaseInsensitiveDict
+
+from tests.github_stand_in import GitHubStandIn
+
+ISSUE_PATH = "/repos/ISISComputingGroup/IBEX/issues/%d"
+TEAM_PATH = "/orgs/ISISComputingGroup/teams/%s/repos/ISISComputingGroup/%s"
+
+
+class GitHubTests(TestCase):
+    """Test the GitHub helpers."""
+
+    def setUp(self) -> None:
+        """Start a stand-in server for the GitHub API with an empty cache."""
+        self.github = GitHubStandIn().__enter__()
+        self._tmpdir = TemporaryDirectory()
+        self._patches = [
+            patch.object(github, "GITHUB_API_URL", self.github.url),
+            patch.object(
+                github_session,
+                "GITHUB_CACHE_DIR",
+                os.path.join(self._tmpdir.name, "github"),
+            ),
+        ]
+        for p in self._patches:
+            p.start()
+        self.device = DeviceInfo("ND1", "New Device")
+
+    def tearDown(self) -> None:
+        """Stop the stand-in server and remove the cache."""
+        for p in self._patches:
+            p.stop()
+        self.github.__exit__(None, None, None)
+        self._tmpdir.cleanup()
+
+    def _respond_to_grants(self, status: int) -> None:
+        for team_name in TEAM_PERMISSIONS:
+            self.github.respond(
+                "PUT", TEAM_PATH % (team_name, "EPICS-New_Device"), status
+            )
+
+    def test_issue_is_open(self) -> None:
+        """Check the state of issues."""
+        self.github.respond("GET", ISSUE_PATH % 1, 200, {"state": "open"})
+        self.github.respond("GET", ISSUE_PATH % 2, 200, {"state": "closed"})
+
+        self.assertTrue(does_github_issue_exist_and_is_open(1))
+        self.assertFalse(does_github_issue_exist_and_is_open(2))
+        self.assertFalse(does_github_issue_exist_and_is_open(3))
+
+    def test_issue_check_is_authenticated_with_token(self) -> None:
+        """Check that the token is used to check issues."""
+        self.github.respond("GET", ISSUE_PATH % 1, 200, {"state": "open"})
+
+        does_github_issue_exist_and_is_open(1, "token")
+
+        self.assertEqual(
+            self.github.requests[0]["headers"]["Authorization"], "Bearer token"
+        )
+
+    def test_unchanged_issue_is_answered_from_cache(self) -> None:
+        """Check that GET responses are revalidated with their ETag."""
+        self.github.respond(
+            "GET", ISSUE_PATH % 1, 200, {"state": "open"}, {"ETag": '"v1"'}
+        )
+        self.github.respond("GET", ISSUE_PATH % 1, 304)
+
+        self.assertTrue(does_github_issue_exist_and_is_open(1))
+        self.assertTrue(does_github_issue_exist_and_is_open(1))
+
+        self.assertNotIn("If-None-Match", self.github.requests[0]["headers"])
+        self.assertEqual(
+            self.github.requests[1]["headers"]["If-None-Match"], '"v1"'
+        )
+
+    def test_server_errors_are_retried(self) -> None:
+        """Check that a request is retried after a server error."""
+        self.github.respond("GET", ISSUE_PATH % 1, 503)
+        self.github.respond("GET", ISSUE_PATH % 1, 200, {"state": "open"})
+
+        self.assertTrue(does_github_issue_exist_and_is_open(1))
+        self.assertEqual(len(self.github.requests), 2)
+
+    def test_secondary_rate_limit_is_retried(self) -> None:
+        """Check that a rate limited request is retried after waiting."""
+        self.github.respond(
+            "GET", ISSUE_PATH % 1, 403, headers={"Retry-After": "0"}
+        )
+        self.github.respond("GET", ISSUE_PATH % 1, 200, {"state": "open"})
+
+        self.assertTrue(does_github_issue_exist_and_is_open(1))
+
+    def test_permissions_are_granted_concurrently(self) -> None:
+        """Check that all teams are granted permissions at the same time."""
+        self._respond_to_grants(204)
+        barrier = Barrier(len(TEAM_PERMISSIONS), timeout=5)
+        self.github.on_request = lambda method, path: barrier.wait()
+
+        grant_permissions_for_github_repository(self.device, "token")
+
+        self.assertCountEqual(
+            [
+                request["json"]["permission"]
+                for request in self.github.requests
+            ],
+            TEAM_PERMISSIONS.values(),
+        )
+        for request in self.github.requests:
+            self.assertEqual(
+                request["headers"]["Authorization"], "Bearer token"
+            )
+
+    def test_failed_grant_raises_error(self) -> None:
+        """Check that failing to grant a permission is reported."""
+        self._respond_to_grants(404)
+
+        with self.assertRaises(FailedToGrantPermissionError):
+            grant_permissions_for_github_repository(self.device, "token")
+
+    def test_dry_run_makes_no_requests(self) -> None:
+        """Check that GitHub is not used to check tickets in a dry run."""
+        with patch(
+            "ibex_device_generator.utils.batch.IBEXDeviceGenerator"
+        ) as generator:
+            parse_arguments(["ND1", "1", "--dry_run"])
+            results = run_batch(
+                [BatchEntry("ND1", 1, "New Device")], dry_run=True
+            )
+
+        self.assertTrue(results[0].succeeded)
+        generator.return_value.run.assert_called()
+        self.assertEqual(self.github.requests, [])
+
+
+class RateLimitTests(TestCase):
+    """Test pacing requests by GitHub's rate limit."""
+
+    def _rate_limit(self, remaining: int, reset_in: float) -> _RateLimit:
+        rate_limit = _RateLimit()
+        rate_limit.update(
+            CaseInsensitiveDict(
+                {
+                    "X-RateLimit-Limit": "100",
+                    "X-RateLimit-Remaining": str(remaining),
+                    "X-RateLimit-Reset": str(time.time() + reset_in),
+                }
+            )
+        )
+        return rate_limit
+
+    def test_unknown_limit_does_not_wait(self) -> None:
+        """Check that requests are sent before the limit is known."""
+        self.assertEqual(_RateLimit().acquire(), 0)
+
+    def test_plenty_of_requests_left_does_not_wait(self) -> None:
+        """Check that requests are not paced with most of the limit left."""
+        self.assertEqual(self._rate_limit(50, 60).acquire(), 0)
+
+    def test_few_requests_left_are_spread_over_window(self) -> None:
+        """Check that the last requests are spread until the reset."""
+        rate_limit = self._rate_limit(5, 60)
+
+        self.assertAlmostEqual(rate_limit.acquire(), 12, delta=0.5)
+        self.assertAlmostEqual(rate_limit.acquire(), 15, delta=0.5)
+
+    def test_exhausted_limit_waits_for_reset(self) -> None:
+        """Check that no requests are sent until the limit resets."""
+        self.assertAlmostEqual(
+            self._rate_limit(0, 30).acquire(), 30, delta=0.5
+        )
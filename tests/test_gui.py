@@ -0,0 +1,156 @@
+"""Test adding device screens to opi_info.xml."""
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import ibex_device_generator.utils.gui as gui
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.gui import (
+    DuplicateOPIKeyError,
+    add_device_opi_to_opi_info,
+    add_device_opis_to_opi_info,
+    get_opi_keys,
+    is_opi_key_taken,
+)
+from lxml import etree
+
+OPI_INFO_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<opiDescriptions>
+  <opis>
+    <entry>
+      <key>OLD</key>
+      <value>
+        <type>UNKNOWN</type>
+        <path>old.opi</path>
+      </value>
+    </entry>
+  </opis>
+</opiDescriptions>
+"""
+
+
+class OPIInfoTestCase(TestCase):
+    """Set up an opi_info.xml file and an OPI key index directory."""
+
+    def setUp(self) -> None:
+        """Write an opi_info.xml file with a single entry."""
+        self._tmpdir = TemporaryDirectory()
+        self.opi_info = os.path.join(self._tmpdir.name, "opi_info.xml")
+        with open(self.opi_info, "w") as f:
+            f.write(OPI_INFO_XML)
+
+        index_dir = os.path.join(self._tmpdir.name, "index")
+        self._patch = patch.object(gui, "OPI_KEY_INDEX_DIR", index_dir)
+        self._patch.start()
+
+    def tearDown(self) -> None:
+        """Remove opi_info.xml and the index."""
+        self._patch.stop()
+        self._tmpdir.cleanup()
+
+
+class OPIInfoTests(OPIInfoTestCase):
+    """Test opi_info.xml updates."""
+
+    def _opi_keys(self) -> list[str]:
+        return [
+            key.text
+            for key in etree.parse(self.opi_info).findall("opis/entry/key")
+        ]
+
+    def test_add_device_opi(self) -> None:
+        """Check that an entry is added for a device."""
+        add_device_opi_to_opi_info(DeviceInfo("NEW", "New"), self.opi_info)
+
+        self.assertEqual(self._opi_keys(), ["OLD", "NEW"])
+
+    def test_streaming_insert_keeps_existing_bytes(self) -> None:
+        """Check that only the new entry is added to the file."""
+        add_device_opi_to_opi_info(DeviceInfo("NEW", "New"), self.opi_info)
+
+        with open(self.opi_info) as f:
+            content = f.read()
+
+        closing_tag = OPI_INFO_XML.index("  </opis>")
+        self.assertTrue(content.startswith(OPI_INFO_XML[:closing_tag]))
+        self.assertTrue(content.endswith(OPI_INFO_XML[closing_tag:]))
+        self.assertIn("\n    <entry>\n      <key>NEW</key>\n", content)
+
+    def test_streaming_and_rewriting_give_same_entries(self) -> None:
+        """Check both insertion modes against each other."""
+        add_device_opis_to_opi_info(
+            [DeviceInfo("NEW", "New")], self.opi_info, streaming=False
+        )
+        rewritten = etree.tostring(etree.parse(self.opi_info))
+
+        with open(self.opi_info, "w") as f:
+            f.write(OPI_INFO_XML)
+        add_device_opis_to_opi_info([DeviceInfo("NEW", "New")], self.opi_info)
+        streamed = etree.tostring(etree.parse(self.opi_info))
+
+        parser = etree.XMLParser(remove_blank_text=True)
+        self.assertEqual(
+            etree.tostring(etree.fromstring(streamed, parser)),
+            etree.tostring(etree.fromstring(rewritten, parser)),
+        )
+
+    def test_add_device_opi_with_existing_key_raises_error(self) -> None:
+        """Check that OPI keys must be unique."""
+        with self.assertRaises(DuplicateOPIKeyError):
+            add_device_opi_to_opi_info(DeviceInfo("OLD", "Old"), self.opi_info)
+
+    def test_add_many_device_opis_reports_each_duplicate(self) -> None:
+        """Check that duplicates are skipped without stopping the batch."""
+        devices = [
+            DeviceInfo("OLD", "Old"),
+            DeviceInfo("NEW1", "New 1"),
+            DeviceInfo("NEW1", "New 1 again"),
+            DeviceInfo("NEW2", "New 2"),
+        ]
+
+        duplicates = add_device_opis_to_opi_info(devices, self.opi_info)
+
+        self.assertEqual(
+            [duplicate.opi_key for duplicate in duplicates], ["OLD", "NEW1"]
+        )
+        self.assertEqual(self._opi_keys(), ["OLD", "NEW1", "NEW2"])
+
+
+class OPIKeyIndexTests(OPIInfoTestCase):
+    """Test the cached index of OPI keys."""
+
+    def test_opi_key_taken(self) -> None:
+        """Check looking up OPI keys."""
+        self.assertTrue(is_opi_key_taken("OLD", self.opi_info))
+        self.assertFalse(is_opi_key_taken("NEW", self.opi_info))
+
+    def test_index_is_used_while_file_is_unchanged(self) -> None:
+        """Check that the file is not parsed again for a valid index."""
+        get_opi_keys(self.opi_info)
+
+        with patch.object(gui, "_read_opi_keys") as read_opi_keys:
+            self.assertEqual(get_opi_keys(self.opi_info), {"OLD"})
+            os.utime(self.opi_info, ns=(0, 0))
+            self.assertEqual(get_opi_keys(self.opi_info), {"OLD"})
+
+        read_opi_keys.assert_not_called()
+
+    def test_index_is_rebuilt_when_file_changes(self) -> None:
+        """Check that edits made outside the generator are picked up."""
+        get_opi_keys(self.opi_info)
+
+        with open(self.opi_info, "w") as f:
+            f.write(OPI_INFO_XML.replace("OLD", "EDITED"))
+
+        self.assertEqual(get_opi_keys(self.opi_info), {"EDITED"})
+
+    def test_index_is_updated_when_entries_are_added(self) -> None:
+        """Check that added OPIs are found without parsing the file."""
+        add_device_opi_to_opi_info(DeviceInfo("NEW", "New"), self.opi_info)
+
+        with patch.object(gui, "_read_opi_keys") as read_opi_keys:
+            self.assertTrue(is_opi_key_taken("NEW", self.opi_info))
+
+        read_opi_keys.assert_not_called()
@@ -0,0 +1,88 @@
+"""Test the journal of completed generator steps."""
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+import ibex_device_generator.utils.journal as journal
+from git import Repo
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.file_system import FileChanges, FileStatus
+from ibex_device_generator.utils.journal import StepJournal
+
+
+class StepJournalTests(TestCase):
+    """Test recording and resuming steps."""
+
+    def setUp(self) -> None:
+        """Use an empty journal directory and write a step output."""
+        self._tmpdir = TemporaryDirectory()
+        self._patch = patch.object(
+            journal, "JOURNAL_DIR", os.path.join(self._tmpdir.name, "journals")
+        )
+        self._patch.start()
+
+        self.device = DeviceInfo("ND1", "New Device")
+        self.output = os.path.join(self._tmpdir.name, "output")
+        with open(self.output, "w") as f:
+            f.write("output")
+        self.changes = FileChanges()
+        self.changes.record(self.output, FileStatus.ADDED)
+
+    def tearDown(self) -> None:
+        """Remove the journal and outputs."""
+        self._patch.stop()
+        self._tmpdir.cleanup()
+
+    def test_resumed_journal_has_completed_steps(self) -> None:
+        """Check that steps recorded by a previous run are complete."""
+        StepJournal(self.device, 1).record("step", None, self.changes, None)
+
+        resumed = StepJournal(self.device, 1, resume=True)
+
+        self.assertTrue(resumed.is_complete("step"))
+        self.assertFalse(resumed.is_complete("other step"))
+
+    def test_new_journal_has_no_completed_steps(self) -> None:
+        """Check that a run which is not resumed starts from scratch."""
+        StepJournal(self.device, 1).record("step", None, self.changes, None)
+
+        self.assertFalse(StepJournal(self.device, 1).is_complete("step"))
+        self.assertFalse(
+            StepJournal(self.device, 2, resume=True).is_complete("step")
+        )
+
+    def test_step_with_missing_output_is_not_complete(self) -> None:
+        """Check that a step runs again if its output was deleted."""
+        StepJournal(self.device, 1).record("step", None, self.changes, None)
+        os.remove(self.output)
+
+        resumed = StepJournal(self.device, 1, resume=True)
+
+        self.assertFalse(resumed.is_complete("step"))
+
+    def test_journal_of_different_device_is_ignored(self) -> None:
+        """Check that a journal is only resumed for the same device."""
+        StepJournal(self.device, 1).record("step", None, self.changes, None)
+
+        resumed = StepJournal(
+            DeviceInfo("ND1", "New Device", device_count=3), 1, resume=True
+        )
+
+        self.assertFalse(resumed.is_complete("step"))
+
+    def test_step_with_missing_commit_is_not_complete(self) -> None:
+        """Check that a step runs again if its commit is gone."""
+        repo_path = os.path.join(self._tmpdir.name, "repo")
+        repo = Repo.init(repo_path)
+        sha = repo.index.commit("Step").hexsha
+
+        steps = StepJournal(self.device, 1)
+        steps.record("committed", repo_path, None, sha)
+        steps.record("lost", repo_path, None, "0" * 40)
+
+        resumed = StepJournal(self.device, 1, resume=True)
+
+        self.assertTrue(resumed.is_complete("committed"))
+        self.assertFalse(resumed.is_complete("lost"))
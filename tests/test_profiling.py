@@ -0,0 +1,40 @@
+"""Test profiling generator steps."""
+
+import os
+import pstats
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ibex_device_generator.utils.profiling import StepProfiler
+
+
+def _busy() -> int:
+    return sum(i * i for i in range(10000))
+
+
+class StepProfilerTests(TestCase):
+    """Test writing the statistics of each step."""
+
+    def test_statistics_are_written_for_each_step(self) -> None:
+        """Check that every step gets its own statistics file."""
+        with TemporaryDirectory() as tmpdir:
+            profiler = StepProfiler(tmpdir, memory=True)
+
+            with self.assertLogs(level="INFO") as logs:
+                with profiler.profile("Add template IOC"):
+                    _busy()
+                with profiler.profile("Add OPI to gui"):
+                    pass
+
+            self.assertEqual(
+                sorted(os.listdir(tmpdir)),
+                ["01_add_template_ioc.pstats", "02_add_opi_to_gui.pstats"],
+            )
+            stats = pstats.Stats(
+                os.path.join(tmpdir, sorted(os.listdir(tmpdir))[0])
+            )
+
+        self.assertTrue(
+            any(function[2] == "_busy" for function in stats.stats)
+        )
+        self.assertIn("Peak memory allocated", logs.output[0])
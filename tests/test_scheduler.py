@@ -0,0 +1,120 @@
+"""Test scheduling generator steps by their dependencies."""
+
+from contextvars import ContextVar
+from threading import Barrier, Lock
+from unittest import TestCase
+
+from ibex_device_generator.utils.scheduler import (
+    Step,
+    run_concurrently,
+    step_dependencies,
+)
+
+_context_value: ContextVar[str] = ContextVar("context_value", default="")
+
+
+def first() -> None:
+    """Do nothing."""
+
+
+def second() -> None:
+    """Do nothing."""
+
+
+def third() -> None:
+    """Do nothing."""
+
+
+class SchedulerTests(TestCase):
+    """Test running steps concurrently."""
+
+    def setUp(self) -> None:
+        """Set up a record of the steps that ran."""
+        self.ran: list[str] = []
+        self._lock = Lock()
+
+    def _record(self, step: Step) -> None:
+        step.action()
+        with self._lock:
+            self.ran.append(step.name)
+
+    def test_steps_in_same_repo_depend_on_previous_one(self) -> None:
+        """Check that steps modifying a repository stay in order."""
+        steps = [
+            Step("first", "repo", first),
+            Step("second", None, second, after=(first,)),
+            Step("third", "repo", third),
+        ]
+
+        self.assertEqual(step_dependencies(steps), {0: set(), 1: {0}, 2: {0}})
+
+    def test_dependencies_on_missing_steps_are_ignored(self) -> None:
+        """Check that a step can depend on a skipped step."""
+        steps = [Step("second", None, second, after=(first,))]
+
+        self.assertEqual(step_dependencies(steps), {0: set()})
+
+    def test_dependency_listed_later_raises_error(self) -> None:
+        """Check that steps must be listed after their dependencies."""
+        steps = [
+            Step("first", None, first, after=(second,)),
+            Step("second", None, second),
+        ]
+
+        with self.assertRaises(ValueError):
+            step_dependencies(steps)
+
+    def test_independent_steps_run_at_the_same_time(self) -> None:
+        """Check that independent steps do not wait for each other."""
+        barrier = Barrier(2, timeout=5)
+
+        def wait_for_second() -> None:
+            barrier.wait()
+
+        def wait_for_first() -> None:
+            barrier.wait()
+
+        steps = [
+            Step("first", "repo1", wait_for_second),
+            Step("second", "repo2", wait_for_first),
+            Step(
+                "third", None, third, after=(wait_for_second, wait_for_first)
+            ),
+        ]
+
+        run_concurrently(steps, self._record)
+
+        self.assertCountEqual(self.ran[:2], ["first", "second"])
+        self.assertEqual(self.ran[2], "third")
+
+    def test_failed_step_stops_dependent_steps(self) -> None:
+        """Check that steps after a failed step are not run."""
+
+        def fail() -> None:
+            raise RuntimeError("Failed.")
+
+        steps = [
+            Step("fail", "repo", fail),
+            Step("second", "repo", second),
+            Step("third", None, third, after=(fail,)),
+        ]
+
+        with self.assertRaises(RuntimeError):
+            run_concurrently(steps, self._record)
+
+        self.assertEqual(self.ran, [])
+
+    def test_steps_run_in_callers_context(self) -> None:
+        """Check that context variables are seen by every step."""
+        seen = []
+
+        def read_context() -> None:
+            seen.append(_context_value.get())
+
+        token = _context_value.set("caller")
+        try:
+            run_concurrently([Step("read", None, read_context)], self._record)
+        finally:
+            _context_value.reset(token)
+
+        self.assertEqual(seen, ["caller"])
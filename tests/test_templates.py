@@ -0,0 +1,217 @@
+"""Test template compilation and caching."""
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import ibex_device_generator.utils.placeholders as p
+from ibex_device_generator.utils.device_info import DeviceInfo
+from ibex_device_generator.utils.templates import (
+    CompiledTemplate,
+    DeviceTemplate,
+    TemplateFileCache,
+    build_template_manifest,
+    get_template,
+    get_template_manifest,
+    populate_template_dir,
+    populate_template_dir_for_each,
+    populate_template_file,
+)
+
+
+class CompiledTemplateTests(TestCase):
+    """Compiled templates must behave like `DeviceTemplate.substitute`."""
+
+    def setUp(self) -> None:
+        """Set up substitutions."""
+        self.substitutions = {"ioc": "ND1", "ioc_number": "02", "count": 3}
+
+    def test_render_matches_substitute(self) -> None:
+        """Check rendering against the standard library implementation."""
+        templates = [
+            "",
+            "no placeholders here",
+            "@ioc",
+            "@{ioc}-IOC-@{ioc_number}App",
+            "prefix @ioc, @@escaped @{count} suffix\n",
+            "@@@ioc@@",
+        ]
+
+        for template in templates:
+            self.assertEqual(
+                CompiledTemplate(template).render(self.substitutions),
+                DeviceTemplate(template).substitute(self.substitutions),
+                msg=f"Rendering of '{template}' is inconsistent.",
+            )
+
+    def test_placeholders(self) -> None:
+        """Check that placeholders are collected from the template."""
+        self.assertEqual(
+            CompiledTemplate("@{ioc}-IOC-@{ioc_number} @ioc @@x").placeholders,
+            {"ioc", "ioc_number"},
+        )
+
+    def test_partial_keeps_only_requested_placeholders(self) -> None:
+        """Check that a partially substituted template renders the same."""
+        template = "@@@{ioc}-IOC-@{ioc_number} @count@@"
+        partial = CompiledTemplate(template).partial(
+            self.substitutions, keep={"ioc_number"}
+        )
+
+        self.assertEqual(partial.placeholders, {"ioc_number"})
+        self.assertEqual(
+            partial.render({"ioc_number": "02"}),
+            DeviceTemplate(template).substitute(self.substitutions),
+        )
+        self.assertEqual(
+            DeviceTemplate(partial.template).substitute(ioc_number="02"),
+            partial.render({"ioc_number": "02"}),
+        )
+
+    def test_missing_substitution_raises_key_error(self) -> None:
+        """Check that missing placeholders are reported."""
+        with self.assertRaises(KeyError):
+            CompiledTemplate("@{unknown}").render(self.substitutions)
+
+    def test_invalid_placeholder_raises_value_error(self) -> None:
+        """Check that ill-formed placeholders are reported."""
+        with self.assertRaises(ValueError):
+            CompiledTemplate("line\n@ not valid")
+
+
+class TemplateFileCacheTests(TestCase):
+    """Test the compiled template file cache."""
+
+    def test_template_file_is_compiled_once(self) -> None:
+        """Check that the same compiled template is reused."""
+        cache = TemplateFileCache()
+        template = get_template(
+            "4", "support", "@device_", "master", "LICENCE"
+        )
+
+        self.assertIs(cache.get(template), cache.get(template))
+        self.assertEqual(len(cache), 1)
+
+    def test_cache_is_bounded(self) -> None:
+        """Check that least recently used templates are evicted."""
+        cache = TemplateFileCache(maxsize=2)
+        configure = get_template("5_1", "ioc", "master", "@ioc", "configure")
+        templates = list(configure.iterdir())[:3]
+
+        for template in templates:
+            cache.get(template)
+
+        self.assertEqual(len(cache), 2)
+
+
+class TemplateManifestTests(TestCase):
+    """Test the template manifest shipped with the package."""
+
+    def test_manifest_is_up_to_date(self) -> None:
+        """Check that the manifest matches the templates directory."""
+        self.assertEqual(
+            get_template_manifest(),
+            build_template_manifest(),
+            msg=(
+                "Template manifest is out of date, regenerate it with"
+                " 'python -m ibex_device_generator.utils.templates'."
+            ),
+        )
+
+    def test_manifest_excludes_ignored_dirs(self) -> None:
+        """Check that cached bytecode is not part of the templates."""
+        for path in get_template_manifest().files:
+            self.assertNotIn("__pycache__", path)
+
+    def test_get_missing_template_raises_error(self) -> None:
+        """Check that templates missing from the manifest are rejected."""
+        with self.assertRaises(ValueError):
+            get_template("does_not_exist")
+
+
+class PopulateTemplateTests(TestCase):
+    """Test populating templates on the disk."""
+
+    def test_static_files_are_copied_byte_for_byte(self) -> None:
+        """Check that files without placeholders are copied unchanged."""
+        with TemporaryDirectory() as tmpdir:
+            template = get_template(
+                "4", "support", "@device_", "master", "configure", "RELEASE"
+            )
+            destination = populate_template_file(template, tmpdir, {})
+
+            with open(destination, "rb") as f:
+                self.assertEqual(f.read(), template.read_bytes())
+
+    def test_populate_for_each_matches_populating_one_by_one(self) -> None:
+        """Check fan-out output against populating each index separately."""
+        device = DeviceInfo("ND1", "New Device 1", device_count=4)
+        indices = ["02", "03", "04"]
+
+        with TemporaryDirectory() as expected_dir:
+            expected_files = []
+            for index in indices:
+                substitutions = dict(device)
+                substitutions[p.INDEX] = index
+                expected_files.extend(
+                    populate_template_dir(
+                        get_template("5_2"), expected_dir, substitutions
+                    ).added
+                )
+            expected = _read_files(expected_dir, expected_files)
+
+        with TemporaryDirectory() as actual_dir:
+            actual_files = populate_template_dir_for_each(
+                get_template("5_2"), actual_dir, device, p.INDEX, indices
+            ).added
+            actual = _read_files(actual_dir, actual_files)
+
+        self.assertEqual(actual, expected)
+
+    def test_concurrent_writes_return_files_in_order(self) -> None:
+        """Check that a pool of writers gives the same result."""
+        device = DeviceInfo("ND1", "New Device 1")
+
+        with TemporaryDirectory() as expected_dir:
+            expected_files = populate_template_dir(
+                get_template("4"), expected_dir, device
+            ).added
+            expected = _read_files(expected_dir, expected_files)
+
+        with TemporaryDirectory() as actual_dir:
+            actual_files = populate_template_dir(
+                get_template("4"), actual_dir, device, jobs=4
+            ).added
+            actual = _read_files(actual_dir, actual_files)
+
+        self.assertEqual(actual, expected)
+
+    def test_repopulating_skips_unchanged_files(self) -> None:
+        """Check that files with the same content are not rewritten."""
+        device = DeviceInfo("ND1", "New Device 1")
+
+        with TemporaryDirectory() as tmpdir:
+            first = populate_template_dir(get_template("4"), tmpdir, device)
+            modified_file, *unchanged_files = first.added
+            mtimes = [os.stat(path).st_mtime_ns for path in unchanged_files]
+
+            with open(modified_file, "ab") as f:
+                f.write(b"local change")
+
+            changes = populate_template_dir(get_template("4"), tmpdir, device)
+
+            self.assertEqual(changes.added, [])
+            self.assertEqual(changes.modified, [modified_file])
+            self.assertEqual(changes.unchanged, unchanged_files)
+            self.assertEqual(
+                [os.stat(path).st_mtime_ns for path in unchanged_files],
+                mtimes,
+            )
+
+
+def _read_files(root: str, paths: list[str]) -> list[tuple[str, bytes]]:
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append((os.path.relpath(path, root), f.read()))
+    return contents
@@ -0,0 +1,76 @@
+"""Test tracing where a run spends its time."""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ibex_device_generator.utils.file_system import write_file
+from ibex_device_generator.utils.trace import (
+    BYTES_WRITTEN,
+    FILES_WRITTEN,
+    SUBPROCESSES,
+    count_subprocess,
+    span,
+    tracing,
+)
+
+
+class TracingTests(TestCase):
+    """Test recording spans as Chrome trace events."""
+
+    def test_counters_include_nested_spans(self) -> None:
+        """Check that I/O is counted for every enclosing span."""
+        with TemporaryDirectory() as tmpdir:
+            with tracing() as tracer:
+                with span("outer", "step", repo="repo"):
+                    write_file(os.path.join(tmpdir, "a"), b"abc")
+                    with span("inner", "templates"):
+                        write_file(os.path.join(tmpdir, "b"), b"de")
+                        count_subprocess()
+
+        events = {event["name"]: event for event in tracer.events}
+        self.assertEqual(
+            set(events), {"ibex_device_generator", "outer", "inner"}
+        )
+
+        outer = events["outer"]["args"]
+        self.assertEqual(outer["repo"], "repo")
+        self.assertEqual(outer[FILES_WRITTEN], 2)
+        self.assertEqual(outer[BYTES_WRITTEN], 5)
+        self.assertEqual(outer[SUBPROCESSES], 1)
+
+        inner = events["inner"]["args"]
+        self.assertEqual(inner[FILES_WRITTEN], 1)
+        self.assertEqual(inner[BYTES_WRITTEN], 2)
+
+    def test_trace_is_written_as_chrome_trace_events(self) -> None:
+        """Check the format of the trace file."""
+        with TemporaryDirectory() as tmpdir:
+            with tracing() as tracer:
+                with span("step", "step"):
+                    pass
+
+            trace_path = os.path.join(tmpdir, "trace.json")
+            tracer.write(trace_path)
+            with open(trace_path) as f:
+                trace = json.load(f)
+
+        for event in trace["traceEvents"]:
+            self.assertEqual(event["ph"], "X")
+            self.assertGreaterEqual(event["dur"], 0)
+            self.assertIn("ts", event)
+            self.assertIn("tid", event)
+
+    def test_spans_are_not_recorded_without_tracer(self) -> None:
+        """Check that spans do nothing outside of tracing."""
+        with tracing() as tracer:
+            pass
+
+        with span("untraced", "step"):
+            count_subprocess()
+
+        self.assertEqual(
+            [event["name"] for event in tracer.events],
+            ["ibex_device_generator"],
+        )